@@ -1,10 +1,10 @@
-from mmeval import COCODetection
 import json
 import os
 import numpy as np
 from registry.registry import DATASET_REGISTRY
 from collections import defaultdict
 from utils.ocr_utils import poly2bbox
+from utils.read_files import iter_json_array, page_selected
 import pdb
 
 @DATASET_REGISTRY.register("detection_dataset")
@@ -14,6 +14,7 @@ class DetectionDataset():
         pred_path = cfg_task['dataset']['prediction']['data_path']
         label_classes_level = cfg_task['categories'].get('eval_cat', {})
         label_classes = sum(list(label_classes_level.values()), [])
+        self.label_index = {name: idx for idx, name in enumerate(label_classes)}  # class name -> label
         gt_cat_mapping = cfg_task['categories']['gt_cat_mapping']
         pred_cat_mapping = cfg_task['categories']['pred_cat_mapping']
         filtered_types = cfg_task['dataset'].get('filter')
@@ -24,37 +25,30 @@ class DetectionDataset():
 
         self.samples = {
             'gts': gts,
-            'preds': preds
+            'preds': preds,
+            'classes': label_classes
         }
         # print(self.samples)
-        
-        meta={'CLASSES':tuple(label_classes)}
-        self.coco_det_metric = COCODetection(dataset_meta=meta, metric=['bbox'], classwise=True)
 
     def get_gts_and_img_list(self, filtered_types, gt_path, label_classes, label_classes_level, gt_cat_mapping):
-        with open(os.path.join(gt_path), 'r') as f:
-            gt_samples = json.load(f)
         basename = os.path.basename(gt_path)[:-5]
 
         img_list = []
         filtered_gt_samples = []
-        if filtered_types:
-            for gt_sample in gt_samples:
-                select_flag = True
+        # stream the pages, only the selected ones are kept in memory
+        for gt_sample in iter_json_array(gt_path):
+            if not page_selected(gt_sample, filtered_types):
+                continue
+            if filtered_types:
                 page_num = gt_sample['page_info']['page_no']
                 if gt_sample['page_info'].get('image_path'):
                     sample_name = gt_sample['page_info']['image_path']
                 else:
                     sample_name = f'{basename}_{page_num}'
-                for k, v in filtered_types.items():
-                    if gt_sample["page_info"]["page_attribute"][k] != v:
-                        select_flag = False
-                if select_flag:
-                    filtered_gt_samples.append(gt_sample)
-                    img_list.append(sample_name)
-        else:
-            filtered_gt_samples = gt_samples
-            img_list = [gt_sample["page_info"]['image_path'] for gt_sample in gt_samples]
+            else:
+                sample_name = gt_sample["page_info"]['image_path']
+            filtered_gt_samples.append(gt_sample)
+            img_list.append(sample_name)
 
         gts = self.reform_gt(filtered_gt_samples, label_classes, label_classes_level, gt_cat_mapping)
 
@@ -73,7 +67,7 @@ class DetectionDataset():
             if class_name in label_classes_level.get('block_level', []):
                 bbox = poly2bbox(item['poly'])
                 bboxes.append(bbox)
-                labels.append(label_classes.index(class_name))
+                labels.append(self.label_index[class_name])
                 if item.get('score'):
                     scores.append(item['score'])
                 else:
@@ -88,7 +82,7 @@ class DetectionDataset():
                 if class_name in label_classes_level.get('span_level', []):
                     bbox = poly2bbox(span['poly'])
                     bboxes.append(bbox)
-                    labels.append(label_classes.index(class_name))
+                    labels.append(self.label_index[class_name])
                     if span.get('score'):
                         scores.append(span['score'])
                     else:
@@ -192,9 +186,9 @@ class DetectionDatasetSimpleFormat(DetectionDataset):
                 else:
                     class_name = item["category_id"]
 
-                if class_name in label_classes:
+                if class_name in self.label_index:
                     pred_bboxes.append(item['bbox'])
-                    pred_labels.append(label_classes.index(class_name))
+                    pred_labels.append(self.label_index[class_name])
                     scores.append(item['score'])
                            
             preds.append({
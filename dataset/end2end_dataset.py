@@ -1,23 +1,48 @@
 import json
 import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from utils.extract import md_tex_filter
 from utils.match import match_gt2pred_simple, match_gt2pred_no_split
 from utils.match_quick import match_gt2pred_quick
 # from utils.match_full import match_gt2pred_full, match_gt2pred_textblock_full
-from utils.read_files import read_md_file
-from utils.data_preprocess import normalized_table, clean_string
+from utils.read_files import read_md_file, read_gt_pages
+from utils.match_cache import MatchCache
+from utils.data_preprocess import normalized_table, clean_string, textblock2unicode, normalized_formula
+from utils.norm_cache import norm_cache
+from utils.latex2html import latex_converter
+from utils.trace import span
 from registry.registry import DATASET_REGISTRY
 from dataset.recog_dataset import *
 import pdb
 import Levenshtein
 from tqdm import tqdm
-from func_timeout import FunctionTimedOut, func_timeout
 from loguru import logger
 import time
 import sys
 from pylatexenc.latex2text import LatexNodes2Text
 import traceback
+from func_timeout import FunctionTimedOut, func_timeout
+
+# seconds the text match of a page may take before falling back to match_gt2pred_simple
+MATCH_TIMEOUT = 30
+
+# the dataset a match worker process matches its pages with, built once by _init_match_worker
+_match_dataset = None
+
+
+def _init_match_worker(match_method):
+    """Pool initializer: the page match only reads the match method, the rest of the dataset stays in the parent"""
+    global _match_dataset
+    _match_dataset = End2EndDataset.__new__(End2EndDataset)
+    _match_dataset.match_method = match_method
+
+
+def _match_page_worker(sample, pred_content, img_name, save_time):
+    """Worker function matching one page with the worker's dataset"""
+    return _match_dataset.process_get_matched_elements(sample, pred_content, img_name, save_time)
+
 
 @DATASET_REGISTRY.register("end2end_dataset")
 class End2EndDataset():
@@ -25,22 +50,24 @@ class End2EndDataset():
         gt_path = cfg_task['dataset']['ground_truth']['data_path']
         pred_folder = cfg_task['dataset']['prediction']['data_path']
         self.match_method = cfg_task['dataset'].get('match_method', 'quick_match')
+        self.num_workers = cfg_task['dataset'].get('num_workers', 1)  # >1 matches pages in a process pool
+        match_cache_dir = cfg_task['dataset'].get('match_cache')  # reuse the match results of unchanged pages
+        self.match_cache = MatchCache(match_cache_dir) if match_cache_dir else None
+        self.latex_cache = cfg_task['dataset'].get('latex_cache')  # keep the LaTeX table -> html conversions across runs
+        self.result_format = cfg_task['dataset'].get('result_format', 'json')  # json, jsonl, jsonl.gz or jsonl.zst per-sample results
         filtered_types = cfg_task['dataset'].get('filter')
 
-        with open(gt_path, 'r') as f:
-            gt_samples = json.load(f)
-
-        filtered_gt_samples = []
-        if filtered_types:
-            for gt_sample in gt_samples:
-                select_flag = True
-                for k, v in filtered_types.items():
-                    if gt_sample["page_info"]["page_attribute"][k] != v:
-                        select_flag = False
-                if select_flag:
-                    filtered_gt_samples.append(gt_sample)
-        else:
-            filtered_gt_samples = gt_samples
+        # one streaming pass over the GT: filter the pages and index page attributes for End2EndEval
+        self.gt_path = gt_path
+        filtered_gt_samples, self.page_info = read_gt_pages(gt_path, filtered_types)
+
+        norm_cache_dir = cfg_task['dataset'].get('norm_cache')  # keep the GT normalizations across runs
+        if norm_cache_dir:
+            norm_cache_path = norm_cache.cache_path(norm_cache_dir, gt_path)
+            norm_cache.load(norm_cache_path)
+            with norm_cache.persisting():
+                self.normalize_gt(filtered_gt_samples)
+            norm_cache.save(norm_cache_path)
 
         self.samples = self.get_matched_elements(filtered_gt_samples, pred_folder)
      
@@ -49,6 +76,15 @@ class End2EndDataset():
         return self.samples[cat_name][idx]
     
 
+    # 预先计算GT文本与公式的归一化结果，存入norm_cache（匹配时直接复用，进程池的子进程fork时继承）
+    def normalize_gt(self, gt_samples):
+        for sample in gt_samples:
+            for item in sample['layout_dets']:
+                if item.get('text') is not None:
+                    clean_string(textblock2unicode(str(item['text'])))
+                if item['category_type'] == 'equation_isolated' and item.get('latex') is not None:
+                    normalized_formula(str(item['latex']))
+
     # 匹配元素 处理文本截断问题，将截断的文本块合并，并将元素按类别存储在字典中
     def get_page_elements(self, selected_annos):
         
@@ -149,6 +185,22 @@ class End2EndDataset():
             item["img_id"] = img_name + '_' + str(i)
         return formula_matches
 
+    # 将单页的匹配结果合并到各类别的匹配列表中
+    def collect_page_result(self, result, plain_text_match, display_formula_match, latex_table_match, html_table_match, order_match):
+        [plain_text_match_clean, formated_display_formula, latex_table_match_s, html_table_match_s, order_match_single, budget_hit_page] = result
+
+        self.match_budget_hit_pages.extend(budget_hit_page)
+        if order_match_single:
+            order_match.append(order_match_single)
+        if plain_text_match_clean:
+            plain_text_match.extend(plain_text_match_clean)
+        if formated_display_formula:
+            display_formula_match.extend(formated_display_formula)
+        if latex_table_match_s:
+            latex_table_match.extend(latex_table_match_s)
+        if html_table_match_s:
+            html_table_match.extend(html_table_match_s)
+
     # 对gt和预测结果进行匹配，调用 process_get_matched_elements 函数进行匹配处理，最终将匹配结果整理成一个字典返回
     def get_matched_elements(self, gt_samples, pred_folder):
         plain_text_match = []
@@ -157,6 +209,9 @@ class End2EndDataset():
         latex_table_match = []
         order_match = []
         save_time = time.time()
+        page_results = []   # per page match result, None until it is matched in the process pool
+        pending = []        # (page index, sample, pred content, img name, cache key) to match in the pool
+        cache_hits = 0
         process_bar = tqdm(gt_samples, ascii=True, ncols=140)
         for sample in process_bar:
             img_name = os.path.basename(sample["page_info"]["image_path"])
@@ -175,24 +230,39 @@ class End2EndDataset():
 
             process_bar.set_description(f'Processing {os.path.basename(pred_path)}')
             pred_content = read_md_file(pred_path)
-            
-            # 对单个样本匹配，根据不同的元素类型（如文本块、显示公式、表格等），使用指定的匹配方法将gt与预测结果进行匹配，并返回匹配结果
-            result = self.process_get_matched_elements(sample, pred_content, img_name, save_time) # Don't use timeout logic
-
-            [plain_text_match_clean, formated_display_formula, latex_table_match_s, html_table_match_s, order_match_single] = result
-
-            # if img_name == 'docstructbench_dianzishu_zhongwenzaixian-o.O-63674848.pdf_101.jpg':
-            #     pdb.set_trace()
-            if order_match_single:
-                order_match.append(order_match_single)
-            if plain_text_match_clean:
-                plain_text_match.extend(plain_text_match_clean)
-            if formated_display_formula:
-                display_formula_match.extend(formated_display_formula)
-            if latex_table_match_s:
-                latex_table_match.extend(latex_table_match_s)
-            if html_table_match_s:
-                html_table_match.extend(html_table_match_s)
+
+            cache_key = self.match_cache.key(sample, pred_content, self.match_method) if self.match_cache else None
+            result = self.match_cache.load(cache_key) if cache_key else None
+            if result is not None:
+                cache_hits += 1
+            else:
+                if self.num_workers > 1:
+                    pending.append((len(page_results), sample, pred_content, img_name, cache_key))
+                else:
+                    # 对单个样本匹配，根据不同的元素类型（如文本块、显示公式、表格等），使用指定的匹配方法将gt与预测结果进行匹配，并返回匹配结果
+                    result = self.process_get_matched_elements(sample, pred_content, img_name, save_time) # Don't use timeout logic
+                    if cache_key:
+                        self.match_cache.save(cache_key, result)
+            page_results.append(result)
+
+        if pending:
+            page_indices, page_samples, page_contents, img_names, cache_keys = zip(*pending)
+            chunksize = max(1, len(pending) // (self.num_workers * 4))
+            with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_match_worker, initargs=(self.match_method,)) as executor:
+                results = executor.map(_match_page_worker, page_samples, page_contents, img_names, repeat(save_time), chunksize=chunksize)
+                for page_idx, cache_key, result in tqdm(zip(page_indices, cache_keys, results), total=len(pending), ascii=True, ncols=140, desc=f'Matching with {self.num_workers} workers'):
+                    page_results[page_idx] = result
+                    if cache_key:
+                        self.match_cache.save(cache_key, result)
+
+        if self.match_cache:
+            print(f'Reused cached matches for {cache_hits}/{len(page_results)} pages.')
+        # merged in page order, so the results do not depend on caching or on the number of workers
+        self.match_budget_hit_pages = []
+        for result in page_results:
+            self.collect_page_result(result, plain_text_match, display_formula_match, latex_table_match, html_table_match, order_match)
+        if self.match_budget_hit_pages:
+            print(f'Warning: the truncation merge search ran out of budget on {len(self.match_budget_hit_pages)} pages.')
 
         display_formula_match_clean,display_formula_match_others = [],[]
         for item in display_formula_match:
@@ -242,15 +312,21 @@ class End2EndDataset():
         matched_samples_all = {
             'text_block': DATASET_REGISTRY.get('recogition_end2end_base_dataset')(plain_text_match),
             'display_formula':  DATASET_REGISTRY.get('recogition_end2end_base_dataset')(display_formula_match), 
-            'table': DATASET_REGISTRY.get('recogition_end2end_table_dataset')(table_match, table_format),
+            'table': DATASET_REGISTRY.get('recogition_end2end_table_dataset')(table_match, table_format,
+                                                                              num_workers=self.num_workers, latex_cache=self.latex_cache),
             'reading_order': DATASET_REGISTRY.get('recogition_end2end_base_dataset')(order_match)
         }
       
 
         return matched_samples_all
     
-    #0403 提取gt的table跟pred的table进行匹配 -> 未匹配上的pred_table 去掉html格式然后丢进去混合匹配
+    # 单个页面的匹配，在trace中记为该页面的match_page
     def process_get_matched_elements(self, sample, pred_content, img_name, save_time):
+        with span('match_page', page=img_name):
+            return self.match_page_elements(sample, pred_content, img_name, save_time)
+
+    #0403 提取gt的table跟pred的table进行匹配 -> 未匹配上的pred_table 去掉html格式然后丢进去混合匹配
+    def match_page_elements(self, sample, pred_content, img_name, save_time):
         if self.match_method == 'simple_match':   # add match choice
             match_gt2pred = match_gt2pred_simple
         elif self.match_method == 'quick_match':
@@ -301,8 +377,12 @@ class End2EndDataset():
             if unmatch_table_pred:
                 pred_dataset_mix.extend(unmatch_table_pred)
 
+        # quick_match bounds its truncation merge search (MERGE_SEARCH_BUDGET), the timeout stays as the backstop
+        # of the other stages and match methods
+        match_stats = {}
         try:
-            match = func_timeout(30, match_gt2pred, args=(gt_mix, pred_dataset_mix, 'text_all', img_name))
+            kwargs = {'match_stats': match_stats} if match_gt2pred is match_gt2pred_quick else {}
+            match = func_timeout(MATCH_TIMEOUT, match_gt2pred, args=(gt_mix, pred_dataset_mix, 'text_all', img_name), kwargs=kwargs)
         except FunctionTimedOut as e1:
             # print(f'Time out for plain text match of {img_name}, match_gt2pred_simple will be used.')
             match,_ = match_gt2pred_simple(gt_mix, pred_dataset_mix, 'text_all', img_name)
@@ -337,7 +417,8 @@ class End2EndDataset():
             order_match_single = self.get_order_paired(order_match_s, img_name)
 
 
-        return [plain_text_match_clean, display_formula_match_s, latex_table_match_s, html_table_match_s, order_match_single]        
+        budget_hit_page = [img_name] if match_stats.get('budget_hit') else []
+        return [plain_text_match_clean, display_formula_match_s, latex_table_match_s, html_table_match_s, order_match_single, budget_hit_page]        
 
     
 
@@ -356,12 +437,17 @@ class RecognitionEnd2EndBaseDataset():
 
 @DATASET_REGISTRY.register("recogition_end2end_table_dataset")
 class RecognitionEnd2EndTableDataset(RecognitionTableDataset):
-    def __init__(self, samples, table_format):
+    def __init__(self, samples, table_format, num_workers=1, latex_cache=None):
         self.pred_table_format = table_format
+        self.num_workers = num_workers
+        self.latex_cache = latex_cache
         self.samples = self.normalize_data(samples)
 
     def normalize_data(self, samples):
         img_id = 0
+        if self.pred_table_format == 'latex':
+            # convert all the LaTeX tables at once, normalized_table then reads the converted html from memory
+            latex_converter.convert([sample['pred'] for sample in samples], self.num_workers, self.latex_cache)
 
         for sample in samples:
             p = sample['pred']
@@ -2,10 +2,10 @@ import re
 from registry.registry import DATASET_REGISTRY
 import json
 import os
-import shutil
 from tqdm import tqdm
 from utils.ocr_utils import get_text_for_block
 from utils.data_preprocess import clean_string, normalized_formula, textblock2unicode, normalized_table
+from utils.latex2html import latex_converter
 
 
 @DATASET_REGISTRY.register("recogition_text_dataset")
@@ -171,16 +171,19 @@ class RecognitionTableDataset():
         gt_file = cfg_task['dataset']['ground_truth']['data_path']
         pred_file = cfg_task['dataset']['prediction']['data_path']
         self.pred_table_format = cfg_task['dataset']['prediction'].get('table_format', 'html')
+        self.num_workers = cfg_task['dataset'].get('num_workers', 1)
+        self.latex_cache = cfg_task['dataset'].get('latex_cache')
 
         references, predictions = self.load_data(gt_file), self.load_data(pred_file)
         self.samples = self.normalize_data(references, predictions)
 
     def normalize_data(self, references, predictions):
-        if self.pred_table_format == 'latex2html':
-            os.makedirs('./temp', exist_ok=True)
-
         samples = []
         ref_keys = list(references.keys())
+        if self.pred_table_format == 'latex':
+            # convert all the LaTeX tables at once, normalized_table then reads the converted html from memory
+            latex_list = [references[img]['latex'] for img in ref_keys] + [predictions[img]['latex'] for img in ref_keys]
+            latex_converter.convert(latex_list, self.num_workers, self.latex_cache)
 
         for img in tqdm(ref_keys, total=len(ref_keys), ncols=140, ascii=True, desc='Normalizing data'):
             if self.pred_table_format == 'html':
@@ -203,9 +206,7 @@ class RecognitionTableDataset():
                 'img_id': img_id,
                 'gt_attribute': [references[img]['attribute']],
             })
-        
-        if self.pred_table_format == 'latex2html':
-            shutil.rmtree('./temp')
+
         return samples
 
     def __getitem__(self, idx):
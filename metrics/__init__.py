@@ -10,6 +10,7 @@ __all__ = [
     "call_Edit_dist",
     "call_CDM",
     "call_CDM_plain",
+    "call_COCODet",
     "call_Move_dist"
 ]
 
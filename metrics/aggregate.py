@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+
+def sequential_sum(values):
+    """Left-to-right sum of a float array, the same result as the built-in sum() of the sample scores"""
+    return np.cumsum(values)[-1] if len(values) else 0.0
+
+
+def group_indices(store, group_info):
+    """
+    Sample indices of 'all' and of every str(group) with samples, in the order the groups get their first sample
+    (the order the per-sample loops used to create them in).
+    """
+    if not len(store):
+        return []
+    groups = {}
+    for position, group in enumerate(group_info):
+        indices = np.flatnonzero(store.group_mask(group))
+        if len(indices) and str(group) not in groups:
+            groups[str(group)] = (indices[0], position, indices)
+    ordered = sorted(groups.items(), key=lambda item: item[1][:2])
+    return [('all', np.arange(len(store)))] + [(name, indices) for name, (_, _, indices) in ordered]
+
+
+def group_means(store, scores, group_info):
+    """Sample-level average of scores (an array over the samples of store) for 'all' and each group"""
+    return {name: float(sequential_sum(scores[indices]) / len(indices))
+            for name, indices in group_indices(store, group_info)}
+
+
+def label_breakdown(store):
+    """
+    Sample-level average of every metric for each 'key: value' label of the gt attributes, and the sample count
+    of each label (the count of the metric that first appeared last for the label, as the label report has
+    always taken the last one).
+    """
+    names, pair_samples, pair_labels = store.attribute_labels()
+    result = {'sample_count': {}}
+    last_metric = {}
+    for position, metric in enumerate(store.metric_names()):
+        scores = store.score(metric)[pair_samples]
+        present = ~np.isnan(scores)
+        samples, labels, scores = pair_samples[present], pair_labels[present], scores[present]
+        counts = np.bincount(labels, minlength=len(names))
+        # bincount adds the weights in sample order, like summing each label's score list
+        sums = np.bincount(labels, weights=scores, minlength=len(names))
+        first_sample = np.full(len(names), len(store), dtype=np.int64)
+        np.minimum.at(first_sample, labels, samples)
+        for label in np.flatnonzero(counts):
+            if metric not in result:
+                result[metric] = {}
+            result[metric][names[label]] = float(sums[label] / counts[label])
+            order = (first_sample[label], position)
+            if label not in last_metric or order > last_metric[label][0]:
+                last_metric[label] = (order, int(counts[label]))
+    for label, (_, count) in last_metric.items():
+        result['sample_count'][names[label]] = count
+    return result
+
+
+def page_attribute_names(page_info_s):
+    """Page attribute labels of a page, with 'ALL' first; duplicated special issues count twice"""
+    attributes = ['ALL']
+    for k, v in page_info_s.items():
+        if isinstance(v, list): # special issue
+            for special_issue in v:
+                if 'table' not in special_issue:  # Table-related special fields have duplicates
+                    attributes.append(special_issue)
+        else:
+            attributes.append(k+": "+str(v))
+    return attributes
+
+
+def page_breakdown(store, page_info, page_names):
+    """
+    Page-level average of every metric for each page attribute: the scores are averaged within a page first
+    (Edit_dist weighted by max(len(gt), len(pred)) of the samples), then the pages are averaged.
+    page_names holds the page of each sample.
+    """
+    page_list, page_codes = np.unique(np.array(page_names, dtype=object), return_inverse=True)
+    page_attributes = [page_attribute_names(page_info[page]) for page in page_list]
+    attribute_list, attribute_codes = np.unique(np.array([a for attrs in page_attributes for a in attrs], dtype=object),
+                                                return_inverse=True)
+    attribute_counts = np.array([len(attrs) for attrs in page_attributes], dtype=np.int64)
+    attribute_starts = np.concatenate([[0], np.cumsum(attribute_counts)[:-1]])
+    gt_len, pred_len = store.text_lengths()
+    upper_len = np.maximum(gt_len, pred_len)
+
+    result = {}
+    for metric in store.metric_names():
+        scores = store.score(metric)
+        samples = np.flatnonzero(~np.isnan(scores))
+        if not len(samples):
+            continue
+        # one row per (sample, attribute of its page), sorted by page and attribute name keeping the sample order
+        repeats = attribute_counts[page_codes[samples]]
+        row_samples = np.repeat(samples, repeats)
+        row_offsets = np.arange(len(row_samples)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        row_attributes = attribute_codes[np.repeat(attribute_starts[page_codes[samples]], repeats) + row_offsets]
+        row_keys = page_codes[row_samples] * len(attribute_list) + row_attributes
+        order = np.argsort(row_keys, kind='stable')
+        row_samples, row_keys = row_samples[order], row_keys[order]
+        bounds = np.flatnonzero(np.diff(row_keys)) + 1
+        starts = np.concatenate([[0], bounds])
+        ends = np.concatenate([bounds, [len(row_keys)]])
+
+        row_scores = scores[row_samples]
+        if metric == 'Edit_dist':   # 只有Edit_dist需要进行page level的计算
+            row_lens = upper_len[row_samples]
+            weighted = row_scores * row_lens
+            with np.errstate(divide='ignore', invalid='ignore'):
+                page_scores = [weighted[start:end].sum() / row_lens[start:end].sum() for start, end in zip(starts, ends)]
+        else:
+            page_scores = [row_scores[start:end].mean() for start, end in zip(starts, ends)]
+        keys = row_keys[starts]
+        index = pd.MultiIndex.from_arrays([page_list[keys // len(attribute_list)], attribute_list[keys % len(attribute_list)]],
+                                          names=['image_name', 'attribute'])
+        # pages are averaged per attribute with pandas, as before, so the page averages keep their precision
+        result[metric] = pd.Series(page_scores, index=index, dtype=np.float64).groupby('attribute').mean().to_dict()
+    return result
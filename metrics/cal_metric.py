@@ -1,99 +1,123 @@
 # import evaluate
 # import random
+import os
 import json
 import time
 # from rapidfuzz.distance import Levenshtein
 import Levenshtein
 from .table_metric import TEDS
-import evaluate
-import random
+from .text_metric import bleu_statistics, corpus_bleu, meteor_score, meteor_resources
 from utils.read_files import save_paired_result
 from registry.registry import METRIC_REGISTRY
 from collections import defaultdict
 import pdb
 import copy
 import pandas as pd
+import numpy as np
 from .cdm_metric import CDM
+from .detection_metric import COCODetectionEvaluator
+from .sample_store import SampleStore
+from .aggregate import group_indices, group_means
+from utils.result_io import write_results
+from utils.trace import span
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from func_timeout import func_timeout, FunctionTimedOut
+from tqdm import tqdm
 
 def get_groups(samples, group_info):
-    group_samples = defaultdict(list)
-    for sample in samples:
-        group_samples['all'].append(sample)
-        for group in group_info:
-            select_flag = True
-            for k, v in group.items():
-                for gt_attribute in sample['gt_attribute']:   # gt_attribute is a list containing all merged gt attributes
-                    if not gt_attribute:   # if no GT attributes, don't include in calculation
-                        select_flag = False
-                    elif gt_attribute[k] != v:  # if any gt attribute doesn't meet criteria, don't select
-                        select_flag = False
-            if select_flag:
-                group_samples[str(group)].append(sample)
+    store = SampleStore.of(samples)
+    group_samples = {}
+    for group_name, indices in group_indices(store, group_info):
+        group_samples[group_name] = [store.samples[idx] for idx in indices]
     return group_samples
 
 
+# score recorded for a table whose TEDS computation exceeds the timeout
+TEDS_TIMEOUT_SCORE = 0
+
+def _teds_table_scores(args):
+    """
+    Full and structure-only TEDS of one table (of the given page, for the trace), run in the main process
+    or in a pool worker.
+    Returns {metric_name: (score, status)} with status in 'ok', 'error' and 'timeout',
+    plus the score errors under 'max_error' in approximate mode.
+    """
+    pred, gt, timeout, approximate, page = args
+    teds = TEDS(structure_only=False, approximate=approximate)
+    try:
+        # both scores come from a single parse of the two tables
+        with span('TEDS.table', page=page):
+            if timeout:
+                score, score_structure_only = func_timeout(timeout, teds.evaluate_with_structure, args=(pred, gt))
+            else:
+                score, score_structure_only = teds.evaluate_with_structure(pred, gt)
+        scores = {'TEDS': (score, 'ok'), 'TEDS_structure_only': (score_structure_only, 'ok')}
+        if approximate:
+            scores['max_error'] = teds.max_error
+        return scores
+    except FunctionTimedOut:
+        return {'TEDS': (TEDS_TIMEOUT_SCORE, 'timeout'), 'TEDS_structure_only': (TEDS_TIMEOUT_SCORE, 'timeout')}
+    except Exception:
+        return {'TEDS': (0, 'error'), 'TEDS_structure_only': (0, 'error')}
+
 @METRIC_REGISTRY.register("TEDS")
 class call_TEDS():
     def __init__(self, samples):
         self.samples = samples
-    def evaluate(self, group_info=[], save_name='default'):
-        teds = TEDS(structure_only=False)
-        teds_structure_only = TEDS(structure_only=True)
-        group_scores = defaultdict(list)
-        group_scores_structure_only = defaultdict(list)
-        samples = self.samples
+    def evaluate(self, group_info=[], save_name='default', num_workers=1, timeout=None, approximate=False, result_format='json'):
+        """
+        num_workers > 1 computes the tables in a process pool. A table taking longer than timeout seconds
+        gets TEDS_TIMEOUT_SCORE and is marked in per_table_TEDS.json; the number and ids of the timed-out tables
+        are reported under TEDS_timeout in the result, since their score counts in the averages. None waits for
+        every table.
+        approximate skips the exact tree edit distance for a quick screening run, see TEDS.approximate;
+        each table's maximum score error is saved in per_table_TEDS.json.
+        result_format is the format of per_table_TEDS, see utils.result_io.
+        """
+        if approximate:
+            print('Approximate TEDS: the scores are lower bounds of the exact TEDS.')
+        store = SampleStore.of(self.samples)
+        samples = store.samples
         per_table_score = {}
-        for idx, sample in enumerate(samples):
+        timeout_tables = []
+        inputs = []
+        for sample in samples:
             gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
             pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
-            try:
-                score = teds.evaluate(pred, gt)
-            except:
-                score = 0
-                print(f'TEDS score error for table {sample["gt_idx"]} in {sample["img_id"]}. The score is set to 0.')
-            try:
-                score_structure_only = teds_structure_only.evaluate(pred, gt)
-            except:
-                score_structure_only = 0
-                print(f'TEDS_structure_only score error for table {sample["gt_idx"]} in {sample["img_id"]}. The score is set to 0.')
-            # print('TEDS score:', score)
-            group_scores['all'].append(score)
-            group_scores_structure_only['all'].append(score_structure_only)
-            if not sample.get('metric'):
-                sample['metric'] = {}
-            sample['metric']['TEDS'] = score
-            sample['metric']['TEDS_structure_only'] = score_structure_only
+            inputs.append((pred, gt, timeout, approximate, sample.get('img_id')))
+        if num_workers > 1 and len(inputs) > 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                # map keeps the sample order, so the outputs do not depend on which table finishes first
+                table_scores = list(tqdm(executor.map(_teds_table_scores, inputs), total=len(inputs), desc='TEDS'))
+        else:
+            table_scores = [_teds_table_scores(args) for args in inputs]
+
+        for idx, (sample, scores) in enumerate(zip(samples, table_scores)):
+            score, status = scores['TEDS']
+            score_structure_only, status_structure_only = scores['TEDS_structure_only']
+            for metric_name, metric_status in [('TEDS', status), ('TEDS_structure_only', status_structure_only)]:
+                if metric_status == 'error':
+                    print(f'{metric_name} score error for table {sample["gt_idx"]} in {sample["img_id"]}. The score is set to 0.')
+                elif metric_status == 'timeout':
+                    print(f'{metric_name} timed out after {timeout}s for table {sample["gt_idx"]} in {sample["img_id"]}. The score is set to {TEDS_TIMEOUT_SCORE}.')
             per_table_score[sample['img_id']+'_'+str(sample.get('gt_idx', idx))] = {'TEDS': score, 'TEDS_structure_only': score_structure_only}
-            for group in group_info:
-                select_flag = True
-                for k, v in group.items():
-                    for gt_attribute in sample['gt_attribute']:   # gt_attribute is a list containing all merged gt attributes
-                        if not gt_attribute:   # if no GT attributes, don't include in calculation
-                            select_flag = False
-                        elif gt_attribute[k] != v:  # if any gt attribute doesn't meet criteria, don't select
-                            select_flag = False
-                if select_flag:
-                    group_scores[str(group)].append(score)
-        with open(f'./result/{save_name}_per_table_TEDS.json', 'w', encoding='utf-8') as f:
-            json.dump(per_table_score, f, indent=4, ensure_ascii=False)
-        result = {}
-        for group_name, scores in group_scores.items():
-            if len(scores) > 0:
-                result[group_name] = sum(scores) / len(scores)    # average of normalized scores at sample level
-            else:
-                result[group_name] = 'NaN'
-                print(f'Warning: Empyty matched samples for {group_name}.')
-        
-        structure_only_result = {}
-        for group_name, scores in group_scores_structure_only.items():
-            if len(scores) > 0:
-                structure_only_result[group_name] = sum(scores) / len(scores)    # average of normalized scores at sample level
-            else:
-                structure_only_result[group_name] = 'NaN'
-                print(f'Warning: Empyty matched samples for {group_name}.')
+            if 'timeout' in (status, status_structure_only):
+                per_table_score[sample['img_id']+'_'+str(sample.get('gt_idx', idx))]['timeout'] = True
+                timeout_tables.append(sample['img_id']+'_'+str(sample.get('gt_idx', idx)))
+            if 'max_error' in scores:
+                per_table_score[sample['img_id']+'_'+str(sample.get('gt_idx', idx))]['max_error'] = {
+                    'TEDS': scores['max_error'][0], 'TEDS_structure_only': scores['max_error'][1]}
+        store.add_score('TEDS', [scores['TEDS'][0] for scores in table_scores])
+        store.add_score('TEDS_structure_only', [scores['TEDS_structure_only'][0] for scores in table_scores])
+        write_results(f'./result/{save_name}_per_table_TEDS', per_table_score, result_format, key_field='table')
+        result = group_means(store, store.score('TEDS'), group_info)
+        structure_only_result = group_means(store, store.score('TEDS_structure_only'), [])
 
-        return samples, {'TEDS': result, 'TEDS_structure_only': structure_only_result}
+        results = {'TEDS': result, 'TEDS_structure_only': structure_only_result}
+        if timeout_tables:
+            print(f'Warning: {len(timeout_tables)} tables timed out and are averaged with a TEDS of {TEDS_TIMEOUT_SCORE}.')
+            results['TEDS_timeout'] = {'table_num': len(timeout_tables), 'tables': timeout_tables}
+        return store, results
 
 
 @METRIC_REGISTRY.register("BLEU")
@@ -101,74 +125,82 @@ class call_BLEU():
     def __init__(self, samples):
         self.samples = samples
     def evaluate(self, group_info=[], save_name='default'):
-        group_samples = get_groups(self.samples, group_info)
+        store = SampleStore.of(self.samples)
+        predictions, references = [], []
+        for sample in store.samples:
+            gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
+            pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
+            predictions.append(gt)
+            references.append(pred)
+        # n-gram statistics are counted once per sample, a group's corpus BLEU comes from the sum of its rows
+        stats = bleu_statistics(predictions, references)
         result = {}
-        for group_name, samples in group_samples.items():
-            predictions, references = [], []
-            for sample in samples:
-                gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
-                pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
-                predictions.append(gt)
-                references.append(pred)
-            bleu = evaluate.load("bleu", keep_in_memory=True, experiment_id=random.randint(1,1e8))
-            bleu_results = bleu.compute(predictions=predictions, references=references)
-            result[group_name] = bleu_results["bleu"]
+        for group_name, indices in group_indices(store, group_info):
+            result[group_name] = corpus_bleu(stats[indices].sum(axis=0))
         
-        return self.samples, {'BLEU': result}
+        return store, {'BLEU': result}
     
 @METRIC_REGISTRY.register("METEOR")
 class call_METEOR():
     def __init__(self, samples):
         self.samples = samples
     def evaluate(self, group_info=[], save_name='default'):
-        group_samples = get_groups(self.samples, group_info)
+        store = SampleStore.of(self.samples)
+        scores = []
+        for sample in store.samples:
+            gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
+            pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
+            scores.append(meteor_score(pred, gt))
+        # METEOR is averaged over the sentences, each sample is scored once for all its groups
+        scores = np.array(scores, dtype=np.float64)
         result = {}
-        for group_name, samples in group_samples.items():
-            predictions, references = [], []
-            for sample in samples:
-                gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
-                pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
-                predictions.append(gt)
-                references.append(pred)
-            meteor = evaluate.load('meteor', keep_in_memory=True, experiment_id=random.randint(1,1e8))
-            meteor_results = meteor.compute(predictions=predictions, references=references)
-            result[group_name] = meteor_results['meteor']
-        
-        return self.samples, {'METEOR': result}
+        for group_name, indices in group_indices(store, group_info):
+            result[group_name] = float(np.mean(scores[indices]))
+
+        results = {'METEOR': result}
+        if meteor_resources().degraded:
+            # without nltk or its data the scores are not comparable to the ones of a full install
+            results['METEOR_mode'] = meteor_resources().mode
+        return store, results
 
 @METRIC_REGISTRY.register("Edit_dist")
 class call_Edit_dist():
     def __init__(self, samples):
         self.samples = samples
     def evaluate(self, group_info=[], save_name='default'):
-        samples = self.samples
-        for sample in samples:
+        store = SampleStore.of(self.samples)
+        image_names, edit_nums, edit_dists = [], [], []
+        for sample in store.samples:
             img_name = sample['img_id'] if sample['img_id'].endswith('.jpg') or sample['img_id'].endswith('.png') else '_'.join(sample['img_id'].split('_')[:-1])
-            sample['image_name'] = img_name
+            image_names.append(img_name)
             gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
             pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
-            upper_len = max(len(pred), len(gt))
-            sample['upper_len'] = upper_len
             if len(pred) > 0 or len(gt) > 0:
                 edit_dist = Levenshtein.distance(pred, gt)
-                if not sample.get('metric'):
-                    sample['metric'] = {}
-                sample['metric']['Edit_dist'] = edit_dist / upper_len
-                sample['Edit_num'] = edit_dist
-
-        if isinstance(samples, list):
-            saved_samples = samples
-        else:
-            saved_samples = samples.samples
+                edit_nums.append(edit_dist)
+                edit_dists.append(edit_dist / max(len(pred), len(gt)))
+            else:
+                edit_nums.append(None)
+                edit_dists.append(None)
+        gt_len, pred_len = store.text_lengths()
+        upper_len = np.maximum(gt_len, pred_len)
+        store.add_column('image_name', image_names)
+        store.add_column('upper_len', upper_len.tolist())
+        store.add_score('Edit_dist', edit_dists)
+        store.add_column('Edit_num', edit_nums)
         
-        if not saved_samples:
-            return samples, {'Edit_dist': {'ALL_page_avg': 'NaN'}}
-
-        df = pd.DataFrame(saved_samples)
-        up_total_avg = df.groupby("image_name").apply(lambda x: x['Edit_num'].sum() / x['upper_len'].sum()) # page level, sum of edits divided by sum of max(gt,pred) lengths for each sample
-        all_total_avg = df['Edit_num'].sum() / df['upper_len'].sum()
-        # all_total_avg = df["Edit_dist"].mean()
-        per_img_score = up_total_avg.to_dict()
+        if not len(store):
+            return store, {'Edit_dist': {'ALL_page_avg': 'NaN'}}
+
+        # page level, sum of edits divided by sum of max(gt,pred) lengths for each sample
+        page_names, page_codes = np.unique(np.array(image_names, dtype=object), return_inverse=True)
+        edit_num = np.array([np.nan if v is None else v for v in edit_nums], dtype=np.float64)
+        has_edit = ~np.isnan(edit_num)
+        edit_num_filled = np.where(has_edit, edit_num, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            up_total_avg = np.bincount(page_codes, weights=edit_num_filled, minlength=len(page_names)) / \
+                np.bincount(page_codes, weights=upper_len, minlength=len(page_names))
+        per_img_score = {name: float(score) for name, score in zip(page_names, up_total_avg)}
         with open(f'./result/{save_name}_per_page_edit.json', 'w', encoding='utf-8') as f:
             json.dump(per_img_score, f, indent=4, ensure_ascii=False)        
         
@@ -177,153 +209,142 @@ class call_Edit_dist():
         # else:
         #     return samples, {'Edit_dist': {'ALL_page_avg': up_total_avg.mean()}}
         
-        edit_whole = df['Edit_num'].sum() / df['upper_len'].sum()
-        df['ratio'] = df['Edit_num'] / df['upper_len']
-        edit_sample_avg = df['ratio'].mean()
-        # edit_sample_avg = df['metric']['Edit_dist'].mean()
-        return samples, {'Edit_dist': {'ALL_page_avg': up_total_avg.mean(), 'edit_whole': edit_whole, 'edit_sample_avg': edit_sample_avg}}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edit_whole = edit_num_filled.sum() / upper_len.sum()
+            ratio = edit_num / upper_len
+        edit_sample_avg = np.nanmean(ratio) if (~np.isnan(ratio)).any() else np.nan
+        page_avg = np.nanmean(up_total_avg) if (~np.isnan(up_total_avg)).any() else np.nan
+        return store, {'Edit_dist': {'ALL_page_avg': page_avg, 'edit_whole': edit_whole, 'edit_sample_avg': edit_sample_avg}}
     
-def _process_single_cdm_sample(args):
-    """Worker function to process a single CDM sample"""
-    idx, sample, output_root, group_info = args
-    
-    # Create a new CDM instance for this worker to avoid thread safety issues
-    cal_cdm = CDM(output_root=output_root)
-    
-    # Prepare sample data
-    sample_copy = copy.deepcopy(sample)
-    sample_copy['img_id_cdm'] = str(idx)
-    sample_copy['gt'] = sample_copy['gt'].lstrip("$$").rstrip("$$").strip()
-    sample_copy['gt'] = sample_copy['gt'].lstrip("$").rstrip("$").strip()
-    sample_copy['pred'] = sample_copy['pred'].split("```latex")[-1].split("```")[0]
-    sample_copy['pred'] = sample_copy['pred'].lstrip("$$").rstrip("$$").strip()
-    sample_copy['pred'] = sample_copy['pred'].lstrip("$").rstrip("$").strip()
-    
-    # Calculate CDM score
-    cdm_score = cal_cdm.evaluate(sample_copy['gt'], sample_copy['pred'], sample_copy['img_id_cdm'])["F1_score"]
-    
-    # Add metric to sample
-    if not sample_copy.get('metric'):
-        sample_copy['metric'] = {}
-    sample_copy['metric']['CDM'] = cdm_score
-    
-    # Check which groups this sample belongs to
-    matched_groups = []
-    for group in group_info:
-        select_flag = True
-        for k, v in group.items():
-            for gt_attribute in sample_copy['gt_attribute']:
-                if not gt_attribute:
-                    select_flag = False
-                elif gt_attribute[k] != v:
-                    select_flag = False
-        if select_flag:
-            matched_groups.append(str(group))
-    
-    return {
-        'sample': sample_copy,
-        'cdm_score': cdm_score,
-        'sample_key': sample_copy['img_id'] + '_' + str(sample_copy.get('gt_idx', 0)),
-        'matched_groups': matched_groups,
-        'original_index': idx
-    }
+def _clean_cdm_latex(gt, pred):
+    """Strip math delimiters and code fences before rendering"""
+    gt = gt.lstrip("$$").rstrip("$$").strip()
+    gt = gt.lstrip("$").rstrip("$").strip()
+    pred = pred.split("```latex")[-1].split("```")[0]
+    pred = pred.lstrip("$$").rstrip("$$").strip()
+    pred = pred.lstrip("$").rstrip("$").strip()
+    return gt, pred
+
+
+# the CDM evaluator of a worker process, built once by _init_cdm_worker
+_cdm_evaluator = None
+
+
+def _init_cdm_worker(output_root, cache_dir=None, cache_max_size_mb=4096):
+    """Pool initializer: one CDM evaluator (matcher, color table, render cache) per worker process"""
+    global _cdm_evaluator
+    _cdm_evaluator = CDM(output_root=output_root, cache_dir=cache_dir, cache_max_size_mb=cache_max_size_mb)
+
+
+def _cdm_chunk_scores(args):
+    """
+    Worker function scoring a chunk of (gt, pred, img_id) formulas, whose pages are given for the trace, with the
+    worker's evaluator. The chunk is rendered first in batches of render_batch_size, one xelatex/magick run per
+    batch; anything a batch fails to produce is rendered one by one when the formula is scored.
+    """
+    formulas, render_batch_size, pages = args
+    with span('CDM.chunk', formulas=len(formulas)):
+        if render_batch_size > 1:
+            for i in range(0, len(formulas), render_batch_size):
+                try:
+                    with span('CDM.render_batch', formulas=len(formulas[i:i+render_batch_size])):
+                        _cdm_evaluator.generate_bboxes_batch(formulas[i:i+render_batch_size])
+                except Exception as exc:
+                    print(f'CDM batch rendering generated an exception: {exc}')
+        scores = []
+        for (gt, pred, img_id), page in zip(formulas, pages):
+            with span('CDM.formula', page=page):
+                scores.append(_cdm_evaluator.evaluate(gt, pred, img_id)["F1_score"])
+        return scores
 
 
 @METRIC_REGISTRY.register("CDM")
 class call_CDM():
     def __init__(self, samples):
         self.samples = samples
-    def evaluate(self, group_info=[], save_name='default', max_workers=32):
-        group_scores = defaultdict(list)
+    def evaluate(self, group_info=[], save_name='default', max_workers=None, chunk_size=16, render_batch_size=16,
+                 cache_dir=None, cache_max_size_mb=4096, result_format='json'):
+        """
+        max_workers processes (min(32, CPUs) by default, 1 runs in this process) each build one CDM evaluator and
+        score chunks of chunk_size formulas; only the cleaned texts go to the workers and only the scores come back.
+        cache_dir enables the render cache shared across runs and models, limited to cache_max_size_mb.
+        """
         output_root = f"result/{save_name}/CDM"
-        
-        if isinstance(self.samples, list):
-            original_samples = self.samples
-        else:
-            original_samples = self.samples.samples
-        
-        # Prepare arguments for concurrent processing
-        worker_args = []
-        for idx, sample in enumerate(original_samples):
-            worker_args.append((idx, sample, output_root, group_info))
-        
-        # Use concurrent execution
-        per_sample_score = {}
-        cdm_samples = []
-        results = []
-        
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_idx = {executor.submit(_process_single_cdm_sample, args): args[0] for args in worker_args}
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_idx):
+        store = SampleStore.of(self.samples)
+        original_samples = store.samples
+
+        formulas = [_clean_cdm_latex(sample['gt'], sample['pred']) + (str(idx),) for idx, sample in enumerate(original_samples)]
+        chunks = [formulas[i:i+chunk_size] for i in range(0, len(formulas), chunk_size)]
+        # the page of each formula, for the spans of the trace
+        pages = [sample.get('img_id') for sample in original_samples]
+        chunk_pages = [pages[i:i+chunk_size] for i in range(0, len(formulas), chunk_size)]
+        chunk_scores = [None] * len(chunks)
+        max_workers = max_workers or min(32, os.cpu_count() or 1)
+
+        def score_chunk(chunk_idx, chunk_result, run):
+            """
+            Scores of a chunk, given by chunk_result(); if it raises, the formulas of the chunk are scored again one at
+            a time with run(args) -> scores, so that one failing formula does not zero its whole chunk.
+            """
+            chunk, pages = chunks[chunk_idx], chunk_pages[chunk_idx]
+            try:
+                return chunk_result()
+            except Exception as exc:
+                print(f'Samples {chunk[0][2]}-{chunk[-1][2]} generated an exception: {exc}, scoring them one by one')
+            scores = []
+            for formula, page in zip(chunk, pages):
                 try:
-                    result = future.result()
-                    results.append(result)
+                    scores.append(run(([formula], 1, [page]))[0])
                 except Exception as exc:
-                    idx = future_to_idx[future]
-                    print(f'Sample {idx} generated an exception: {exc}')
-                    # Create a default result for failed samples
-                    sample_copy = copy.deepcopy(original_samples[idx])
-                    sample_copy['img_id_cdm'] = str(idx)
-                    if not sample_copy.get('metric'):
-                        sample_copy['metric'] = {}
-                    sample_copy['metric']['CDM'] = 0.0
-                    results.append({
-                        'sample': sample_copy,
-                        'cdm_score': 0.0,
-                        'sample_key': sample_copy['img_id'] + '_' + str(sample_copy.get('gt_idx', 0)),
-                        'matched_groups': [],
-                        'original_index': idx
-                    })
-        
-        # Sort results by original index to maintain order
-        results.sort(key=lambda x: x['original_index'])
-        
-        # Process results
-        for result in results:
-            sample = result['sample']
-            cdm_score = result['cdm_score']
-            sample_key = result['sample_key']
-            matched_groups = result['matched_groups']
-            
-            cdm_samples.append(sample)
-            per_sample_score[sample_key] = cdm_score
-            group_scores['all'].append(cdm_score)
-            
-            # Add scores to matched groups
-            for group_name in matched_groups:
-                group_scores[group_name].append(cdm_score)
+                    print(f'Sample {formula[2]} generated an exception: {exc}')
+                    scores.append(0.0)
+            return scores
+
+        with tqdm(total=len(formulas), desc='CDM') as progress:
+            if max_workers == 1:
+                _init_cdm_worker(output_root, cache_dir, cache_max_size_mb)
+                for chunk_idx, chunk in enumerate(chunks):
+                    chunk_scores[chunk_idx] = score_chunk(
+                        chunk_idx, lambda: _cdm_chunk_scores((chunk, render_batch_size, chunk_pages[chunk_idx])), _cdm_chunk_scores)
+                    progress.update(len(chunk))
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_cdm_worker, initargs=(output_root, cache_dir, cache_max_size_mb)) as executor:
+                    future_to_chunk = {executor.submit(_cdm_chunk_scores, (chunk, render_batch_size, chunk_pages[chunk_idx])): chunk_idx
+                                       for chunk_idx, chunk in enumerate(chunks)}
+                    for future in as_completed(future_to_chunk):
+                        chunk_idx = future_to_chunk[future]
+                        chunk_scores[chunk_idx] = score_chunk(
+                            chunk_idx, future.result, lambda args: executor.submit(_cdm_chunk_scores, args).result())
+                        progress.update(len(chunks[chunk_idx]))
+        scores = [score for chunk in chunk_scores for score in chunk]
+
+        per_sample_score = {}
+        for sample, cdm_score in zip(original_samples, scores):
+            per_sample_score[sample['img_id'] + '_' + str(sample.get('gt_idx', 0))] = cdm_score
+
+        # the following metrics and the reports see the cleaned texts, as rows sharing the columns added so far
+        cdm_store = store.derive([dict(sample, gt=gt, pred=pred) for sample, (gt, pred, _) in zip(original_samples, formulas)])
+        cdm_store.add_column('img_id_cdm', [img_id for _, _, img_id in formulas])
+        cdm_store.add_score('CDM', scores)
 
         # Save results to files
         with open(f'./result/{save_name}_per_sample_CDM.json', 'w', encoding='utf-8') as f:
             json.dump(per_sample_score, f, indent=4, ensure_ascii=False)
 
-        with open(f'result/{save_name}_result.json', 'w', encoding='utf-8') as f:
-            json.dump(cdm_samples, f, indent=4, ensure_ascii=False)
+        write_results(f'result/{save_name}_result', cdm_store.rows(), result_format)
 
-        # Calculate final results
-        result = {}
-        for group_name, scores in group_scores.items():
-            if len(scores) > 0:
-                result[group_name] = sum(scores) / len(scores)    # average of normalized scores at sample level
-            else:
-                result[group_name] = 'NaN'
-                print(f'Warning: Empty matched samples for {group_name}.')
-        
-        return cdm_samples, {'CDM': result}
+        # average of normalized scores at sample level, for all samples and each group of element attributes
+        result = group_means(cdm_store, cdm_store.score('CDM'), group_info)
 
+        return cdm_store, {'CDM': result}
 
 @METRIC_REGISTRY.register("CDM_plain")
 class call_CDM_plain():
     def __init__(self, samples):
         self.samples = samples
     def evaluate(self, group_info=[], save_name='default'):
-        if isinstance(self.samples, list):
-            cdm_samples = copy.deepcopy(self.samples)
-        else:
-            cdm_samples = copy.deepcopy(self.samples.samples)
+        store = SampleStore.of(self.samples)
+        cdm_samples = list(store.rows())   # copies, the samples keep their texts
         for idx, sample in enumerate(cdm_samples):
             sample['img_name'] = sample['img_id']
             sample['img_id'] = str(idx)
@@ -334,4 +355,14 @@ class call_CDM_plain():
         # time_stap = time.time()
         with open(f'result/{save_name}_formula.json', 'w', encoding='utf-8') as f:
             json.dump(cdm_samples, f, indent=4, ensure_ascii=False)
-        return self.samples, False
\ No newline at end of file
+        return store, False
+
+
+@METRIC_REGISTRY.register("COCODet")
+class call_COCODet():
+    def __init__(self, samples):
+        self.samples = samples
+    def evaluate(self, group_info=[], save_name='default', num_workers=1):
+        """COCO bbox mAP of the detection samples ({'gts', 'preds', 'classes'}), num_workers > 1 evaluates the categories in a process pool"""
+        evaluator = COCODetectionEvaluator(self.samples['classes'], num_workers=num_workers)
+        return self.samples, evaluator(predictions=self.samples['preds'], groundtruths=self.samples['gts'])
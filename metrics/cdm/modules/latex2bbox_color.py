@@ -6,6 +6,7 @@ import logging
 import subprocess
 import numpy as np
 
+from collections import defaultdict
 from threading import Timer
 from PIL import Image, ImageDraw
 from .latex_processor import (
@@ -15,6 +16,17 @@ from .latex_processor import (
 )
 from .tokenize_latex.tokenize_latex import tokenize_latex
 
+try:
+    from utils.trace import span, traced
+except ImportError:   # the standalone CDM tool, without the tracing of the evaluation
+    from contextlib import nullcontext
+
+    def span(name, **args):
+        return nullcontext()
+
+    def traced(name):
+        return lambda func: func
+
 
 tabular_template = r"""
 \documentclass[12pt]{article}
@@ -95,9 +107,10 @@ def run_cmd(cmd, timeout_sec=30, temp_dir=None):
     finally:
         timer.cancel()
         
-def convert_pdf2img(pdf_filename, png_filename, temp_dir=None):
+@traced('CDM.magick')
+def convert_pdf2img(pdf_filename, png_filename, temp_dir=None, timeout_sec=30):
     cmd = "magick -density 200 -quality 100 \"%s\" \"%s\""%(pdf_filename, png_filename)
-    run_cmd(cmd, temp_dir=temp_dir)
+    run_cmd(cmd, timeout_sec=timeout_sec, temp_dir=temp_dir)
 
 def crop_image(image_path, pad=8):
     img = Image.open(image_path).convert("L")
@@ -117,91 +130,129 @@ def crop_image(image_path, pad=8):
     img = Image.open(image_path).convert("RGB").crop((x_min-pad, y_min-pad, x_max+pad, y_max+pad))
     img.save(image_path)
     
+# pixels of a token color needed to count it as rendered on a page, the antialiased edges of the glyphs give a
+# few pixels of arbitrary colors
+MIN_COLOR_PIXELS = 16
+
+def rgb_to_code(rgb):
+    # pack R, G, B into a single integer so a pixel can be compared with one operation
+    rgb = np.asarray(rgb, dtype=np.int64)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
 def extrac_bbox_from_color_image(image_path, color_list):
     img = Image.open(image_path).convert("RGB")
     W, H = img.size
-    pixels = list(img.getdata())
-    
-    bbox_list = []
-    for target_color in color_list:
-        target_pixels = [ i for i, pixel in enumerate(pixels)if pixel == target_color ]
-        x_list = []
-        y_list = []
-        for idx in target_pixels:
-            x_list.append(idx % W)
-            y_list.append(idx // W)
-        try:
-            y_min, y_max, x_min, x_max = min(y_list), max(y_list), min(x_list), max(x_list)
-            bbox_list.append([x_min-1, y_min-1, x_max+1, y_max+1])
+    pixel_codes = rgb_to_code(np.asarray(img)).ravel()
+
+    bbox_list = [[] for _ in color_list]
+    if len(color_list) > 0:
+        # map every pixel to its token color in one pass, then reduce min/max x/y per color
+        color_codes, color_inverse = np.unique(rgb_to_code(color_list), return_inverse=True)
+        color_pos = np.minimum(np.searchsorted(color_codes, pixel_codes), len(color_codes) - 1)
+        pixel_idx = np.flatnonzero(color_codes[color_pos] == pixel_codes)
+        if len(pixel_idx) > 0:
+            pixel_color = color_pos[pixel_idx]
+            order = np.argsort(pixel_color, kind='stable')
+            pixel_color, pixel_idx = pixel_color[order], pixel_idx[order]
+            xs, ys = pixel_idx % W, pixel_idx // W
+            found, starts = np.unique(pixel_color, return_index=True)
+            x_min, x_max = np.minimum.reduceat(xs, starts), np.maximum.reduceat(xs, starts)
+            y_min, y_max = np.minimum.reduceat(ys, starts), np.maximum.reduceat(ys, starts)
+            color_boxes = {}
+            for i, code_idx in enumerate(found.tolist()):
+                color_boxes[code_idx] = [int(x_min[i])-1, int(y_min[i])-1, int(x_max[i])+1, int(y_max[i])+1]
+            for idx, code_idx in enumerate(color_inverse.tolist()):
+                if code_idx in color_boxes:
+                    bbox_list[idx] = list(color_boxes[code_idx])
 
-        except:
-            bbox_list.append([])
-            continue
-        
     img = img.convert("L")
     img_bw = img.point(lambda x: 255 if x == 255 else 0, '1')
     img_bw.convert("RGB").save(image_path) 
     return bbox_list
 
+def page_colors_match(image_path, color_list, total_color_list, min_pixels=MIN_COLOR_PIXELS):
+    """
+    Whether a rendered page holds the formula of color_list: some of its token colors and none of the colors of
+    total_color_list it does not use. Every formula is colored from the start of total_color_list, so the content
+    of a longer neighbour shifted onto the page shows up as colors beyond color_list.
+    """
+    codes, counts = np.unique(rgb_to_code(np.asarray(Image.open(image_path).convert("RGB"))), return_counts=True)
+    rendered = set(codes[counts >= min_pixels].tolist())
+    expected = set(rgb_to_code(color_list).tolist()) if len(color_list) > 0 else set()
+    foreign = set(rgb_to_code(total_color_list[len(color_list):]).tolist()) if len(total_color_list) > len(color_list) else set()
+    if rendered & foreign:
+        return False
+    return not expected or bool(rendered & expected)
 
-def latex2bbox_color(input_arg):
-    latex, basename, output_path, temp_dir, total_color_list = input_arg
-    template = tabular_template if "tabular" in latex else formular_template
-    basename = basename.replace('.jpg', '')# *****
-    output_bbox_path = os.path.join(output_path, 'bbox', basename+'.jsonl')
-    output_vis_path = os.path.join(output_path, 'vis', basename+'.png')
-    output_base_path = os.path.join(output_path, 'vis', basename+'_base.png')
-    
-    if os.path.exists(output_bbox_path) and os.path.exists(output_vis_path) and os.path.exists(output_base_path):
-        return
-    
-    try:
-        latex = latex.replace("\n", " ")
-        latex = latex.replace("\%", "<PERCENTAGETOKEN>")
-        ret, new_latex = tokenize_latex(latex, middle_file=os.path.join(temp_dir, basename+'.txt'))
-        if not(ret and new_latex):
-            log = f"ERROR, Tokenize latex failed: {basename}."
-            logging.info(log)
-            new_latex = latex
-        new_latex = new_latex.replace("< P E R C E N T A G E T O K E N >", "\%")
-        latex = normalize_latex(new_latex)
-        token_list = []
-        l_split = latex.strip().split(' ')
-        color_list = total_color_list[0:len(l_split)]
-        idx = 0
-        while idx < len(l_split):
-            l_split, idx, token_list = token_add_color_RGB(l_split, idx, token_list)
-
-        rgb_latex = " ".join(l_split)
-        for idx, color in enumerate(color_list):
-            R, G, B = color
-            rgb_latex = rgb_latex.replace(f"<color_{idx}>", f"{R},{G},{B}")
-
-        if len(token_list) > 1300:
-            paper_size = 3
-        elif len(token_list) > 600:
-            paper_size = 4
-        else:
-            paper_size = 5
-        final_latex = formular_template.replace("<PaperSize>", str(paper_size)) % rgb_latex
-        
-    except Exception as e:
-        log = f"ERROR, Preprocess latex failed: {basename}; {e}."
+def draw_bbox_vis(base_path, token_boxes, vis_path):
+    vis = Image.open(base_path)
+    draw = ImageDraw.Draw(vis)
+    for token, box in token_boxes:
+        if not box:
+            continue
+        x_min, y_min, x_max, y_max = box
+        draw.rectangle([x_min, y_min, x_max, y_max], fill=None, outline=(0,250,0), width=1)
+        try:
+            draw.text((x_min, y_min), token, (250,0,0))
+        except:
+            pass
+    vis.save(vis_path)
+
+
+def color_latex(latex, basename, temp_dir, total_color_list):
+    latex = latex.replace("\n", " ")
+    latex = latex.replace("\%", "<PERCENTAGETOKEN>")
+    with span('CDM.tokenize'):
+        ret, new_latex = tokenize_latex(latex)
+    if not(ret and new_latex):
+        log = f"ERROR, Tokenize latex failed: {basename}."
         logging.info(log)
-        return
-    
-    pre_name = output_path.replace('/', '_').replace('.','_') + '_' + basename
+        new_latex = latex
+    new_latex = new_latex.replace("< P E R C E N T A G E T O K E N >", "\%")
+    latex = normalize_latex(new_latex)
+    token_list = []
+    l_split = latex.strip().split(' ')
+    color_list = total_color_list[0:len(l_split)]
+    idx = 0
+    while idx < len(l_split):
+        l_split, idx, token_list = token_add_color_RGB(l_split, idx, token_list)
+
+    rgb_latex = " ".join(l_split)
+    for idx, color in enumerate(color_list):
+        R, G, B = color
+        rgb_latex = rgb_latex.replace(f"<color_{idx}>", f"{R},{G},{B}")
+
+    if len(token_list) > 1300:
+        paper_size = 3
+    elif len(token_list) > 600:
+        paper_size = 4
+    else:
+        paper_size = 5
+    return rgb_latex, paper_size, token_list, color_list
+
+def read_latex_errors(log_filename):
+    """The error lines ("! ...") of a xelatex log, which nonstopmode otherwise goes past"""
+    if not os.path.exists(log_filename):
+        return []
+    with open(log_filename, encoding='utf-8', errors='replace') as f:
+        return [line.strip() for line in f if line.startswith('! ')]
+
+@traced('CDM.xelatex')
+def compile_latex(final_latex, pre_name, temp_dir, timeout_sec=30, errors=None):
+    """
+    Compile final_latex to a pdf, return its path or None. When errors is a list, the errors reported in the
+    xelatex log are appended to it: a document with errors can still compile to a plausible pdf.
+    """
     tex_filename = os.path.join(temp_dir, pre_name+'.tex')
     log_filename = os.path.join(temp_dir, pre_name+'.log')
     aux_filename = os.path.join(temp_dir, pre_name+'.aux')
     
-    # print(os.path.exists(tex_filename), tex_filename)
     with open(tex_filename, "w") as w: 
-        # print(final_latex, file=w)
         w.write(final_latex)
-    # print(os.path.exists(tex_filename), tex_filename)
     # run_cmd(f"pdflatex -interaction=nonstopmode -output-directory={temp_dir} {tex_filename} >/dev/null")
-    run_cmd(f"xelatex -interaction=nonstopmode -output-directory={temp_dir} \"{tex_filename}\" >/dev/null", temp_dir=temp_dir)
+    run_cmd(f"xelatex -interaction=nonstopmode -output-directory={temp_dir} \"{tex_filename}\" >/dev/null", timeout_sec=timeout_sec, temp_dir=temp_dir)
+    if errors is not None:
+        errors.extend(read_latex_errors(log_filename))
     try:
         os.remove(tex_filename)
         os.remove(log_filename)
@@ -212,30 +263,112 @@ def latex2bbox_color(input_arg):
     if not os.path.exists(pdf_filename):
         log = f"ERROR, Compile pdf failed: {pdf_filename}"
         logging.info(log)
-    else:
+        return None
+    return pdf_filename
+
+@traced('CDM.extract_bbox')
+def save_bbox_outputs(output_base_path, token_list, color_list, output_bbox_path, output_vis_path):
+    crop_image(output_base_path)
+    bbox_list = extrac_bbox_from_color_image(output_base_path, color_list)
+
+    with open(output_bbox_path, 'w', encoding='utf-8') as f:
+        for token, box in zip(token_list, bbox_list):
+            item = {
+                "bbox": box,
+                "token": token
+            }
+            f.write(json.dumps(item, ensure_ascii=False)+'\n')
+
+    draw_bbox_vis(output_base_path, zip(token_list, bbox_list), output_vis_path)
+
+def get_output_paths(output_path, basename):
+    output_bbox_path = os.path.join(output_path, 'bbox', basename+'.jsonl')
+    output_vis_path = os.path.join(output_path, 'vis', basename+'.png')
+    output_base_path = os.path.join(output_path, 'vis', basename+'_base.png')
+    return output_bbox_path, output_vis_path, output_base_path
+
+
+def latex2bbox_color(input_arg):
+    latex, basename, output_path, temp_dir, total_color_list = input_arg
+    template = tabular_template if "tabular" in latex else formular_template
+    basename = basename.replace('.jpg', '')# *****
+    output_bbox_path, output_vis_path, output_base_path = get_output_paths(output_path, basename)
+    
+    if os.path.exists(output_bbox_path) and os.path.exists(output_vis_path) and os.path.exists(output_base_path):
+        return
+    
+    try:
+        rgb_latex, paper_size, token_list, color_list = color_latex(latex, basename, temp_dir, total_color_list)
+        final_latex = formular_template.replace("<PaperSize>", str(paper_size)) % rgb_latex
+        
+    except Exception as e:
+        log = f"ERROR, Preprocess latex failed: {basename}; {e}."
+        logging.info(log)
+        return
+    
+    pre_name = output_path.replace('/', '_').replace('.','_') + '_' + basename
+    pdf_filename = compile_latex(final_latex, pre_name, temp_dir)
+    if pdf_filename:
         convert_pdf2img(pdf_filename, output_base_path)
         os.remove(pdf_filename)
-        
-        crop_image(output_base_path)
-        bbox_list = extrac_bbox_from_color_image(output_base_path, color_list)
-        vis = Image.open(output_base_path)
-        draw = ImageDraw.Draw(vis)
-
-        with open(output_bbox_path, 'w', encoding='utf-8') as f:
-            for token, box in zip(token_list, bbox_list):
-                item = {
-                    "bbox": box,
-                    "token": token
-                }
-                f.write(json.dumps(item, ensure_ascii=False)+'\n')
-
-                if not box:
-                    continue
-                x_min, y_min, x_max, y_max = box
-                draw.rectangle([x_min, y_min, x_max, y_max], fill=None, outline=(0,250,0), width=1)
-                try:
-                    draw.text((x_min, y_min), token, (250,0,0))
-                except:
-                    pass
-            
-        vis.save(output_vis_path)
+        save_bbox_outputs(output_base_path, token_list, color_list, output_bbox_path, output_vis_path)
+
+
+def latex2bbox_color_batch(input_args, output_path, temp_dir, total_color_list):
+    """
+    Render many formulas with one xelatex and one magick call per paper size.
+
+    input_args is a list of (latex, basename). Each formula goes on its own page of a shared document,
+    the pages are rasterized in one pass and split back into the per-formula bbox/vis outputs written
+    by latex2bbox_color. A broken formula can swallow a page break or push its content onto the page of
+    a neighbour, so a batch is rendered again one formula at a time when xelatex reports an error, when
+    its page count does not match its formulas, or when a page does not hold the colors of its formula.
+    """
+    pending = defaultdict(list)
+    for latex, basename in input_args:
+        basename = basename.replace('.jpg', '')
+        output_bbox_path, output_vis_path, output_base_path = get_output_paths(output_path, basename)
+        if os.path.exists(output_bbox_path) and os.path.exists(output_vis_path) and os.path.exists(output_base_path):
+            continue
+        try:
+            rgb_latex, paper_size, token_list, color_list = color_latex(latex, basename, temp_dir, total_color_list)
+        except Exception as e:
+            log = f"ERROR, Preprocess latex failed: {basename}; {e}."
+            logging.info(log)
+            continue
+        pending[paper_size].append((latex, basename, rgb_latex, token_list, color_list))
+
+    for paper_size, items in pending.items():
+        page_break = "\n\\end{displaymath}\n\\clearpage\n\\begin{displaymath}\n"
+        final_latex = formular_template.replace("<PaperSize>", str(paper_size)) % page_break.join(item[2] for item in items)
+        pre_name = output_path.replace('/', '_').replace('.','_') + f'_batch_{items[0][1]}_{paper_size}'
+        errors = []
+        pdf_filename = compile_latex(final_latex, pre_name, temp_dir, timeout_sec=30+2*len(items), errors=errors)
+
+        page_files = []
+        if pdf_filename:
+            page_pattern = os.path.join(temp_dir, pre_name+'_page_%d.png')
+            convert_pdf2img(pdf_filename, page_pattern, temp_dir=temp_dir, timeout_sec=30+2*len(items))
+            os.remove(pdf_filename)
+            page_files = [page_pattern % idx for idx in range(len(items)+1) if os.path.exists(page_pattern % idx)]
+
+        if errors:
+            log = f"ERROR, Batch render of {len(items)} formulas failed ({errors[0]}), rendering them one by one."
+        elif len(page_files) != len(items):
+            log = f"ERROR, Batch render got {len(page_files)} pages for {len(items)} formulas, rendering them one by one."
+        elif not all(page_colors_match(page_file, item[4], total_color_list) for page_file, item in zip(page_files, items)):
+            log = f"ERROR, Batch render put a formula on the wrong page, rendering {len(items)} formulas one by one."
+        else:
+            log = None
+        if log:
+            logging.info(log)
+            for page_file in page_files:
+                os.remove(page_file)
+            for latex, basename, _, _, _ in items:
+                latex2bbox_color((latex, basename, output_path, temp_dir, total_color_list))
+            continue
+
+        for page_file, (_, basename, _, token_list, color_list) in zip(page_files, items):
+            output_bbox_path, output_vis_path, output_base_path = get_output_paths(output_path, basename)
+            shutil.move(page_file, output_base_path)
+            save_bbox_outputs(output_base_path, token_list, color_list, output_bbox_path, output_vis_path)
@@ -0,0 +1,142 @@
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+import uuid
+
+from .latex2bbox_color import formular_template, draw_bbox_vis
+
+# bump when the rendering pipeline changes in a way the renderer fingerprint does not see, e.g. new fonts
+RENDER_CACHE_VERSION = "2"
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+# code that turns a formula into its colored render and token boxes
+RENDERER_SOURCES = ['latex2bbox_color.py', 'latex_processor.py', os.path.join('tokenize_latex', 'tokenize_latex.py'),
+                    os.path.join('tokenize_latex', 'preprocess_formula.js')]
+RENDERER_TOOLS = [['xelatex', '--version'], ['magick', '--version'], ['node', '--version']]
+
+
+def tool_version(cmd):
+    try:
+        output = subprocess.run(cmd, capture_output=True, text=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return 'missing'
+    return output.strip().split('\n')[0]
+
+
+def renderer_fingerprint():
+    """Hash of the xelatex template, the renderer sources and the xelatex, magick and node versions"""
+    digest = hashlib.sha256()
+    digest.update(formular_template.encode('utf-8'))
+    for name in RENDERER_SOURCES:
+        with open(os.path.join(MODULE_DIR, name), 'rb') as f:
+            digest.update(f.read())
+    for cmd in RENDERER_TOOLS:
+        digest.update(tool_version(cmd).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def normalize_cache_latex(latex):
+    # same whitespace handling latex2bbox_color applies before tokenizing
+    return latex.replace("\n", " ").strip()
+
+
+class RenderCache:
+    """
+    On-disk, content-addressed cache of CDM renders shared across runs and models.
+
+    An entry is keyed by a hash of the normalized LaTeX and of the renderer fingerprint (xelatex template,
+    renderer sources, xelatex/magick/node versions), so a renderer change never reuses stale boxes. The paper
+    size is chosen from the token count of the LaTeX itself, so it is covered by the same key.
+    Each entry stores the bbox JSONL and the base PNG; the vis PNG is redrawn from them on a hit.
+    The least recently used entries are evicted once the cache grows beyond max_size_mb.
+    """
+    def __init__(self, cache_dir, max_size_mb=4096, check_interval=64):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.check_interval = check_interval
+        self.puts_since_check = 0
+        self.fingerprint = renderer_fingerprint()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, latex):
+        content = '\n'.join([RENDER_CACHE_VERSION, self.fingerprint, normalize_cache_latex(latex)])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _entry_paths(self, key):
+        entry_dir = os.path.join(self.cache_dir, key[:2])
+        return entry_dir, os.path.join(entry_dir, key + '.jsonl'), os.path.join(entry_dir, key + '_base.png')
+
+    def load(self, latex, output_path, basename):
+        """Restore a cached render into output_path. Returns False on a cache miss."""
+        _, cache_bbox_path, cache_base_path = self._entry_paths(self.key(latex))
+        if not (os.path.exists(cache_bbox_path) and os.path.exists(cache_base_path)):
+            return False
+
+        output_bbox_path = os.path.join(output_path, 'bbox', basename+'.jsonl')
+        output_vis_path = os.path.join(output_path, 'vis', basename+'.png')
+        output_base_path = os.path.join(output_path, 'vis', basename+'_base.png')
+        try:
+            shutil.copyfile(cache_bbox_path, output_bbox_path)
+            shutil.copyfile(cache_base_path, output_base_path)
+            with open(output_bbox_path, 'r', encoding='utf-8') as f:
+                items = [json.loads(line) for line in f]
+            draw_bbox_vis(output_base_path, [(item['token'], item['bbox']) for item in items], output_vis_path)
+            # mark the entry as recently used
+            os.utime(cache_bbox_path)
+            os.utime(cache_base_path)
+        except (OSError, ValueError):  # entry evicted or written concurrently, render it again
+            return False
+        return True
+
+    def save(self, latex, output_path, basename):
+        """Store a finished render. Failed renders (missing outputs) are not cached."""
+        output_bbox_path = os.path.join(output_path, 'bbox', basename+'.jsonl')
+        output_base_path = os.path.join(output_path, 'vis', basename+'_base.png')
+        if not (os.path.exists(output_bbox_path) and os.path.exists(output_base_path)):
+            return
+
+        entry_dir, cache_bbox_path, cache_base_path = self._entry_paths(self.key(latex))
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            # write to a private temp name first so concurrent workers never see partial files
+            for src, dst in [(output_base_path, cache_base_path), (output_bbox_path, cache_bbox_path)]:
+                tmp = f'{dst}.{uuid.uuid4().hex}.tmp'
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, dst)
+        except OSError:  # a full or read-only cache must not fail the evaluation
+            return
+
+        self.puts_since_check += 1
+        if self.puts_since_check >= self.check_interval:
+            self.puts_since_check = 0
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is below max_size."""
+        entries = {}
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                key = name.split('.')[0].replace('_base', '')
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                size, last_used, paths = entries.get(key, (0, 0, []))
+                entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime), paths + [path])
+
+        total_size = sum(size for size, _, _ in entries.values())
+        if total_size <= self.max_size:
+            return
+        for size, _, paths in sorted(entries.values(), key=lambda x: x[1]):
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
+            if total_size <= self.max_size:
+                break
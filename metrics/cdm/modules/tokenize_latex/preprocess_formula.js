@@ -9,7 +9,11 @@ var rl = readline.createInterface({
 });
 
 
-rl.on('line', function(line){
+var serve_mode = process.argv[3] == "--serve";
+
+// Tokenize one line of latex and return the output line.
+function process_line(line){
+    var output;
     a = line
     if (line[0] == "%") {
         line = line.substr(1, line.length - 1);
@@ -40,7 +44,7 @@ rl.on('line', function(line){
 
         if (process.argv[2] == "tokenize") {
             var tree = katex.__parse(line, {});
-            console.log(global_str.replace(/\\label { .*? }/, ""));
+            output = global_str.replace(/\\label { .*? }/, "");
         } else {
             for (var i = 0; i < 300; ++i) {
                 line = line.replace(/{\\rm/, "\\mathrm{");
@@ -54,16 +58,32 @@ rl.on('line', function(line){
                 norm_str = norm_str.replace('SSSSSS', '$');
                 norm_str = norm_str.replace(' S S S S S S', '$');
             }
-            console.log(norm_str.replace(/\\label { .*? }/, ""));
+            output = norm_str.replace(/\\label { .*? }/, "");
         }
     } catch (e) {
         console.error(line);
         console.error(norm_str);
         console.error(e);
-        console.log();
+        output = "";
     }
     global_str = ""
     norm_str = ""
+    return output
+}
+
+// With --serve, every stdin line is a JSON request {"id", "latex"} answered by one JSON line
+// {"id", "output"}, so a single long-lived process can tokenize many formulas.
+rl.on('line', function(line){
+    if (serve_mode) {
+        var request = JSON.parse(line);
+        var lines = request.latex.split(/\r\n|\n|\r/);
+        if (lines[lines.length - 1] === "") {
+            lines.pop();
+        }
+        process.stdout.write(JSON.stringify({id: request.id, output: lines.map(process_line)}) + "\n");
+    } else {
+        console.log(process_line(line));
+    }
 })
 
 
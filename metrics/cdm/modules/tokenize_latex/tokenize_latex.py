@@ -2,7 +2,11 @@
 # tokenize latex formulas
 import sys
 import os
+import io
 import re
+import json
+import atexit
+import threading
 import argparse
 import subprocess
 import shutil
@@ -20,43 +24,99 @@ def run_cmd(cmd, timeout_sec=30):
     finally:
         timer.cancel()
         
+class TokenizerWorker:
+    """
+    A long-lived node (KaTeX) process answering newline-delimited JSON requests on stdin/stdout.
+
+    One worker is kept per script and mode in each Python process. A request that crashes or times out
+    the node process fails on its own, and the process is started again for the next request.
+    """
+    def __init__(self, script, mode, timeout_sec=30):
+        self.cmd = ['node', os.path.join(os.path.dirname(__file__), script), mode, '--serve']
+        self.timeout_sec = timeout_sec
+        self.proc = None
+        self.request_id = 0
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     encoding='utf-8', bufsize=1)
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def request(self, latex):
+        """Return the output lines for the input lines of latex, or None if the tokenizer failed"""
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self._start()
+            self.request_id += 1
+            timer = Timer(self.timeout_sec, lambda p: p.kill(), [self.proc])
+            try:
+                timer.start()
+                self.proc.stdin.write(json.dumps({'id': self.request_id, 'latex': latex}) + '\n')
+                self.proc.stdin.flush()
+                response = json.loads(self.proc.stdout.readline())
+                if response['id'] != self.request_id:
+                    raise ValueError(f"Unexpected tokenizer response {response['id']}")
+                return response['output']
+            except (OSError, ValueError, KeyError):
+                # crashed, killed by the timer or out of sync: restart on the next request
+                self.close()
+                return None
+            finally:
+                timer.cancel()
+
+
+_workers = {}
+
+def get_tokenizer_worker(script, mode):
+    # workers are per process, a forked child must not share the parent's pipes
+    key = (os.getpid(), script, mode)
+    if key not in _workers:
+        _workers[key] = TokenizerWorker(script, mode)
+    return _workers[key]
+
+@atexit.register
+def close_tokenizer_workers():
+    for key, worker in list(_workers.items()):
+        if key[0] == os.getpid():
+            worker.close()
+
+
 def tokenize_latex(latex_code, latex_type="", middle_file=""):
+    # middle_file is kept for backward compatibility, tokenizing no longer writes any file
     if not latex_code:
         return False, latex_code
     if not latex_type:
         latex_type = "tabular" if "tabular" in latex_code else "formula"
-    if not middle_file:
-        middle_file = "out-" + datetime.now().strftime('%Y_%m_%d_%H_%M_%S') + ".txt"
-    temp_file = middle_file + '.tmp'
     
     if latex_type == "formula":
-        with open(temp_file, 'w') as f:
-            prepre = latex_code
-            # replace split, align with aligned
-            prepre = re.sub(r'\\begin{(split|align|alignedat|alignat|eqnarray)\*?}(.+?)\\end{\1\*?}', r'\\begin{aligned}\2\\end{aligned}', prepre, flags=re.S)
-            prepre = re.sub(r'\\begin{(smallmatrix)\*?}(.+?)\\end{\1\*?}', r'\\begin{matrix}\2\\end{matrix}', prepre, flags=re.S)
-            f.write(prepre)
+        prepre = latex_code
+        # replace split, align with aligned
+        prepre = re.sub(r'\\begin{(split|align|alignedat|alignat|eqnarray)\*?}(.+?)\\end{\1\*?}', r'\\begin{aligned}\2\\end{aligned}', prepre, flags=re.S)
+        prepre = re.sub(r'\\begin{(smallmatrix)\*?}(.+?)\\end{\1\*?}', r'\\begin{matrix}\2\\end{matrix}', prepre, flags=re.S)
     
-        cmd = r"cat %s | node %s %s > %s " % (temp_file, os.path.join(os.path.dirname(__file__), 'preprocess_formula.js'), 'normalize', middle_file)
-        ret = subprocess.call(cmd, shell=True)
-        os.remove(temp_file)
-        if ret != 0:
+        output = get_tokenizer_worker('preprocess_formula.js', 'normalize').request(prepre)
+        if output is None or not output:
             return False, latex_code
         
         operators = '\s?'.join('|'.join(['arccos', 'arcsin', 'arctan', 'arg', 'cos', 'cosh', 'cot', 'coth', 'csc', 'deg', 'det', 'dim', 'exp', 'gcd', 'hom', 'inf',
                                         'injlim', 'ker', 'lg', 'lim', 'liminf', 'limsup', 'ln', 'log', 'max', 'min', 'Pr', 'projlim', 'sec', 'sin', 'sinh', 'sup', 'tan', 'tanh']))
         ops = re.compile(r'\\operatorname {(%s)}' % operators)
-        with open(middle_file, 'r') as fin:
-            for line in fin:
-                tokens = line.strip().split()
-                tokens_out = []
-                for token in tokens:
-                    tokens_out.append(token)
-                post = ' '.join(tokens_out)
-                # use \sin instead of \operatorname{sin}
-                names = ['\\'+x.replace(' ', '') for x in re.findall(ops, post)]
-                post = re.sub(ops, lambda match: str(names.pop(0)), post).replace(r'\\ \end{array}', r'\end{array}')
-        os.remove(middle_file)
+        # read the output the same way as the lines of a text file
+        for line in io.StringIO(''.join(out + '\n' for out in output), newline=None):
+            tokens = line.strip().split()
+            tokens_out = []
+            for token in tokens:
+                tokens_out.append(token)
+            post = ' '.join(tokens_out)
+            # use \sin instead of \operatorname{sin}
+            names = ['\\'+x.replace(' ', '') for x in re.findall(ops, post)]
+            post = re.sub(ops, lambda match: str(names.pop(0)), post).replace(r'\\ \end{array}', r'\end{array}')
         return True, post
     
     elif latex_type == "tabular":
@@ -66,26 +126,17 @@ def tokenize_latex(latex_code, latex_type="", middle_file=""):
         latex_code = latex_code.replace("<PERCENTAGE_TOKEN>", "\%")
         if not "\\end{tabular}" in latex_code:
             latex_code += "\\end{tabular}"
-        with open(middle_file, 'w') as f:
-            f.write(latex_code.replace('\r', ' ').replace('\n', ' '))
-        cmd = "perl -pe 's|hskip(.*?)(cm\\|in\\|pt\\|mm\\|em)|hspace{\\1\\2}|g' %s > %s"%(middle_file, temp_file)
-        ret = subprocess.call(cmd, shell=True)
-        if ret != 0:
-            return False, latex_code
-        os.remove(middle_file)
-        cmd = r"cat %s | node %s %s > %s " % (temp_file, os.path.join(os.path.dirname(__file__), 'preprocess_tabular.js'), 'tokenize', middle_file)
-        ret = subprocess.call(cmd, shell=True)
-        os.remove(temp_file)
-        if ret != 0:
+        line = latex_code.replace('\r', ' ').replace('\n', ' ')
+        line = re.sub(r'hskip(.*?)(cm|in|pt|mm|em)', r'hspace{\1\2}', line)
+        output = get_tokenizer_worker('preprocess_tabular.js', 'tokenize').request(line)
+        if output is None or not output:
             return False, latex_code
-        with open(middle_file, 'r') as fin:
-            for line in fin:
-                tokens = line.strip().split()
-                tokens_out = []
-                for token in tokens:
-                    tokens_out.append(token)
-                post = ' '.join(tokens_out)
-        os.remove(middle_file)
+        for line in io.StringIO(''.join(out + '\n' for out in output), newline=None):
+            tokens = line.strip().split()
+            tokens_out = []
+            for token in tokens:
+                tokens_out.append(token)
+            post = ' '.join(tokens_out)
         return True, post
     else:
         print(f"latex type{latex_type} unrecognized.")
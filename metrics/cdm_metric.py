@@ -5,27 +5,34 @@ import json
 import shutil
 import numpy as np
 from PIL import Image, ImageDraw
+from utils.trace import span
 
 
 
 
 class CDM:
-    def __init__(self, output_root="./result"):
+    def __init__(self, output_root="./result", cache_dir=None, cache_max_size_mb=4096):
         """
         Initialize the LaTeX formula evaluator.
         
         Args:
             output_root (str): Root directory for saving intermediate and final results
+            cache_dir (str): Directory of the render cache shared across runs and models, None (default) disables it
+            cache_max_size_mb (int): Size limit of the render cache, least recently used renders are evicted beyond it
         """
         from .cdm.modules.visual_matcher import HungarianMatcher
+        from .cdm.modules.render_cache import RenderCache
         self.output_root = output_root
         self.matcher = HungarianMatcher()
+        self.render_cache = RenderCache(cache_dir, cache_max_size_mb) if cache_dir else None
         
         # Evaluation parameters
         self.max_iter = 3
         self.min_samples = 3
         self.residual_threshold = 25
         self.max_trials = 50
+        # colors of the rendered tokens, the same table for every formula
+        self.color_list = self.gen_color_list(num=5800)
         
     @staticmethod
     def gen_color_list(num=10, gap=15):
@@ -66,15 +73,60 @@ class CDM:
     def _generate_bboxes(self, gt_latex, pred_latex, img_id):
         """Generate bounding boxes for both GT and prediction"""
         from .cdm.modules.latex2bbox_color import latex2bbox_color
-        total_color_list = self.gen_color_list(num=5800)
         
         for subset, latex in zip(['gt', 'pred'], [gt_latex, pred_latex]):
             output_path = os.path.join(self.output_root, subset)
+            if self._has_render(output_path, img_id):
+                continue
+            if self.render_cache is not None and self.render_cache.load(latex, output_path, img_id):
+                continue
             temp_dir = os.path.join(self.output_root, f'temp_dir_{subset}_{img_id}')
             os.makedirs(temp_dir, exist_ok=True)
             
-            latex2bbox_color((latex, img_id, output_path, temp_dir, total_color_list))
+            latex2bbox_color((latex, img_id, output_path, temp_dir, self.color_list))
             shutil.rmtree(temp_dir)
+            if self.render_cache is not None:
+                self.render_cache.save(latex, output_path, img_id)
+    
+    @staticmethod
+    def _has_render(output_path, img_id):
+        """Check whether the bbox/vis outputs of a formula were already rendered (e.g. by a batch)"""
+        return all(os.path.exists(path) for path in [
+            os.path.join(output_path, 'bbox', f"{img_id}.jsonl"),
+            os.path.join(output_path, 'vis', f"{img_id}.png"),
+            os.path.join(output_path, 'vis', f"{img_id}_base.png"),
+        ])
+
+    def generate_bboxes_batch(self, formulas):
+        """
+        Render many formula pairs with one xelatex compile per subset instead of one per formula.
+        
+        Args:
+            formulas (list): (gt_latex, pred_latex, img_id) tuples; outputs land where evaluate() expects them
+        """
+        from .cdm.modules.latex2bbox_color import latex2bbox_color_batch
+        
+        for subset_idx, subset in enumerate(['gt', 'pred']):
+            output_path = os.path.join(self.output_root, subset)
+            to_render = []
+            for formula in formulas:
+                latex, img_id = formula[subset_idx], formula[2]
+                self._prepare_directories(img_id)
+                if self._has_render(output_path, img_id):
+                    continue
+                if self.render_cache is not None and self.render_cache.load(latex, output_path, img_id):
+                    continue
+                to_render.append((latex, img_id))
+            if not to_render:
+                continue
+            
+            temp_dir = os.path.join(self.output_root, f'temp_dir_{subset}_batch_{to_render[0][1]}')
+            os.makedirs(temp_dir, exist_ok=True)
+            latex2bbox_color_batch(to_render, output_path, temp_dir, self.color_list)
+            shutil.rmtree(temp_dir)
+            if self.render_cache is not None:
+                for latex, img_id in to_render:
+                    self.render_cache.save(latex, output_path, img_id)
     
     def _load_bboxes(self, img_id):
         """Load generated bounding boxes from files"""
@@ -202,15 +254,18 @@ class CDM:
         
         try:
             self._prepare_directories(img_id)
-            self._generate_bboxes(gt_latex, pred_latex, img_id)
+            with span('CDM.render'):
+                self._generate_bboxes(gt_latex, pred_latex, img_id)
             box_gt, box_pred = self._load_bboxes(img_id)
             img_gt, img_pred = self._load_images(img_id)
-            matched_idxes, inliers = self._match_boxes(box_gt, box_pred, img_gt, img_pred)
+            with span('CDM.match'):
+                matched_idxes, inliers = self._match_boxes(box_gt, box_pred, img_gt, img_pred)
         except:
             return {"recall": 0, "precision": 0, "F1_score": 0}
 
         recall, precision, F1_score = self._calculate_metrics(box_gt, box_pred, inliers)
-        self._visualize_matches(img_gt, img_pred, box_gt, box_pred, matched_idxes, inliers, img_id)
+        with span('CDM.visualize'):
+            self._visualize_matches(img_gt, img_pred, box_gt, box_pred, matched_idxes, inliers, img_id)
         
         return {
             "recall": recall,
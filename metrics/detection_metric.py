@@ -0,0 +1,253 @@
+import numpy as np
+from tabulate import tabulate
+from concurrent.futures import ProcessPoolExecutor
+
+# the parameters of the COCO bbox protocol, as used by pycocotools' COCOeval and mmeval's COCODetection
+COCO_IOU_THRS = np.linspace(.5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+COCO_REC_THRS = np.linspace(.0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
+COCO_MAX_DETS = [1, 10, 100]
+COCO_AREA_RNG = [[0 ** 2, 1e5 ** 2], [0 ** 2, 32 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]]
+COCO_AREA_LBL = ['all', 'small', 'medium', 'large']
+
+
+def xyxy2xywh(bboxes):
+    """(n, 4) xyxy boxes (any shape when there are none) -> float64 xywh boxes"""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    return np.stack([bboxes[:, 0], bboxes[:, 1], bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1]], axis=1)
+
+
+def bbox_iou(dt, gt, gt_crowd):
+    """
+    IoU of xywh boxes with the arithmetic of pycocotools, broadcast over leading axes: dt (..., D, 4) and
+    gt (..., G, 4) give (..., D, G). A crowd gt is divided by the detection area only.
+    """
+    dt, gt = dt[..., :, None, :], gt[..., None, :, :]
+    dt_area = dt[..., 2] * dt[..., 3]
+    gt_area = gt[..., 2] * gt[..., 3]
+    w = np.minimum(dt[..., 2] + dt[..., 0], gt[..., 2] + gt[..., 0]) - np.maximum(dt[..., 0], gt[..., 0])
+    h = np.minimum(dt[..., 3] + dt[..., 1], gt[..., 3] + gt[..., 1]) - np.maximum(dt[..., 1], gt[..., 1])
+    inter = w * h
+    union = np.where(gt_crowd[..., None, :], dt_area, dt_area + gt_area - inter)
+    ious = np.zeros(inter.shape)
+    np.divide(inter, union, out=ious, where=(w > 0) & (h > 0))
+    return ious
+
+
+def _last_argmax(values):
+    """Index of the last maximum along the last axis, as the greedy COCO matching keeps the last of equal IoUs"""
+    return values.shape[-1] - 1 - np.argmax(values[..., ::-1], axis=-1)
+
+
+def greedy_match(ious, gt_ignore, gt_crowd, n_dt, iou_thrs):
+    """
+    COCO matching of a chunk of images (COCOeval.evaluateImg), for all area ranges and IoU thresholds at once.
+
+    ious (I, D, G) holds the IoUs of the score-sorted detections of each image, -1 for padding; images have
+    n_dt detections and are sorted by it, largest first. gt_ignore is (A, I, G). The d-th detections of all
+    images are matched together: each takes the best still-free gt (crowd gts stay free) with an IoU of at least
+    the threshold, preferring gts that are not ignored, and the last of equal IoUs (in the order of the gts).
+    Returns the matched gt of each (area range, threshold, image, detection), -1 for none.
+    """
+    (I, D, G), A, T = ious.shape, gt_ignore.shape[0], len(iou_thrs)
+    thrs = np.minimum(iou_thrs, 1 - 1e-10)[:, None, None]
+    gt_taken = np.zeros((A, T, I, G), dtype=bool)
+    dt_match = np.full((A, T, I, D), -1, dtype=np.int64)
+    for d in range(D):
+        n = int(np.count_nonzero(n_dt > d))
+        hit = ious[None, :n, d, :] >= thrs   # (T, n, G)
+        if not hit.any():
+            continue
+        iou = ious[:n, d, :]
+        candidates = hit[None] & (~gt_taken[:, :, :n] | gt_crowd[None, None, :n])
+        ignored = gt_ignore[:, None, :n]
+        valid_values = np.where(candidates & ~ignored, iou, -np.inf)
+        ignored_values = np.where(candidates & ignored, iou, -np.inf)
+        match = np.where(np.isfinite(valid_values.max(axis=-1)), _last_argmax(valid_values),
+                         np.where(np.isfinite(ignored_values.max(axis=-1)), _last_argmax(ignored_values), -1))
+        dt_match[:, :, :n, d] = match
+        a, t, i = np.nonzero(match >= 0)
+        gt_taken[a, t, i, match[a, t, i]] = True
+    return dt_match
+
+
+def _pad(arrays, size, fill):
+    padded = np.full((len(arrays), size) + arrays[0].shape[1:], fill, dtype=np.float64)
+    for idx, array in enumerate(arrays):
+        padded[idx, :len(array)] = array
+    return padded
+
+
+def evaluate_category(args):
+    """
+    Precision (T, R, A, M) and recall (T, A, M) of one category, as COCOeval.evaluate and accumulate; -1 where
+    there are no gts to recall. images holds (gt xywh, gt crowd, dt xywh, dt scores) of the images with gts or
+    detections, in image order. The images are matched in chunks of similar gt counts to keep the padding small.
+    """
+    images, iou_thrs = args
+    T, R, A, M = len(iou_thrs), len(COCO_REC_THRS), len(COCO_AREA_RNG), len(COCO_MAX_DETS)
+    precision = -np.ones((T, R, A, M))
+    recall = -np.ones((T, A, M))
+    if not images:
+        return precision, recall
+    area_rng = np.array(COCO_AREA_RNG)[:, :, None, None]
+
+    # score-sorted detections of each image, cut to the largest maxDets
+    dts, scores = [], []
+    for _, _, dt, dt_scores in images:
+        order = np.argsort(-dt_scores, kind='mergesort')[:COCO_MAX_DETS[-1]]
+        dts.append(dt[order])
+        scores.append(dt_scores[order])
+    n_gt = np.array([len(gt) for gt, _, _, _ in images])
+    n_dt = np.array([len(dt) for dt in dts])
+    I, D = len(images), max(int(n_dt.max()), 1)
+    dt_matched = np.zeros((A, T, I, D), dtype=bool)
+    dt_ignore = np.zeros((A, T, I, D), dtype=bool)
+    npig = np.zeros(A, dtype=np.int64)
+
+    by_gt_count = np.argsort(n_gt, kind='stable')
+    for start in range(0, I, 256):
+        chunk = by_gt_count[start:start + 256]
+        chunk = chunk[np.argsort(-n_dt[chunk], kind='stable')]
+        G = max(int(n_gt[chunk].max()), 1)
+        gt = _pad([images[i][0] for i in chunk], G, 0)
+        gt_valid = np.arange(G)[None, :] < n_gt[chunk][:, None]
+        gt_crowd = np.zeros((len(chunk), G), dtype=bool)
+        for row, i in enumerate(chunk):
+            gt_crowd[row, :n_gt[i]] = images[i][1]
+        dt = _pad([dts[i] for i in chunk], D, 0)
+        dt_valid = np.arange(D)[None, :] < n_dt[chunk][:, None]
+        ious = np.where(dt_valid[:, :, None] & gt_valid[:, None, :], bbox_iou(dt, gt, gt_crowd), -1)
+
+        gt_area = gt[..., 2] * gt[..., 3]
+        gt_ignore = gt_crowd[None] | (gt_area[None] < area_rng[:, 0]) | (gt_area[None] > area_rng[:, 1])   # (A, I, G)
+        npig += np.count_nonzero(gt_valid[None] & ~gt_ignore, axis=(1, 2))
+        dt_match = greedy_match(ious, gt_ignore, gt_crowd, n_dt[chunk], iou_thrs)
+        matched = dt_match >= 0
+        # a matched detection takes the ignore flag of its gt, an unmatched one outside the area range is ignored
+        matched_ignore = np.take_along_axis(gt_ignore[:, None], np.maximum(dt_match, 0), axis=-1) & matched
+        dt_area = dt[..., 2] * dt[..., 3]
+        out_of_range = (dt_area[None] < area_rng[:, 0]) | (dt_area[None] > area_rng[:, 1])   # (A, I, D)
+        dt_matched[:, :, chunk] = matched
+        dt_ignore[:, :, chunk] = matched_ignore | (~matched & out_of_range[:, None])
+
+    # the detections of all images in image order, each image's in score order, as accumulate concatenates them
+    rank = np.arange(D)[None, :]
+    dt_valid = rank < n_dt[:, None]
+    dt_scores = _pad(scores, D, 0)
+    for a in range(A):
+        if npig[a] == 0:
+            continue
+        for m, max_det in enumerate(COCO_MAX_DETS):
+            keep = dt_valid & (rank < max_det)
+            kept_scores = dt_scores[keep]
+            inds = np.argsort(-kept_scores, kind='mergesort')
+            dtm = dt_matched[a][:, keep][:, inds]
+            dtig = dt_ignore[a][:, keep][:, inds]
+            tp_sum = np.cumsum(dtm & ~dtig, axis=1).astype(dtype=float)
+            fp_sum = np.cumsum(~dtm & ~dtig, axis=1).astype(dtype=float)
+            nd = tp_sum.shape[1]
+            rc = tp_sum / npig[a]
+            pr = tp_sum / (fp_sum + tp_sum + np.spacing(1))
+            recall[:, a, m] = rc[:, -1] if nd else 0
+            # interpolated precision: the best precision at any higher recall
+            pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+            q = np.zeros((T, R))
+            for t in range(T):
+                rec_inds = np.searchsorted(rc[t], COCO_REC_THRS, side='left')
+                valid = rec_inds < nd
+                q[t, valid] = pr[t, rec_inds[valid]]
+            precision[:, :, a, m] = q
+    return precision, recall
+
+
+def _summarize(precision, recall, iou_thrs, ap=1, iou_thr=None, area_rng='all', max_dets=100):
+    aind = [i for i, lbl in enumerate(COCO_AREA_LBL) if lbl == area_rng]
+    mind = [i for i, m in enumerate(COCO_MAX_DETS) if m == max_dets]
+    if ap == 1:
+        s = precision
+        if iou_thr is not None:
+            s = s[np.where(iou_thr == iou_thrs)[0]]
+        s = s[:, :, :, aind, mind]
+    else:
+        s = recall
+        if iou_thr is not None:
+            s = s[np.where(iou_thr == iou_thrs)[0]]
+        s = s[:, :, aind, mind]
+    mean_s = -1 if len(s[s > -1]) == 0 else np.mean(s[s > -1])
+    title, kind = ('Average Precision', '(AP)') if ap == 1 else ('Average Recall', '(AR)')
+    iou = f'{iou_thrs[0]:0.2f}:{iou_thrs[-1]:0.2f}' if iou_thr is None else f'{iou_thr:0.2f}'
+    print(f' {title:<18} {kind} @[ IoU={iou:<9} | area={area_rng:>6s} | maxDets={max_dets:>3d} ] = {mean_s:0.3f}')
+    return mean_s
+
+
+class COCODetectionEvaluator:
+    """
+    COCO bbox mAP of xyxy boxes with numpy, giving the results of mmeval's COCODetection(metric=['bbox'],
+    classwise=True) without building COCO json files: the gts and predictions are the per-image dicts of
+    DetectionDataset. The categories are evaluated independently, in a process pool with num_workers > 1.
+    """
+    def __init__(self, classes, iou_thrs=COCO_IOU_THRS, num_workers=1):
+        self.classes = list(classes)
+        self.iou_thrs = np.asarray(iou_thrs)
+        self.num_workers = num_workers
+
+    def _category_images(self, groundtruths, predictions):
+        """Per category, (gt xywh, gt crowd, dt xywh, dt scores) of each image having one of them, in image order"""
+        category_images = [[] for _ in self.classes]
+        preds = {pred.get('img_id', idx): pred for idx, pred in enumerate(predictions)}
+        for idx, gt in sorted(((gt.get('img_id', idx), gt) for idx, gt in enumerate(groundtruths)), key=lambda item: item[0]):
+            gt_labels = np.asarray(gt['labels'], dtype=np.int64).reshape(-1)
+            gt_boxes = xyxy2xywh(gt['bboxes'])
+            gt_crowd = np.asarray(gt.get('ignore_flags', np.zeros(len(gt_labels))), dtype=bool).reshape(-1)
+            pred = preds.get(idx, {'labels': [], 'bboxes': [], 'scores': []})
+            dt_labels = np.asarray(pred['labels'], dtype=np.int64).reshape(-1)
+            dt_boxes = xyxy2xywh(pred['bboxes'])
+            dt_scores = np.asarray(pred['scores'], dtype=np.float64).reshape(-1)
+            for cat in np.union1d(gt_labels, dt_labels):
+                gt_sel, dt_sel = gt_labels == cat, dt_labels == cat
+                category_images[cat].append((gt_boxes[gt_sel], gt_crowd[gt_sel], dt_boxes[dt_sel], dt_scores[dt_sel]))
+        return category_images
+
+    def __call__(self, predictions, groundtruths):
+        if not any(len(pred['labels']) for pred in predictions):
+            print('The testing results of the whole dataset is empty.')
+            return {}
+        tasks = [(images, self.iou_thrs) for images in self._category_images(groundtruths, predictions)]
+        if self.num_workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                category_results = list(executor.map(evaluate_category, tasks))
+        else:
+            category_results = [evaluate_category(task) for task in tasks]
+        # precision (T, R, K, A, M) and recall (T, K, A, M) as in COCOeval.eval
+        precision = np.stack([p for p, _ in category_results], axis=2)
+        recall = np.stack([r for _, r in category_results], axis=1)
+
+        stats = [
+            _summarize(precision, recall, self.iou_thrs, 1),
+            _summarize(precision, recall, self.iou_thrs, 1, iou_thr=.5),
+            _summarize(precision, recall, self.iou_thrs, 1, iou_thr=.75),
+            _summarize(precision, recall, self.iou_thrs, 1, area_rng='small'),
+            _summarize(precision, recall, self.iou_thrs, 1, area_rng='medium'),
+            _summarize(precision, recall, self.iou_thrs, 1, area_rng='large'),
+            _summarize(precision, recall, self.iou_thrs, 0, max_dets=COCO_MAX_DETS[0]),
+            _summarize(precision, recall, self.iou_thrs, 0, max_dets=COCO_MAX_DETS[1]),
+            _summarize(precision, recall, self.iou_thrs, 0, max_dets=COCO_MAX_DETS[2]),
+            _summarize(precision, recall, self.iou_thrs, 0, area_rng='small'),
+            _summarize(precision, recall, self.iou_thrs, 0, area_rng='medium'),
+            _summarize(precision, recall, self.iou_thrs, 0, area_rng='large'),
+        ]
+        eval_results = {}
+        for name, val in zip(['mAP', 'mAP_50', 'mAP_75', 'mAP_s', 'mAP_m', 'mAP_l'], stats):
+            eval_results[f'bbox_{name}'] = float(val)
+        per_category = []
+        for idx, name in enumerate(self.classes):
+            # area range index 0: all area ranges, max dets index -1: 100 per image
+            p = precision[:, :, idx, 0, -1]
+            p = p[p > -1]
+            ap = np.mean(p) if p.size else float('nan')
+            eval_results[f'bbox_{name}_precision'] = ap
+            per_category.append([name, f'{round(ap * 100, 2):0.2f}'])
+        print(tabulate([[f'{round(val * 100, 2):0.2f}' for val in stats[:6]]],
+                       headers=[f'bbox_{name}' for name in ['mAP', 'mAP_50', 'mAP_75', 'mAP_s', 'mAP_m', 'mAP_l']], disable_numparse=True))
+        print(tabulate(per_category, headers=['category', 'bbox_AP'], disable_numparse=True))
+        return eval_results
@@ -0,0 +1,154 @@
+import numpy as np
+
+
+class SampleStore:
+    """
+    Columnar store of the matched samples of one element type, shared by the metrics and the reports.
+
+    The sample dicts are the rows (texts, ids and attributes) and are never modified. Metrics append
+    per-sample columns instead: add_score() for a metric score, saved under 'metric' of a sample,
+    and add_column() for any other field. A missing value is None in a column and NaN in score().
+    rows() rebuilds the sample dicts with all columns, in the order they were added, for saving.
+    """
+    def __init__(self, samples):
+        self.samples = samples
+        self.columns = []   # (name, values, is_score) in the order they were added
+        self.score_columns = {}
+        self._arrays = {}
+        self._codes = {}
+        self._labels = None
+        self._text_lengths = None
+
+    @classmethod
+    def of(cls, samples):
+        """The store of samples, which can be a store, a list of sample dicts or a dataset holding them"""
+        if isinstance(samples, cls):
+            return samples
+        if not isinstance(samples, list):
+            samples = samples.samples
+        return cls(samples)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add_column(self, name, values):
+        self.columns.append((name, values, False))
+
+    def add_score(self, name, values):
+        self.columns.append((name, values, True))
+        self.score_columns[name] = values
+        self._arrays.pop(name, None)
+
+    def metric_names(self):
+        return list(self.score_columns.keys())
+
+    def score(self, name):
+        """float64 array of a metric score, NaN for the samples without it"""
+        if name not in self._arrays:
+            self._arrays[name] = np.array([np.nan if v is None else v for v in self.score_columns[name]], dtype=np.float64)
+        return self._arrays[name]
+
+    def text_lengths(self):
+        """int64 arrays of the gt and pred lengths, the normalized texts when there are ones"""
+        if self._text_lengths is None:
+            gt_len = np.empty(len(self.samples), dtype=np.int64)
+            pred_len = np.empty(len(self.samples), dtype=np.int64)
+            for idx, sample in enumerate(self.samples):
+                gt_len[idx] = len(sample['norm_gt'] if sample.get('norm_gt') else sample['gt'])
+                pred_len[idx] = len(sample['norm_pred'] if sample.get('norm_pred') else sample['pred'])
+            self._text_lengths = (gt_len, pred_len)
+        return self._text_lengths
+
+    def attribute_codes(self, key):
+        """
+        Code of the element attribute key for every sample, encoded once per store: the index of the value in
+        the returned list when all gt attributes of the sample share it, -1 when they differ or one of them is
+        empty, and -2 when the sample has no gt attributes at all.
+        """
+        if key not in self._codes:
+            values = {}
+            codes = np.empty(len(self.samples), dtype=np.int64)
+            for idx, sample in enumerate(self.samples):
+                attributes = sample['gt_attribute']   # a list containing all merged gt attributes
+                code = -2
+                for gt_attribute in attributes:
+                    if not gt_attribute:
+                        code = -1
+                        continue
+                    value_code = values.setdefault(gt_attribute[key], len(values))
+                    if code == -2:
+                        code = value_code
+                    elif code != value_code:
+                        code = -1
+                codes[idx] = code
+            self._codes[key] = (codes, list(values.keys()))
+        return self._codes[key]
+
+    def group_mask(self, group):
+        """Samples selected by a group of element attributes, e.g. {'language': 'table_en'}"""
+        mask = np.ones(len(self.samples), dtype=bool)
+        for k, v in group.items():
+            codes, values = self.attribute_codes(k)
+            # a sample without gt attributes is kept, one with an empty or a different attribute is not
+            selected = codes == -2
+            if v in values:
+                selected |= codes == values.index(v)
+            mask &= selected
+        return mask
+
+    def attribute_labels(self):
+        """
+        The 'key: value' labels of the gt attributes as (label names, sample index, label code) pairs,
+        each label once per sample even when several merged attributes carry it.
+        """
+        if self._labels is None:
+            names = {}
+            pair_samples, pair_labels = [], []
+            for idx, sample in enumerate(self.samples):
+                if not sample.get("gt_attribute"):
+                    continue
+                labels = set()
+                for anno in sample["gt_attribute"]:
+                    for k, v in anno.items():
+                        labels.add(names.setdefault(k+": "+str(v), len(names)))
+                for label in sorted(labels):
+                    pair_samples.append(idx)
+                    pair_labels.append(label)
+            self._labels = (list(names.keys()), np.array(pair_samples, dtype=np.int64),
+                            np.array(pair_labels, dtype=np.int64))
+        return self._labels
+
+    def row_scores(self, idx):
+        """(metric, score) pairs of a sample, in the order they would be saved"""
+        return [(name, values[idx]) for name, values in self.score_columns.items() if values[idx] is not None]
+
+    def derive(self, samples):
+        """A store over replacement rows (e.g. with rewritten texts) keeping the columns added so far"""
+        store = SampleStore(samples)
+        for name, values, is_score in self.columns:
+            if is_score:
+                store.add_score(name, values)
+            else:
+                store.add_column(name, values)
+        return store
+
+    def row(self, idx):
+        """Copy of a sample dict with all columns filled in"""
+        sample = dict(self.samples[idx])
+        if 'metric' in sample:
+            sample['metric'] = dict(sample['metric'])
+        for name, values, is_score in self.columns:
+            value = values[idx]
+            if value is None:
+                continue
+            if is_score:
+                if not sample.get('metric'):
+                    sample['metric'] = {}
+                sample['metric'][name] = value
+            else:
+                sample[name] = value
+        return sample
+
+    def rows(self):
+        for idx in range(len(self.samples)):
+            yield self.row(idx)
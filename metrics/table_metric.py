@@ -14,7 +14,7 @@ import Levenshtein
 from apted import APTED, Config
 from apted.helpers import Tree
 from lxml import etree, html
-from collections import deque
+from collections import deque, Counter
 # from parallel import parallel_process
 from tqdm import tqdm
 
@@ -38,6 +38,13 @@ class TableTree(Tree):
         return "{{{}}}".format(result)
 
 
+def structure_tree(tree):
+    """Copy of a TableTree without the cell contents, as built with structure_only=True"""
+    content = [] if tree.tag == 'td' else tree.content
+    return TableTree(tree.tag, tree.colspan, tree.rowspan, content,
+                     *[structure_tree(child) for child in tree.children])
+
+
 class CustomConfig(Config):
     @staticmethod
     def maximum(*sequences):
@@ -60,16 +67,66 @@ class CustomConfig(Config):
         return 0.
 
 
+def tree_nodes(tree):
+    """All nodes of a TableTree in preorder"""
+    nodes, stack = [], [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(reversed(node.children))
+    return nodes
+
+
+def distance_lower_bound(tree1, tree2):
+    """Lower bound of the tree edit distance from node counts and attribute histograms.
+    Nodes with a different (tag, colspan, rowspan) can only be paired by a rename costing 1,
+    so at most sum(min(hist1, hist2)) pairs are free and every other node costs at least 1.
+    """
+    hist1 = Counter((node.tag, node.colspan, node.rowspan) for node in tree_nodes(tree1))
+    hist2 = Counter((node.tag, node.colspan, node.rowspan) for node in tree_nodes(tree2))
+    n1, n2 = sum(hist1.values()), sum(hist2.values())
+    return max(n1, n2) - sum((hist1 & hist2).values())
+
+
+def distance_upper_bound(tree1, tree2, config):
+    """Upper bound of the tree edit distance: the cost of pairing the roots and then the children
+    of paired nodes by position, which is a valid edit mapping.
+    """
+    cost = config.rename(tree1, tree2)
+    for child1, child2 in zip(tree1.children, tree2.children):
+        cost += distance_upper_bound(child1, child2, config)
+    for child in tree1.children[len(tree2.children):] + tree2.children[len(tree1.children):]:
+        cost += len(tree_nodes(child))
+    return cost
+
+
 class TEDS(object):
     ''' Tree Edit Distance basead Similarity
     '''
-    def __init__(self, structure_only=False, n_jobs=1, ignore_nodes=None):
+    def __init__(self, structure_only=False, n_jobs=1, ignore_nodes=None, approximate=False):
         assert isinstance(n_jobs, int) and (n_jobs >= 1), 'n_jobs must be an integer greather than 1'
         self.structure_only = structure_only
         self.n_jobs = n_jobs
         self.ignore_nodes = ignore_nodes
+        # approximate skips APTED and scores the position-wise mapping of distance_upper_bound,
+        # a lower bound of the exact TEDS; the score errors of the last sample are kept in max_error
+        self.approximate = approximate
+        self.max_error = []
         self.__tokens__ = []
 
+    def tree_distance(self, tree1, tree2):
+        ''' Tree edit distance with a fast path for pairs whose bounds already fix
+            the distance. Returns (distance, max_error of the distance)
+        '''
+        config = CustomConfig()
+        lower = distance_lower_bound(tree1, tree2)
+        upper = distance_upper_bound(tree1, tree2, config)
+        if upper == lower:
+            return upper, 0.
+        if self.approximate:
+            return upper, upper - lower
+        return APTED(tree1, tree2, config).compute_edit_distance(), 0.
+
     def tokenize(self, node):
         ''' Tokenizes table cells
         '''
@@ -108,12 +165,12 @@ class TEDS(object):
         if parent is None:
             return new_node
 
-    def evaluate(self, pred, true):
-        ''' Computes TEDS score between the prediction and the ground truth of a
-            given sample
+    def parse_tables(self, pred, true):
+        ''' Parses the prediction and the ground truth HTML, returns the two table
+            elements or None if either of them has no table
         '''
         if (not pred) or (not true):
-            return 0.0
+            return None
         parser = html.HTMLParser(remove_comments=True, encoding='utf-8')
         pred = html.fromstring(pred, parser=parser)
         true = html.fromstring(true, parser=parser)
@@ -123,15 +180,50 @@ class TEDS(object):
             if self.ignore_nodes:
                 etree.strip_tags(pred, *self.ignore_nodes)
                 etree.strip_tags(true, *self.ignore_nodes)
-            n_nodes_pred = len(pred.xpath(".//*"))
-            n_nodes_true = len(true.xpath(".//*"))
-            n_nodes = max(n_nodes_pred, n_nodes_true)
+            return pred, true
+        return None
+
+    def evaluate(self, pred, true):
+        ''' Computes TEDS score between the prediction and the ground truth of a
+            given sample
+        '''
+        tables = self.parse_tables(pred, true)
+        if tables is None:
+            self.max_error = [0.]
+            return 0.0
+        pred, true = tables
+        n_nodes_pred = len(pred.xpath(".//*"))
+        n_nodes_true = len(true.xpath(".//*"))
+        n_nodes = max(n_nodes_pred, n_nodes_true)
+        tree_pred = self.load_html_tree(pred)
+        tree_true = self.load_html_tree(true)
+        distance, error = self.tree_distance(tree_pred, tree_true)
+        score = 1.0 - (float(distance) / n_nodes)
+        self.max_error = [error / n_nodes]
+        return score
+
+    def evaluate_with_structure(self, pred, true):
+        ''' Computes both the full TEDS and the structure-only TEDS of a sample,
+            parsing the HTML and building the trees only once
+        '''
+        tables = self.parse_tables(pred, true)
+        if tables is None:
+            self.max_error = [0., 0.]
+            return 0.0, 0.0
+        pred, true = tables
+        n_nodes = max(len(pred.xpath(".//*")), len(true.xpath(".//*")))
+        structure_only = self.structure_only
+        self.structure_only = False
+        try:
             tree_pred = self.load_html_tree(pred)
             tree_true = self.load_html_tree(true)
-            distance = APTED(tree_pred, tree_true, CustomConfig()).compute_edit_distance()
-            return 1.0 - (float(distance) / n_nodes)
-        else:
-            return 0.0
+        finally:
+            self.structure_only = structure_only
+        distance, error = self.tree_distance(tree_pred, tree_true)
+        distance_structure, error_structure = self.tree_distance(structure_tree(tree_pred), structure_tree(tree_true))
+        scores = 1.0 - (float(distance) / n_nodes), 1.0 - (float(distance_structure) / n_nodes)
+        self.max_error = [error / n_nodes, error_structure / n_nodes]
+        return scores
 
     def batch_evaluate(self, pred_json, true_json):
         ''' Computes TEDS score between the prediction and the ground truth of
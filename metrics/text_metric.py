@@ -0,0 +1,201 @@
+"""
+Offline corpus BLEU and METEOR, computing the same scores as the `bleu` and `meteor` modules of HF evaluate.
+
+BLEU keeps additive statistics per sample (n-gram matches and possible matches per order, hypothesis and
+reference lengths), so the corpus score of any group of samples is computed from the sum of their rows.
+METEOR is a sentence-level score averaged over the samples, so each sample is scored once.
+"""
+import re
+import math
+from collections import Counter
+from functools import lru_cache
+from itertools import chain
+
+import numpy as np
+
+try:
+    import nltk
+except ImportError:
+    nltk = None
+
+BLEU_MAX_ORDER = 4
+
+# the 13a tokenizer of sacrebleu, as used by HF evaluate's bleu
+_13A_RULES = [
+    # language-dependent part (assuming Western languages)
+    (re.compile(r"([\{-\~\[-\` -\&\(-\+\:-\@\/])"), r" \1 "),
+    # tokenize period and comma unless preceded by a digit
+    (re.compile(r"([^0-9])([\.,])"), r"\1 \2 "),
+    # tokenize period and comma unless followed by a digit
+    (re.compile(r"([\.,])([^0-9])"), r" \1 \2"),
+    # tokenize dash when preceded by a digit
+    (re.compile(r"([0-9])(-)"), r"\1 \2 "),
+]
+
+
+@lru_cache(maxsize=2**16)
+def tokenize_13a(line):
+    line = line.replace("<skipped>", "")
+    line = line.replace("-\n", "")
+    line = line.replace("\n", " ")
+    if "&" in line:
+        line = line.replace("&quot;", '"')
+        line = line.replace("&amp;", "&")
+        line = line.replace("&lt;", "<")
+        line = line.replace("&gt;", ">")
+    line = f" {line} "
+    for regex, repl in _13A_RULES:
+        line = regex.sub(repl, line)
+    return line.split()
+
+
+def _ngram_counts(tokens, max_order):
+    counts = Counter()
+    for order in range(1, max_order + 1):
+        for i in range(len(tokens) - order + 1):
+            counts[tuple(tokens[i:i+order])] += 1
+    return counts
+
+
+def bleu_statistics(predictions, references, max_order=BLEU_MAX_ORDER):
+    """
+    Additive BLEU statistics of each (prediction, reference) pair, an int64 array of shape (n, 2 * max_order + 2):
+    the clipped n-gram matches of each order, the possible matches of each order, the prediction length and
+    the reference length.
+    """
+    stats = np.zeros((len(predictions), 2 * max_order + 2), dtype=np.int64)
+    for idx, (prediction, reference) in enumerate(zip(predictions, references)):
+        translation = tokenize_13a(prediction)
+        reference = tokenize_13a(reference)
+        overlap = _ngram_counts(translation, max_order) & _ngram_counts(reference, max_order)
+        for ngram, count in overlap.items():
+            stats[idx, len(ngram) - 1] += count
+        for order in range(1, max_order + 1):
+            stats[idx, max_order + order - 1] = max(len(translation) - order + 1, 0)
+        stats[idx, 2 * max_order] = len(translation)
+        stats[idx, 2 * max_order + 1] = len(reference)
+    return stats
+
+
+def corpus_bleu(stats, max_order=BLEU_MAX_ORDER):
+    """Corpus BLEU (no smoothing) of summed bleu_statistics rows"""
+    matches, possible = stats[:max_order], stats[max_order:2 * max_order]
+    translation_length, reference_length = stats[2 * max_order], stats[2 * max_order + 1]
+    precisions = [float(m) / p if p > 0 else 0.0 for m, p in zip(matches, possible)]
+    if min(precisions) > 0:
+        geo_mean = math.exp(sum((1. / max_order) * math.log(p) for p in precisions))
+    else:
+        geo_mean = 0
+    if translation_length == 0 or reference_length == 0:   # the evaluate module fails on an empty corpus side
+        return 0.0
+    ratio = float(translation_length) / reference_length
+    bp = 1. if ratio > 1.0 else math.exp(1 - 1. / ratio)
+    return geo_mean * bp
+
+
+class _MeteorResources:
+    """
+    The nltk tokenizer, stemmer and WordNet when they are available offline, simple fallbacks otherwise. mode tells
+    which ones are used, the scores of a degraded mode are lower than the ones of HF evaluate.
+    """
+    def __init__(self):
+        self.tokenize = lambda text: re.findall(r"\w+|[^\w\s]", text)
+        self.stem = None
+        self.wordnet = None
+        self.mode = {'tokenizer': 'regex', 'stemming': False, 'synonyms': False}
+        if nltk is None:
+            print('WARNING: nltk is not installed, METEOR matches exact words only.')
+            return
+        try:
+            nltk.word_tokenize('a')
+            self.tokenize = nltk.word_tokenize
+            self.mode['tokenizer'] = 'punkt'
+        except LookupError:
+            print('WARNING: nltk punkt data is not available, METEOR splits words with a regex.')
+        self.stem = nltk.stem.porter.PorterStemmer().stem
+        self.mode['stemming'] = True
+        try:
+            from nltk.corpus import wordnet
+            wordnet.synsets('a')
+            self.wordnet = wordnet
+            self.mode['synonyms'] = True
+        except LookupError:
+            print('WARNING: nltk wordnet data is not available, METEOR does not match synonyms.')
+
+    @property
+    def degraded(self):
+        return self.mode != {'tokenizer': 'punkt', 'stemming': True, 'synonyms': True}
+
+
+_meteor_resources = None
+
+
+def meteor_resources():
+    global _meteor_resources
+    if _meteor_resources is None:
+        _meteor_resources = _MeteorResources()
+    return _meteor_resources
+
+
+def _match_enums(enum_hypothesis, enum_reference):
+    word_match = []
+    for i in range(len(enum_hypothesis))[::-1]:
+        for j in range(len(enum_reference))[::-1]:
+            if enum_hypothesis[i][1] == enum_reference[j][1]:
+                word_match.append((enum_hypothesis[i][0], enum_reference[j][0]))
+                enum_hypothesis.pop(i)
+                enum_reference.pop(j)
+                break
+    return word_match, enum_hypothesis, enum_reference
+
+
+def _synonym_match(enum_hypothesis, enum_reference, wordnet):
+    word_match = []
+    for i in range(len(enum_hypothesis))[::-1]:
+        hypothesis_syns = set(chain.from_iterable(
+            (lemma.name() for lemma in synset.lemmas() if lemma.name().find("_") < 0)
+            for synset in wordnet.synsets(enum_hypothesis[i][1]))).union({enum_hypothesis[i][1]})
+        for j in range(len(enum_reference))[::-1]:
+            if enum_reference[j][1] in hypothesis_syns:
+                word_match.append((enum_hypothesis[i][0], enum_reference[j][0]))
+                enum_hypothesis.pop(i)
+                enum_reference.pop(j)
+                break
+    return word_match
+
+
+def _count_chunks(matches):
+    i, chunks = 0, 1
+    while i < len(matches) - 1:
+        if not (matches[i + 1][0] == matches[i][0] + 1 and matches[i + 1][1] == matches[i][1] + 1):
+            chunks += 1
+        i += 1
+    return chunks
+
+
+def meteor_score(reference, hypothesis, alpha=0.9, beta=3, gamma=0.5):
+    """METEOR of one hypothesis against one reference, as nltk's single_meteor_score of the tokenized texts"""
+    resources = meteor_resources()
+    enum_hypothesis = list(enumerate(word.lower() for word in resources.tokenize(hypothesis)))
+    enum_reference = list(enumerate(word.lower() for word in resources.tokenize(reference)))
+    translation_length, reference_length = len(enum_hypothesis), len(enum_reference)
+
+    # exact, stem and synonym matches, each stage on the words left unmatched by the previous ones
+    matches, enum_hypothesis, enum_reference = _match_enums(enum_hypothesis, enum_reference)
+    if resources.stem is not None:
+        stem_matches, enum_hypothesis, enum_reference = _match_enums(
+            [(idx, resources.stem(word)) for idx, word in enum_hypothesis],
+            [(idx, resources.stem(word)) for idx, word in enum_reference])
+        matches += stem_matches
+    if resources.wordnet is not None:
+        matches += _synonym_match(enum_hypothesis, enum_reference, resources.wordnet)
+    matches.sort(key=lambda word_pair: word_pair[0])
+
+    if not matches or not translation_length or not reference_length:
+        return 0.0
+    precision = float(len(matches)) / translation_length
+    recall = float(len(matches)) / reference_length
+    fmean = (precision * recall) / (alpha * precision + (1 - alpha) * recall)
+    frag_frac = float(_count_chunks(matches)) / len(matches)
+    penalty = gamma * frag_frac ** beta
+    return (1 - penalty) * fmean
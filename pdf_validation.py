@@ -11,13 +11,39 @@ from registry.registry import EVAL_TASK_REGISTRY, DATASET_REGISTRY, METRIC_REGIS
 import dataset
 import task
 import metrics
+from utils import trace
 
 def process_args(args):
     parser = argparse.ArgumentParser(description='Render latex formulas for comparison.')
     parser.add_argument('--config', '-c', type=str, default='./configs/ocr.yaml')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='write a Chrome trace (chrome://tracing, ui.perfetto.dev) of the evaluation stages to this json file')
     parameters = parser.parse_args(args)
     return parameters
 
+def run_tasks(cfg):
+    for task in cfg.keys():
+        if not cfg.get(task):
+            print(f'No config for task {task}')
+        dataset = cfg[task]['dataset']['dataset_name']
+        # metrics_list = [METRIC_REGISTRY.get(i) for i in cfg[task]['metrics']] # TODO: 直接在主函数里实例化
+        metrics_list = cfg[task]['metrics']  # 在task里再实例化
+        with trace.span(f'dataset.{dataset}'):
+            val_dataset = DATASET_REGISTRY.get(dataset)(cfg[task])
+        val_task = EVAL_TASK_REGISTRY.get(task)
+        # val_task(val_dataset, metrics_list)
+        if cfg[task]['dataset']['prediction'].get('data_path'):
+            save_name = os.path.basename(cfg[task]['dataset']['prediction']['data_path']) + '_' + cfg[task]['dataset'].get('match_method', 'quick_match')
+        else:
+            save_name = os.path.basename(cfg[task]['dataset']['ground_truth']['data_path']).split('.')[0]
+        print('###### Process: ', save_name)
+        with trace.span(f'task.{task}', save_name=save_name):
+            if cfg[task]['dataset']['ground_truth'].get('page_info'):
+                val_task(val_dataset, metrics_list, cfg[task]['dataset']['ground_truth']['page_info'], save_name)  # 按页面区分
+            else:
+                val_task(val_dataset, metrics_list, cfg[task]['dataset']['ground_truth']['data_path'], save_name)  # 按页面区分
+
+
 if __name__ == '__main__':
     parameters = process_args(sys.argv[1:])
     config_path = parameters.config
@@ -34,21 +60,10 @@ if __name__ == '__main__':
         )
 
 
-    for task in cfg.keys():
-        if not cfg.get(task):
-            print(f'No config for task {task}')
-        dataset = cfg[task]['dataset']['dataset_name']
-        # metrics_list = [METRIC_REGISTRY.get(i) for i in cfg[task]['metrics']] # TODO: 直接在主函数里实例化
-        metrics_list = cfg[task]['metrics']  # 在task里再实例化
-        val_dataset = DATASET_REGISTRY.get(dataset)(cfg[task])
-        val_task = EVAL_TASK_REGISTRY.get(task)
-        # val_task(val_dataset, metrics_list)
-        if cfg[task]['dataset']['prediction'].get('data_path'):
-            save_name = os.path.basename(cfg[task]['dataset']['prediction']['data_path']) + '_' + cfg[task]['dataset'].get('match_method', 'quick_match')
-        else:
-            save_name = os.path.basename(cfg[task]['dataset']['ground_truth']['data_path']).split('.')[0]
-        print('###### Process: ', save_name)
-        if cfg[task]['dataset']['ground_truth'].get('page_info'):
-            val_task(val_dataset, metrics_list, cfg[task]['dataset']['ground_truth']['page_info'], save_name)  # 按页面区分
-        else:
-            val_task(val_dataset, metrics_list, cfg[task]['dataset']['ground_truth']['data_path'], save_name)  # 按页面区分
+    if parameters.trace:
+        trace.enable()
+    try:
+        run_tasks(cfg)
+    finally:
+        if parameters.trace:
+            trace.finish(parameters.trace)
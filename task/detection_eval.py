@@ -1,8 +1,18 @@
 # coding: utf-8
 from registry.registry import EVAL_TASK_REGISTRY
+from registry.registry import METRIC_REGISTRY
+from utils.trace import span
 
 @EVAL_TASK_REGISTRY.register("detection_eval")
 class DetectionEval():
     def __init__(self, dataset, metrics_list='COCODet', page_info_path='', save_name=''):
-        detect_matrix = dataset.coco_det_metric(predictions=dataset.samples['preds'], groundtruths=dataset.samples['gts'])
-        print('detect_matrix', detect_matrix)
+        if isinstance(metrics_list, str):
+            metrics_list = [metrics_list]
+        for metric in metrics_list:
+            metric_args = {}
+            if isinstance(metric, dict):   # e.g. "- COCODet: {num_workers: 4}" passes arguments to the metric
+                metric, metric_args = next(iter(metric.items()))
+            metric_val = METRIC_REGISTRY.get(metric)
+            with span(f'metric.{metric}'):
+                _, detect_matrix = metric_val(dataset.samples).evaluate({}, save_name, **(metric_args or {}))
+            print('detect_matrix', detect_matrix)
@@ -1,7 +1,12 @@
 # from modules.cal_matrix import cal_text_matrix, cal_table_teds
 from registry.registry import EVAL_TASK_REGISTRY
 from metrics.show_result import show_result, get_full_labels_results, get_page_split
+from metrics.sample_store import SampleStore
 from registry.registry import METRIC_REGISTRY
+from utils.read_files import read_gt_pages
+from utils.result_io import write_results
+from utils.trace import span
+import inspect
 import json
 import os
 import pdb
@@ -16,20 +21,26 @@ class End2EndEval():
         else:
             md_flag = False
         if not md_flag:
-            with open(page_info_path, 'r') as f:
-                pages = json.load(f)
-            
-            for page in pages:
-                img_path = os.path.basename(page['page_info']['image_path'])
-                page_info[img_path[:-4]] = page['page_info']['page_attribute']
+            if getattr(dataset, 'gt_path', None) == page_info_path:
+                page_info = dataset.page_info   # indexed while the dataset streamed the GT
+            else:
+                _, page_info = read_gt_pages(page_info_path, keep_pages=False)
+        result_format = getattr(dataset, 'result_format', 'json')
 
         for element in metrics_list.keys():
             result = {}
             group_info = metrics_list[element].get('group', [])
             samples = dataset.samples[element]
             for metric in metrics_list[element]['metric']:
+                metric_args = {}
+                if isinstance(metric, dict):   # e.g. "- TEDS: {num_workers: 8}" passes arguments to the metric
+                    metric, metric_args = next(iter(metric.items()))
                 metric_val = METRIC_REGISTRY.get(metric)
-                samples, result_s = metric_val(samples).evaluate(group_info, f"{save_name}_{element}")
+                if 'result_format' in inspect.signature(metric_val.evaluate).parameters:
+                    # metrics saving per-sample results write them in the format of the dataset config
+                    metric_args = {'result_format': result_format, **(metric_args or {})}
+                with span(f'metric.{metric}', element=element):
+                    samples, result_s = metric_val(samples).evaluate(group_info, f"{save_name}_{element}", **(metric_args or {}))
                 if result_s:
                     result.update(result_s)
             if result:
@@ -51,17 +62,14 @@ class End2EndEval():
 
             if not os.path.exists('./result'):
                 os.makedirs('./result')
-            if isinstance(samples, list):
-                saved_samples = samples
-            else:
-                saved_samples = samples.samples
+            store = SampleStore.of(samples)
             try:
-
-                with open(f'./result/{save_name}_{element}_result.json', 'w', encoding='utf-8') as f:
-                    json.dump(saved_samples, f, indent=4, ensure_ascii=False)
+                # the jsonl formats stream the rows, the samples are not copied into one list
+                write_results(f'./result/{save_name}_{element}_result', store.rows(), result_format)
             except TypeError as e:
                 print(f"JSON 序列化错误: {e}")
                 print("请检查 saved_samples 中是否包含非 JSON 可序列化的数据类型")
+                saved_samples = list(store.rows())
                 
                 # 打印出有问题的数据类型
                 def find_non_serializable(data):
@@ -85,4 +93,12 @@ class End2EndEval():
 
         with open(f'./result/{save_name}_metric_result.json', 'w', encoding='utf-8') as f:
             json.dump(result_all, f, indent=4, ensure_ascii=False)
+
+        if getattr(dataset, 'match_budget_hit_pages', None):
+            # pages whose truncation merge search was cut by the budget of quick_match, kept out of the metric
+            # results whose top level keys are the elements
+            diagnostics = {'match_budget_hit': {'page_num': len(dataset.match_budget_hit_pages),
+                                                'pages': dataset.match_budget_hit_pages}}
+            with open(f'./result/{save_name}_diagnostics.json', 'w', encoding='utf-8') as f:
+                json.dump(diagnostics, f, indent=4, ensure_ascii=False)
     
\ No newline at end of file
@@ -4,6 +4,7 @@ from registry.registry import METRIC_REGISTRY
 import os
 import json
 from metrics.show_result import show_result, get_full_labels_results, get_page_split
+from utils.trace import span
 
 @EVAL_TASK_REGISTRY.register("recogition_eval")
 class RecognitionBaseEval():
@@ -30,8 +31,12 @@ class RecognitionBaseEval():
                 page_info[img_path[:-4]] = page['page_info']['page_attribute']
 
         for metric in metrics_list:
+            metric_args = {}
+            if isinstance(metric, dict):   # e.g. "- TEDS: {num_workers: 8}" passes arguments to the metric
+                metric, metric_args = next(iter(metric.items()))
             metric_val = METRIC_REGISTRY.get(metric)
-            samples, result = metric_val(samples).evaluate({}, save_name)
+            with span(f'metric.{metric}'):
+                samples, result = metric_val(samples).evaluate({}, save_name, **(metric_args or {}))
             if result:
                 p_scores.update(result) 
         # score_table = [[k,v] for k,v in p_scores.items()]
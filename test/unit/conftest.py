@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the tests import the repo modules as pdf_validation.py does, from the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
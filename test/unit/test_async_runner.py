@@ -0,0 +1,100 @@
+"""The shared inference runner of tools/model_infer against the local mock server (127.0.0.1 only)"""
+import os
+import sys
+import time
+import asyncio
+
+import pytest
+from PIL import Image as PILImage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tools', 'model_infer'))
+from async_runner import Image, chat_completion, image_content, parse_args, run_images, run_inference  # noqa: E402
+from mock_server import MockServer  # noqa: E402
+
+SCRIPT = {
+    'p_429': [(429, 'slow down', {'Retry-After': '1'})],
+    'p_500': [(500, None, None)],
+    'p_empty': [(200, '', None)],
+    'p_401': [(401, 'invalid api key', None)],
+}
+
+
+def build_request(image, args):
+    # the name in the prompt is the marker the mock server answers by
+    return chat_completion(args, [{'role': 'user', 'content': [image_content(image),
+                                                               {'type': 'text', 'text': f'Convert {image.name}'}]}])
+
+
+@pytest.fixture(autouse=True)
+def no_proxy(monkeypatch):
+    # the runner trusts the proxy variables, the requests to the mock server must stay on the loopback
+    for name in ['http_proxy', 'https_proxy', 'all_proxy', 'HTTP_PROXY', 'HTTPS_PROXY', 'ALL_PROXY']:
+        monkeypatch.delenv(name, raising=False)
+
+
+def sent(server, name):
+    return sum(text == f'Convert {name}.jpg' for text in server.texts)
+
+
+@pytest.fixture
+def image_root(tmp_path):
+    root = tmp_path / 'images'
+    root.mkdir()
+    for name in ['p_429', 'p_500', 'p_empty', 'p_401', 'p_ok', 'p_done']:
+        PILImage.new('RGB', (8, 8), (255, 255, 255)).save(root / f'{name}.jpg')
+    return root
+
+
+def runner_args(server, image_root, save_root):
+    return ['--image_root', str(image_root), '--save_root', str(save_root), '--base_url', server.url,
+            '--api_key', 'test', '--model', 'mock', '--max_retries', '3', '--backoff', '0.01', '--concurrency', '4']
+
+
+def test_run_images_retries(image_root, tmp_path):
+    save_root = tmp_path / 'output'
+    save_root.mkdir()
+    with MockServer({marker: answers for marker, answers in SCRIPT.items()}) as server:
+        args = parse_args('test', {}, runner_args(server, image_root, save_root))
+        images = [Image(str(image_root / f'{name}.jpg')) for name in ['p_429', 'p_500', 'p_empty', 'p_401', 'p_ok']]
+        start = time.perf_counter()
+        failed = asyncio.run(run_images(images, build_request, lambda response: response['choices'][0]['message']['content'], args))
+        elapsed = time.perf_counter() - start
+    # a 401 fails at once, the retryable failures succeed on their second request
+    assert failed == ['p_401.jpg']
+    assert server.requests['p_401'] == 1
+    for marker in ['p_429', 'p_500', 'p_empty']:
+        assert server.requests[marker] == 2
+        assert (save_root / f'{marker}.md').read_text(encoding='utf-8').endswith(marker)
+    assert sent(server, 'p_ok') == 1
+    assert not (save_root / 'p_401.md').exists()
+    # the retry of the 429 waited for its Retry-After
+    assert elapsed >= 1.0
+    assert not [name for name in os.listdir(save_root) if name.endswith('.tmp')]
+
+
+def test_run_inference_resumes(image_root, tmp_path):
+    save_root = tmp_path / 'output'
+    save_root.mkdir()
+    (save_root / 'p_done.md').write_text('already done', encoding='utf-8')
+    # the other name the evaluation reads, written by earlier versions of some scripts
+    (save_root / 'p_500.jpg.md').write_text('already done', encoding='utf-8')
+    with MockServer({'p_401': list(SCRIPT['p_401'])}) as server:
+        status = run_inference(build_request, args=runner_args(server, image_root, save_root))
+        assert status == 1
+        assert sent(server, 'p_done') == 0 and sent(server, 'p_500') == 0
+        assert (save_root / 'p_done.md').read_text(encoding='utf-8') == 'already done'
+        assert (save_root / 'p_ok.md').exists() and not (save_root / 'p_401.md').exists()
+
+        # a second run only sends the image that failed
+        requests_before = len(server.texts)
+        assert run_inference(build_request, args=runner_args(server, image_root, save_root)) == 0
+        assert server.texts[requests_before:] == ['Convert p_401.jpg']
+        assert (save_root / 'p_401.md').exists()
+
+
+def test_api_key_environment_overrides_script_placeholder(monkeypatch):
+    monkeypatch.setenv('API_KEY', 'from-env')
+    assert parse_args('test', {'api_key': 'sk-xxx'}, []).api_key == 'from-env'
+    assert parse_args('test', {'api_key': 'sk-xxx'}, ['--api_key', 'cli']).api_key == 'cli'
+    monkeypatch.delenv('API_KEY')
+    assert parse_args('test', {'api_key': 'sk-xxx'}, []).api_key == 'sk-xxx'
@@ -0,0 +1,104 @@
+"""Checks of the batched CDM render against a broken formula in the batch (user-005)"""
+import os
+import shutil
+
+import pytest
+from PIL import Image, ImageDraw
+
+import metrics.cdm.modules.latex2bbox_color as latex2bbox_color
+from metrics.cdm_metric import CDM
+
+COLORS = CDM.gen_color_list(num=5800)
+# the broken formula sits between two good ones, its unbalanced brace reaches into the next page
+FORMULAS = [('x^{2}', 'short'), ('\\frac{a}{', 'broken'), ('a+b+c+d+e', 'long')]
+
+
+def draw_page(path, colors):
+    img = Image.new('RGB', (20 * len(colors) + 20, 40), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for idx, color in enumerate(colors):
+        draw.rectangle([10 + 20 * idx, 10, 20 + 20 * idx, 20], fill=tuple(color))
+    img.save(path)
+
+
+def token_colors(latex):
+    return latex2bbox_color.color_latex(latex, 'page', '/tmp', COLORS)[3]
+
+
+def fake_renderer(monkeypatch, pages, log_errors=()):
+    """xelatex and magick replaced by a render of the given color lists, one page each"""
+    def compile_latex(final_latex, pre_name, temp_dir, timeout_sec=30, errors=None):
+        errors.extend(log_errors)
+        pdf_filename = os.path.join(temp_dir, pre_name + '.pdf')
+        open(pdf_filename, 'w').close()
+        return pdf_filename
+
+    def convert_pdf2img(pdf_filename, png_filename, temp_dir=None, timeout_sec=30):
+        for idx, colors in enumerate(pages):
+            draw_page(png_filename % idx, colors)
+
+    one_by_one = []
+    monkeypatch.setattr(latex2bbox_color, 'compile_latex', compile_latex)
+    monkeypatch.setattr(latex2bbox_color, 'convert_pdf2img', convert_pdf2img)
+    monkeypatch.setattr(latex2bbox_color, 'latex2bbox_color', lambda input_arg: one_by_one.append(input_arg[1]))
+    return one_by_one
+
+
+def render_batch(tmp_path):
+    output_path, temp_dir = str(tmp_path / 'out'), str(tmp_path / 'tmp')
+    for sub in ('bbox', 'vis'):
+        os.makedirs(os.path.join(output_path, sub))
+    os.makedirs(temp_dir)
+    latex2bbox_color.latex2bbox_color_batch(FORMULAS, output_path, temp_dir, COLORS)
+    return output_path
+
+
+def test_clean_batch_is_split_into_pages(tmp_path, monkeypatch):
+    one_by_one = fake_renderer(monkeypatch, [token_colors(latex) for latex, _ in FORMULAS])
+    output_path = render_batch(tmp_path)
+    assert one_by_one == []
+    for _, basename in FORMULAS:
+        assert os.path.exists(os.path.join(output_path, 'bbox', basename + '.jsonl'))
+
+
+def test_shifted_page_falls_back_to_one_by_one(tmp_path, monkeypatch):
+    # same page count, no error in the log, but the page of the broken formula holds its neighbour
+    pages = [token_colors('x^{2}'), token_colors('a+b+c+d+e'), token_colors('a+b+c+d+e')]
+    one_by_one = fake_renderer(monkeypatch, pages)
+    output_path = render_batch(tmp_path)
+    assert one_by_one == [basename for _, basename in FORMULAS]
+    assert os.listdir(os.path.join(output_path, 'bbox')) == []
+
+
+def test_latex_errors_fall_back_to_one_by_one(tmp_path, monkeypatch):
+    pages = [token_colors(latex) for latex, _ in FORMULAS]
+    one_by_one = fake_renderer(monkeypatch, pages, log_errors=['! Missing } inserted.'])
+    render_batch(tmp_path)
+    assert one_by_one == [basename for _, basename in FORMULAS]
+
+
+def test_read_latex_errors(tmp_path):
+    log = tmp_path / 'page.log'
+    log.write_text('This is XeTeX\n! Missing } inserted.\n<inserted text>\n}\nOutput written on page.pdf\n')
+    assert latex2bbox_color.read_latex_errors(str(log)) == ['! Missing } inserted.']
+    assert latex2bbox_color.read_latex_errors(str(tmp_path / 'missing.log')) == []
+
+
+@pytest.mark.skipif(not (shutil.which('xelatex') and shutil.which('magick')), reason='needs xelatex and magick')
+def test_batch_matches_one_by_one_render(tmp_path):
+    outputs = {}
+    for mode in ('batch', 'single'):
+        output_path, temp_dir = str(tmp_path / mode / 'out'), str(tmp_path / mode / 'tmp')
+        for sub in ('bbox', 'vis'):
+            os.makedirs(os.path.join(output_path, sub))
+        os.makedirs(temp_dir)
+        if mode == 'batch':
+            latex2bbox_color.latex2bbox_color_batch(FORMULAS, output_path, temp_dir, COLORS)
+        else:
+            for latex, basename in FORMULAS:
+                latex2bbox_color.latex2bbox_color((latex, basename, output_path, temp_dir, COLORS))
+        outputs[mode] = {}
+        for _, basename in FORMULAS:
+            bbox_path = os.path.join(output_path, 'bbox', basename + '.jsonl')
+            outputs[mode][basename] = open(bbox_path).read() if os.path.exists(bbox_path) else None
+    assert outputs['batch'] == outputs['single']
@@ -0,0 +1,52 @@
+"""CDM workers and the retry of a failing chunk (user-020)"""
+import pytest
+
+import metrics.cal_metric as cal_metric
+
+
+class FakeCDM:
+    """Scores a formula 1.0, or raises on the formula 'bad' and on any batch render holding it"""
+
+    def __init__(self, output_root='./result', cache_dir=None, cache_max_size_mb=4096):
+        pass
+
+    def generate_bboxes_batch(self, formulas):
+        pass
+
+    def evaluate(self, gt, pred, img_id):
+        if gt == 'bad':
+            raise RuntimeError('render failed')
+        return {'F1_score': 1.0}
+
+
+@pytest.fixture
+def samples(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'result').mkdir()
+    monkeypatch.setattr(cal_metric, 'CDM', FakeCDM)
+    return [{'gt': gt, 'pred': 'x', 'img_id': f'page_{idx}'} for idx, gt in enumerate(['a', 'b', 'bad', 'c', 'd'])]
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_failing_chunk_is_scored_one_by_one(samples, max_workers):
+    store, result = cal_metric.call_CDM(samples).evaluate(save_name='cdm', max_workers=max_workers, chunk_size=4)
+    # only the failing formula is zeroed, not the three others of its chunk
+    assert store.score('CDM').tolist() == [1.0, 1.0, 0.0, 1.0, 1.0]
+    assert result['CDM']['all'] == pytest.approx(0.8)
+
+
+def test_default_workers_are_capped(samples, monkeypatch):
+    workers = []
+
+    class Pool:
+        def __init__(self, max_workers, **kwargs):
+            workers.append(max_workers)
+            raise RuntimeError('no pool in this test')
+
+    monkeypatch.setattr(cal_metric, 'ProcessPoolExecutor', Pool)
+    monkeypatch.setattr(cal_metric.os, 'cpu_count', lambda: 128)
+    with pytest.raises(RuntimeError):
+        cal_metric.call_CDM(samples).evaluate(save_name='cdm')
+    with pytest.raises(RuntimeError):
+        cal_metric.call_CDM(samples).evaluate(save_name='cdm', max_workers=64)
+    assert workers == [32, 64]
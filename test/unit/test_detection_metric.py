@@ -0,0 +1,58 @@
+"""Native COCO bbox mAP against mmeval's COCODetection on the demo detection configs (user-022)"""
+import os
+
+import pytest
+import yaml
+
+import dataset  # noqa: F401, registers the datasets
+from conftest import ROOT
+from metrics.detection_metric import COCODetectionEvaluator
+from registry.registry import DATASET_REGISTRY
+
+# the results of mmeval 0.2.1 COCODetection(metric=['bbox'], classwise=True) on the demo data
+MMEVAL_RESULTS = {
+    'layout_detection': {
+        'bbox_mAP': 0.5999473124324551, 'bbox_mAP_50': 0.7428296583248318, 'bbox_mAP_75': 0.659798191204087,
+        'bbox_mAP_s': 0.43728739540620726, 'bbox_mAP_m': 0.5576207944965431, 'bbox_mAP_l': 0.6417409859727522,
+        'bbox_title_precision': 0.5668897325366035, 'bbox_text_precision': 0.7807727147232891,
+        'bbox_abandon_precision': 0.35912769997574145, 'bbox_figure_precision': 0.44099102217914093,
+        'bbox_figure_caption_precision': 0.44455445544554456, 'bbox_table_precision': 0.801980198019802,
+        'bbox_table_caption_precision': 0.41468646864686465, 'bbox_table_footnote_precision': 0.6999999999999998,
+        'bbox_isolate_formula_precision': 0.8771570014144272, 'bbox_formula_caption_precision': 0.6133138313831382,
+    },
+    'formula_detection': {
+        'bbox_mAP': 0.4881188118811881, 'bbox_mAP_50': 0.5, 'bbox_mAP_75': 0.5, 'bbox_mAP_s': 0.0, 'bbox_mAP_m': 0.0,
+        'bbox_mAP_l': 0.4881188118811881, 'bbox_isolate_formula_precision': 0.9762376237623762,
+        'bbox_inline_formula_precision': 0.0,
+    },
+}
+
+
+@pytest.fixture(params=sorted(MMEVAL_RESULTS))
+def demo(request, monkeypatch):
+    """(config name, samples of its detection dataset) of a demo detection config"""
+    monkeypatch.chdir(ROOT)
+    with open(os.path.join('configs', f'{request.param}.yaml')) as f:
+        cfg_task = yaml.safe_load(f)['detection_eval']
+    return request.param, DATASET_REGISTRY.get(cfg_task['dataset']['dataset_name'])(cfg_task).samples
+
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_matches_stored_mmeval_results(demo, num_workers):
+    name, samples = demo
+    result = COCODetectionEvaluator(samples['classes'], num_workers=num_workers)(
+        predictions=samples['preds'], groundtruths=samples['gts'])
+    assert list(result) == list(MMEVAL_RESULTS[name])
+    for key, value in MMEVAL_RESULTS[name].items():
+        assert result[key] == pytest.approx(value, abs=1e-12), key
+
+
+def test_matches_mmeval(demo):
+    mmeval = pytest.importorskip('mmeval')
+    _, samples = demo
+    reference = mmeval.COCODetection(dataset_meta={'CLASSES': tuple(samples['classes'])}, metric=['bbox'],
+                                     classwise=True)(predictions=samples['preds'], groundtruths=samples['gts'])
+    result = COCODetectionEvaluator(samples['classes'])(predictions=samples['preds'], groundtruths=samples['gts'])
+    assert list(result) == list(reference)
+    for key, value in reference.items():
+        assert result[key] == pytest.approx(value, abs=1e-12), key
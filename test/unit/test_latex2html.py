@@ -0,0 +1,54 @@
+"""Batched latexmlc conversion of LaTeX tables against the single-table conversion (user-015)"""
+import re
+import shutil
+
+import pytest
+
+import utils.latex2html as latex2html
+from utils.latex2html import LatexTableConverter, convert_latex_table, convert_latex_table_batch
+
+TABLES = [
+    r'\begin{tabular}{|c|c|}\hline a & b \\ \hline 1 & 2 \\ \hline\end{tabular}',
+    r'\begin{table}[h]\caption{Results}\begin{tabular}{lr}\toprule Model & Score \\ \midrule A & $0.5$ \\ \bottomrule\end{tabular}\end{table}',
+    r'\begin{tabular}{ccc}\multicolumn{2}{c}{x} & y \\ \multirow{2}{*}{z} & 1 & 2 \\ & 3 & 4\end{tabular}',
+    r'\begin{tabular}{c}\textbf{bold}\footnote{note} \\ $x^{2}$\end{tabular}',
+]
+
+
+def fake_latexmlc(positional_ids):
+    """latexmlc stand-in: a one-cell table per tabular, with a cell id counted along the document or not"""
+    def run_latexmlc(latex_document):
+        count = iter(range(1, 1000))
+        body = re.sub(r'\\begin\{tabular\}\{[^}]*\}(.*?)\\end\{tabular\}',
+                      lambda m: f'<table><tr><td id="T{next(count) if positional_ids else 1}.1.1">{m.group(1)}</td></tr></table>',
+                      latex_document, flags=re.DOTALL)
+        return f'<html><body>{body}</body></html>'
+    return run_latexmlc
+
+
+@pytest.fixture
+def converter(monkeypatch):
+    monkeypatch.setattr(shutil, 'which', lambda cmd: f'/usr/bin/{cmd}')
+    return LatexTableConverter(batch_size=2, check_size=3)
+
+
+def test_batching_kept_when_it_matches(converter, monkeypatch):
+    monkeypatch.setattr(latex2html, 'run_latexmlc', fake_latexmlc(positional_ids=False))
+    html_list = converter.convert(TABLES)
+    assert converter.batch_size == 2
+    assert html_list == [convert_latex_table(latex_content) for latex_content in TABLES]
+
+
+def test_batching_turned_off_when_ids_depend_on_position(converter, monkeypatch):
+    monkeypatch.setattr(latex2html, 'run_latexmlc', fake_latexmlc(positional_ids=True))
+    assert convert_latex_table_batch(TABLES[:2]) != [convert_latex_table(latex_content) for latex_content in TABLES[:2]]
+    html_list = converter.convert(TABLES)
+    assert converter.batch_size == 1
+    # the ids are kept, they are part of the html the metrics see
+    assert html_list == [convert_latex_table(latex_content) for latex_content in TABLES]
+    assert all('id="T1.1.1"' in html for html in html_list)
+
+
+@pytest.mark.skipif(shutil.which('latexmlc') is None, reason='needs latexmlc')
+def test_latexmlc_batch_matches_single_tables():
+    assert convert_latex_table_batch(TABLES) == [convert_latex_table(latex_content) for latex_content in TABLES]
@@ -0,0 +1,79 @@
+"""The truncation merge budget of quick_match (user-012)"""
+import random
+
+import numpy as np
+import pytest
+
+import utils.match_quick as match_quick
+from utils.extract import md_tex_filter
+from utils.norm_cache import norm_cache
+from dataset.end2end_dataset import End2EndDataset
+from tools.benchmark.synthetic import generate_pages
+
+
+def split_paragraphs(pages, seed=0):
+    """The pages with predicted paragraphs split at their sentences, as spans for the truncation merge search"""
+    rng = random.Random(seed)
+    split = []
+    for page, markdown in pages:
+        blocks = []
+        for block in markdown.split('\n\n'):
+            if block[:1].isalpha() and '. ' in block and rng.random() < 0.7:
+                blocks.extend(sentence if sentence.endswith('.') else sentence + '.' for sentence in block.split('. '))
+            else:
+                blocks.append(block)
+        split.append((page, '\n\n'.join(blocks)))
+    return split
+
+
+def match_pages(pages):
+    dataset = End2EndDataset.__new__(End2EndDataset)
+    categories = ['text_block', 'title', 'equation_isolated']
+    results = []
+    for page, markdown in pages:
+        pred = md_tex_filter(markdown)
+        pred_mix = [item for category in pred if category not in ['html_table', 'latex_table', 'md2html_table']
+                    for item in pred[category]]
+        gt_mix = dataset.get_sorted_text_list(dataset.get_page_elements_list(dataset.get_page_elements(page), categories))
+        stats = {}
+        match = match_quick.match_gt2pred_quick(gt_mix, pred_mix, 'text_all', page['page_info']['image_path'], match_stats=stats)
+        results.append(([(item['gt_idx'], item['pred_idx'], item['edit']) for item in match], stats))
+    return results
+
+
+def test_default_budget_matches_unbounded_search(monkeypatch):
+    pages = split_paragraphs(generate_pages(num_pages=20, seed=3, num_blocks=30, noise_rate=0.05))
+    bounded = match_pages(pages)
+    assert any(len(pred_idx) > 1 for match, _ in bounded for _, pred_idx, _ in match)
+    norm_cache.lru.clear()
+    monkeypatch.setattr(match_quick, 'MERGE_SEARCH_BUDGET', 10**9)
+    unbounded = match_pages(pages)
+    assert not any(stats.get('budget_hit') for _, stats in bounded)
+    assert [match for match, _ in bounded] == [match for match, _ in unbounded]
+
+
+def merged_spans(budget, monkeypatch):
+    monkeypatch.setattr(match_quick, 'MERGE_SEARCH_BUDGET', budget)
+    # gt line 0 is spread over 40 pred lines, gt line 1 over the last two pred lines of the page
+    fragments = ['word%d alpha beta' % idx for idx in range(40)]
+    gt_lines = [' '.join(fragments), 'the quick brown fox jumps over the lazy dog']
+    pred_lines = fragments + ['the quick brown fox', 'jumps over the lazy dog']
+    stats = {}
+    _, _, pred_idx_list = match_quick.deal_with_truncated(np.ones((len(gt_lines), len(pred_lines))), gt_lines,
+                                                         pred_lines, stats)
+    return [idx for idx in pred_idx_list if isinstance(idx, list)], stats
+
+
+@pytest.mark.parametrize('budget', [10, 45, 100, 1000])
+def test_short_budget_cuts_spans_evenly(budget, monkeypatch):
+    spans, stats = merged_spans(budget, monkeypatch)
+    assert stats.get('budget_hit')
+    # the span at the end of the page is still found, the long span is cut instead
+    assert spans[-1] == [40, 41]
+    assert 1 < len(spans[0]) < 40
+
+
+def test_unbounded_spans(monkeypatch):
+    spans, stats = merged_spans(10**9, monkeypatch)
+    assert not stats.get('budget_hit')
+    assert spans == [list(range(40)), [40, 41]]
@@ -0,0 +1,65 @@
+"""Streaming GT reader against json.load (user-010)"""
+import json
+import os
+
+import pytest
+
+from conftest import ROOT
+from utils.read_files import iter_json_array, read_gt_pages
+
+GT_PATH = os.path.join(ROOT, 'demo_data/omnidocbench_demo/OmniDocBench_demo.json')
+
+TRICKY = [
+    {'text': 'brackets ] [ } { and , commas', 'escaped': 'quote \" backslash \\ ] newline \n', 'unicode': '公式 é 😀'},
+    12345678901234567890, -1.5e-10, 0, True, False, None, '', [], {}, [[1, [2, [3]]], {'a': [{}]}],
+    'a' * 300,
+]
+
+
+def write(tmp_path, text):
+    path = tmp_path / 'gt.json'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 1 << 20])
+def test_demo_gt_matches_json_load(chunk_size):
+    with open(GT_PATH, encoding='utf-8') as f:
+        expected = json.load(f)
+    assert list(iter_json_array(GT_PATH, chunk_size=chunk_size)) == expected
+
+
+@pytest.mark.parametrize('indent', [None, 0, 4])
+@pytest.mark.parametrize('chunk_size', [1, 3, 16, 1 << 20])
+def test_elements_split_across_chunks(tmp_path, indent, chunk_size):
+    # numbers, literals and escapes cut at a chunk boundary must not be read as complete elements
+    path = write(tmp_path, '\n  ' + json.dumps(TRICKY, indent=indent, ensure_ascii=False) + '\n')
+    assert list(iter_json_array(path, chunk_size=chunk_size)) == TRICKY
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '[\n]\n'])
+def test_empty_array(tmp_path, text):
+    assert list(iter_json_array(write(tmp_path, text), chunk_size=1)) == []
+
+
+def test_errors(tmp_path):
+    with pytest.raises(ValueError):
+        list(iter_json_array(write(tmp_path, '{"pages": []}')))
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(write(tmp_path, '[{"a": 1}, {"b": ]'), chunk_size=4))
+
+
+@pytest.mark.parametrize('filtered_types', [None, {'data_source': 'exam_paper'}, {'language': 'english'}])
+def test_read_gt_pages_matches_json_load(filtered_types):
+    with open(GT_PATH, encoding='utf-8') as f:
+        gt_samples = json.load(f)
+    # the filter and page index as built from json.load before the streaming reader
+    expected_pages = [page for page in gt_samples
+                      if not filtered_types
+                      or all(page['page_info']['page_attribute'][k] == v for k, v in filtered_types.items())]
+    expected_info = {os.path.basename(page['page_info']['image_path'])[:-4]: page['page_info']['page_attribute']
+                     for page in gt_samples}
+    pages, page_info = read_gt_pages(GT_PATH, filtered_types)
+    assert pages == expected_pages
+    assert page_info == expected_info
+    assert read_gt_pages(GT_PATH, filtered_types, keep_pages=False) == ([], expected_info)
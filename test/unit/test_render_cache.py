@@ -0,0 +1,25 @@
+"""Keys of the opt-in CDM render cache (user-004)"""
+import metrics.cdm.modules.render_cache as render_cache
+from metrics.cdm_metric import CDM
+
+
+def test_cache_is_off_by_default(tmp_path):
+    assert CDM(output_root=str(tmp_path)).render_cache is None
+
+
+def test_key_follows_latex_and_renderer(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_cache, 'tool_version', lambda cmd: f'{cmd[0]} 1.0')
+    cache = render_cache.RenderCache(str(tmp_path / 'cache'))
+    key = cache.key('x^{2} + y')
+    # the same formula up to the whitespace normalized before rendering
+    assert cache.key('\nx^{2} + y ') == key
+    assert cache.key('x^{3} + y') != key
+
+    # a new xelatex, magick or node version gives new keys
+    monkeypatch.setattr(render_cache, 'tool_version', lambda cmd: f'{cmd[0]} 2.0' if cmd[0] == 'magick' else f'{cmd[0]} 1.0')
+    assert render_cache.RenderCache(str(tmp_path / 'cache')).key('x^{2} + y') != key
+
+    # so does a new xelatex template
+    monkeypatch.setattr(render_cache, 'tool_version', lambda cmd: f'{cmd[0]} 1.0')
+    monkeypatch.setattr(render_cache, 'formular_template', render_cache.formular_template + '%')
+    assert render_cache.RenderCache(str(tmp_path / 'cache')).key('x^{2} + y') != key
@@ -0,0 +1,95 @@
+"""TEDS distance bounds and approximate mode against the plain APTED computation (user-009)"""
+import json
+import os
+import random
+import re
+
+import pytest
+from apted import APTED
+
+from metrics.table_metric import (TEDS, CustomConfig, distance_lower_bound, distance_upper_bound,
+                                  structure_tree)
+
+from conftest import ROOT
+
+with open(os.path.join(ROOT, 'demo_data/omnidocbench_demo/OmniDocBench_demo.json'), encoding='utf-8') as f:
+    GT_TABLES = [anno['html'] for page in json.load(f) for anno in page['layout_dets'] if anno.get('html')]
+
+
+def perturb(table, rng):
+    """A prediction of the table: a dropped row, edited cell texts, a changed span or header cell"""
+    rows = re.findall(r'<tr>.*?</tr>', table, re.DOTALL)
+    edit = rng.randrange(4)
+    if edit == 0 and len(rows) > 1:
+        table = table.replace(rng.choice(rows), '', 1)
+    elif edit == 1:
+        table = re.sub(r'<td>([^<]*)</td>', lambda m: f'<td>{m.group(1)[::-1] if rng.random() < 0.3 else m.group(1)}</td>', table)
+    elif edit == 2:
+        table = table.replace('<td>', '<td colspan="2">', 1)
+    else:
+        table = table.replace('<th', '<td').replace('</th>', '</td>')
+    return table
+
+
+def page(table):
+    return f'<html><body>{table}</body></html>'
+
+
+def table_pairs():
+    rng = random.Random(9)
+    pairs = []
+    for table in GT_TABLES:
+        pairs.append((page(table), page(table)))
+        pairs.extend((page(perturb(table, rng)), page(table)) for _ in range(3))
+        pairs.append((page(perturb(perturb(table, rng), rng)), page(table)))
+    pairs.extend((page(a), page(b)) for a, b in zip(GT_TABLES, GT_TABLES[1:4]))
+    return pairs
+
+
+def baseline_teds(pred, true, structure_only=False):
+    """TEDS as computed before the bounds: APTED on every pair"""
+    teds = TEDS(structure_only=structure_only)
+    pred, true = teds.parse_tables(pred, true)
+    n_nodes = max(len(pred.xpath('.//*')), len(true.xpath('.//*')))
+    distance = APTED(teds.load_html_tree(pred), teds.load_html_tree(true), CustomConfig()).compute_edit_distance()
+    return 1.0 - float(distance) / n_nodes
+
+
+@pytest.fixture(scope='module')
+def pairs():
+    """(pred, true, baseline TEDS, baseline structure-only TEDS) of each pair"""
+    assert GT_TABLES
+    return [(pred, true, baseline_teds(pred, true), baseline_teds(pred, true, structure_only=True))
+            for pred, true in table_pairs()]
+
+
+def test_bounds_enclose_apted(pairs):
+    teds = TEDS()
+    for pred, true, _, _ in pairs:
+        tree_pred, tree_true = (teds.load_html_tree(table) for table in teds.parse_tables(pred, true))
+        for tree1, tree2 in [(tree_pred, tree_true), (structure_tree(tree_pred), structure_tree(tree_true))]:
+            exact = APTED(tree1, tree2, CustomConfig()).compute_edit_distance()
+            assert distance_lower_bound(tree1, tree2) <= exact + 1e-9
+            assert exact <= distance_upper_bound(tree1, tree2, CustomConfig()) + 1e-9
+
+
+def test_exact_scores_match_baseline(pairs):
+    teds = TEDS()
+    for pred, true, baseline, baseline_structure in pairs:
+        assert teds.evaluate(pred, true) == pytest.approx(baseline, abs=1e-12)
+        assert teds.max_error == [0.]
+        full, structure = teds.evaluate_with_structure(pred, true)
+        assert full == pytest.approx(baseline, abs=1e-12)
+        assert structure == pytest.approx(baseline_structure, abs=1e-12)
+
+
+def test_approximate_scores_are_within_max_error(pairs):
+    teds = TEDS(approximate=True)
+    skipped_apted = 0
+    for pred, true, exact, _ in pairs:
+        score = teds.evaluate(pred, true)
+        error = teds.max_error[0]
+        assert score - 1e-9 <= exact <= score + error + 1e-9
+        skipped_apted += error == 0
+    # identical tables are decided by the bounds alone
+    assert skipped_apted >= len(GT_TABLES)
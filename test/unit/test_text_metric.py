@@ -0,0 +1,145 @@
+"""Offline BLEU and METEOR (user-021)"""
+import collections
+import math
+import random
+
+import numpy as np
+import pytest
+
+import metrics.cal_metric as cal_metric
+import metrics.text_metric as text_metric
+
+from metrics.text_metric import bleu_statistics, corpus_bleu, meteor_score, tokenize_13a
+
+SAMPLES = [
+    {'gt': 'The cat sat on the mat.', 'pred': 'The cat is sitting on the mat.'},
+    {'gt': 'Results are shown in Table 2.', 'pred': 'Results are shown in table 2'},
+]
+
+
+@pytest.fixture
+def meteor_resources(monkeypatch):
+    """Reload the METEOR resources in each test, and again after it"""
+    monkeypatch.setattr(text_metric, '_meteor_resources', None)
+    return monkeypatch
+
+
+def test_meteor_records_degraded_mode(meteor_resources):
+    meteor_resources.setattr(text_metric, 'nltk', None)
+    _, result = cal_metric.call_METEOR(SAMPLES).evaluate()
+    assert result['METEOR_mode'] == {'tokenizer': 'regex', 'stemming': False, 'synonyms': False}
+    assert 0 < result['METEOR']['all'] < 1
+
+
+def test_meteor_full_mode_is_not_reported(meteor_resources):
+    resources = text_metric._MeteorResources.__new__(text_metric._MeteorResources)
+    resources.tokenize, resources.stem, resources.wordnet = str.split, None, None
+    resources.mode = {'tokenizer': 'punkt', 'stemming': True, 'synonyms': True}
+    meteor_resources.setattr(text_metric, '_meteor_resources', resources)
+    _, result = cal_metric.call_METEOR(SAMPLES).evaluate()
+    assert list(result) == ['METEOR']
+
+
+def nmt_compute_bleu(reference_corpus, translation_corpus, max_order=4):
+    """compute_bleu of the tensorflow nmt code used by HF evaluate's bleu module (without smoothing)"""
+    def get_ngrams(segment):
+        ngram_counts = collections.Counter()
+        for order in range(1, max_order + 1):
+            for i in range(0, len(segment) - order + 1):
+                ngram_counts[tuple(segment[i:i + order])] += 1
+        return ngram_counts
+
+    matches_by_order = [0] * max_order
+    possible_matches_by_order = [0] * max_order
+    reference_length = translation_length = 0
+    for references, translation in zip(reference_corpus, translation_corpus):
+        reference_length += min(len(r) for r in references)
+        translation_length += len(translation)
+        merged_ref_ngram_counts = collections.Counter()
+        for reference in references:
+            merged_ref_ngram_counts |= get_ngrams(reference)
+        overlap = get_ngrams(translation) & merged_ref_ngram_counts
+        for ngram in overlap:
+            matches_by_order[len(ngram) - 1] += overlap[ngram]
+        for order in range(1, max_order + 1):
+            if len(translation) - order + 1 > 0:
+                possible_matches_by_order[order - 1] += len(translation) - order + 1
+    precisions = [float(m) / p if p > 0 else 0.0 for m, p in zip(matches_by_order, possible_matches_by_order)]
+    geo_mean = math.exp(sum((1. / max_order) * math.log(p) for p in precisions)) if min(precisions) > 0 else 0
+    ratio = float(translation_length) / reference_length
+    bp = 1. if ratio > 1.0 else math.exp(1 - 1. / ratio)
+    return geo_mean * bp
+
+
+def random_corpus(rng, n):
+    words = ['the', 'cat', 'sat', 'on', 'mat', 'Table', '2', '3.5', ',', '.', '(a)', 'x-y', '&amp;']
+    corpus = []
+    for _ in range(n):
+        gt = [rng.choice(words) for _ in range(rng.randrange(1, 30))]
+        pred = [word for word in gt if rng.random() > 0.2] + [rng.choice(words) for _ in range(rng.randrange(3))]
+        corpus.append((' '.join(pred), ' '.join(gt)))
+    return corpus
+
+
+@pytest.mark.parametrize('text, tokens', [
+    ('Hello, world.', ['Hello', ',', 'world', '.']),
+    ('It costs $3.50, ok?', ['It', 'costs', '$', '3.50', ',', 'ok', '?']),
+    ('1,000 items', ['1,000', 'items']),
+    ('pages 2-3', ['pages', '2', '-', '3']),
+    ('&quot;hi&quot; &amp; bye', ['"', 'hi', '"', '&', 'bye']),
+])
+def test_tokenize_13a(text, tokens):
+    assert tokenize_13a(text) == tokens
+
+
+def test_group_bleu_from_summed_statistics_matches_nmt_bleu():
+    rng = random.Random(21)
+    corpus = random_corpus(rng, 200)
+    predictions, references = [pred for pred, _ in corpus], [gt for _, gt in corpus]
+    stats = bleu_statistics(predictions, references)
+    for _ in range(20):
+        indices = np.array(sorted(rng.sample(range(len(corpus)), rng.randrange(1, len(corpus)))))
+        expected = nmt_compute_bleu([[tokenize_13a(references[i])] for i in indices],
+                                    [tokenize_13a(predictions[i]) for i in indices])
+        assert corpus_bleu(stats[indices].sum(axis=0)) == pytest.approx(expected, abs=1e-12)
+
+
+def test_call_bleu_keeps_the_argument_order_of_evaluate():
+    # the gt was passed to evaluate as the prediction and the model output as the reference
+    _, result = cal_metric.call_BLEU(SAMPLES).evaluate()
+    expected = nmt_compute_bleu([[tokenize_13a(sample['pred'])] for sample in SAMPLES],
+                                [tokenize_13a(sample['gt']) for sample in SAMPLES])
+    assert result['BLEU']['all'] == pytest.approx(expected, abs=1e-12)
+
+
+def test_call_bleu_matches_evaluate():
+    evaluate = pytest.importorskip('evaluate')
+    try:
+        bleu = evaluate.load('bleu')
+    except Exception:
+        pytest.skip('the bleu module of evaluate is neither cached nor reachable')
+    _, result = cal_metric.call_BLEU(SAMPLES).evaluate()
+    expected = bleu.compute(predictions=[s['gt'] for s in SAMPLES], references=[[s['pred']] for s in SAMPLES])['bleu']
+    assert result['BLEU']['all'] == pytest.approx(expected, abs=1e-12)
+
+
+def test_meteor_regex_mode_by_hand(meteor_resources):
+    meteor_resources.setattr(text_metric, 'nltk', None)
+    # 5 of 6 words match in 3 chunks: the greedy exact stage pairs the first "the" with the last one of the
+    # reference, as nltk does; fmean = 5/6 and penalty = 0.5 * (3/5) ** 3
+    score = meteor_score('the cat sat on the mat', 'the cat sat on a mat')
+    assert score == pytest.approx((1 - 0.5 * 0.6 ** 3) * 5 / 6, abs=1e-12)
+    assert meteor_score('', 'the cat') == 0.0
+
+
+def test_meteor_matches_nltk(meteor_resources):
+    nltk = pytest.importorskip('nltk')
+    from nltk.translate.meteor_score import single_meteor_score
+    try:
+        nltk.word_tokenize('a')
+        nltk.corpus.wordnet.synsets('a')
+    except LookupError:
+        pytest.skip('needs the nltk punkt and wordnet data')
+    for pred, gt in random_corpus(random.Random(3), 50) + [(s['pred'], s['gt']) for s in SAMPLES]:
+        expected = single_meteor_score(nltk.word_tokenize(gt), nltk.word_tokenize(pred))
+        assert meteor_score(gt, pred) == pytest.approx(expected, abs=1e-12)
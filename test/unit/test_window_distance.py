@@ -0,0 +1,67 @@
+"""Bounded fixed-window fuzzy matching against the plain slide over every window (user-013)"""
+import random
+
+import pytest
+from Levenshtein import distance
+
+from utils.match_quick import SHORT_PATTERN_LEN, best_window_distance, semi_global_distances
+
+
+def semi_global_dp(pattern, text):
+    """Textbook semi-global alignment: the pattern may start anywhere in the text for free"""
+    column = list(range(len(pattern) + 1))
+    dists = [column[-1]]
+    for c in text:
+        new = [0]
+        for i, p in enumerate(pattern):
+            new.append(min(column[i] + (p != c), column[i + 1] + 1, new[i] + 1))
+        column = new
+        dists.append(column[-1])
+    return dists
+
+
+def slide(text, pattern):
+    dists = [distance(text[i:i + len(pattern)], pattern) for i in range(len(text) - len(pattern) + 1)]
+    return min(dists), dists.index(min(dists))
+
+
+def random_pair(rng, pattern_len, text_len, alphabet):
+    pattern = ''.join(rng.choice(alphabet) for _ in range(pattern_len))
+    text = [rng.choice(alphabet) for _ in range(text_len)]
+    # plant a mutated copy of the pattern, so that the best window is close but rarely exact
+    start = rng.randrange(text_len - pattern_len + 1)
+    planted = [c if rng.random() > 0.1 else rng.choice(alphabet) for c in pattern]
+    text[start:start + pattern_len] = planted
+    return pattern, ''.join(text)
+
+
+@pytest.mark.parametrize('pattern_len', [1, 5, 63, 64, 65, 130])
+def test_semi_global_distances_match_dp(pattern_len):
+    rng = random.Random(pattern_len)
+    for _ in range(20):
+        pattern, text = random_pair(rng, pattern_len, pattern_len + rng.randrange(40), 'abcd')
+        assert semi_global_distances(pattern, text) == semi_global_dp(pattern, text)
+
+
+def test_semi_global_distance_bounds_every_window():
+    rng = random.Random(1)
+    for _ in range(20):
+        pattern, text = random_pair(rng, 80, 200, 'ab c')
+        end_dists = semi_global_distances(pattern, text)
+        for i in range(len(text) - len(pattern) + 1):
+            assert end_dists[i + len(pattern)] <= distance(text[i:i + len(pattern)], pattern)
+
+
+@pytest.mark.parametrize('alphabet', ['ab', 'abcdefgh', 'the quick brown fox'])
+def test_best_window_distance_matches_slide(alphabet):
+    rng = random.Random(alphabet)
+    for _ in range(100):
+        pattern_len = rng.choice([3, SHORT_PATTERN_LEN, SHORT_PATTERN_LEN + 1, 100, 150])
+        pattern, text = random_pair(rng, pattern_len, pattern_len + rng.randrange(1, 300), alphabet)
+        assert best_window_distance(text, pattern) == slide(text, pattern)
+
+
+def test_best_window_distance_returns_first_tie():
+    pattern = 'x' * 100
+    text = 'y' * 50 + 'x' * 99 + 'y' * 10 + 'x' * 99 + 'y' * 50
+    assert best_window_distance(text, pattern) == slide(text, pattern) == (1, 49)
@@ -0,0 +1,10 @@
+from .synthetic import generate_page, generate_pages, write_dataset
+from .hot_paths import BENCHMARKS, benchmark
+
+__all__ = [
+    "generate_page",
+    "generate_pages",
+    "write_dataset",
+    "BENCHMARKS",
+    "benchmark",
+]
@@ -0,0 +1,5 @@
+import sys
+
+from tools.benchmark.runner import main
+
+sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+The benchmarked hot paths. Each benchmark gets the synthetic pages and a scratch directory (removed after the
+benchmark) and returns a Case: run() is the timed work, reset() (untimed, before every run) drops the state a
+previous run left behind, e.g. the normalization memo.
+"""
+import os
+import re
+import shutil
+import importlib.util
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+Case = namedtuple('Case', ['run', 'reset'], defaults=[None])
+Benchmark = namedtuple('Benchmark', ['name', 'setup', 'requires', 'description'])
+
+BENCHMARKS = {}
+
+
+def benchmark(name, requires=(), description=''):
+    """
+    Register a benchmark setup(pages, work_dir) -> Case. requires lists the modules and the executables (prefixed
+    with 'bin:') it needs, the benchmark is skipped when one of them is missing.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = Benchmark(name, setup, tuple(requires), description)
+        return setup
+    return decorator
+
+
+def missing_requirements(bench):
+    missing = []
+    for requirement in bench.requires:
+        if requirement.startswith('bin:'):
+            if shutil.which(requirement[4:]) is None:
+                missing.append(requirement[4:])
+        elif importlib.util.find_spec(requirement) is None:
+            missing.append(requirement)
+    return missing
+
+
+def clear_norm_cache():
+    from utils.norm_cache import norm_cache
+    norm_cache.lru.clear()
+    norm_cache.persistent.clear()
+
+
+def page_formulas(pages):
+    """(gt latex, pred latex) of the display formulas, paired in reading order"""
+    from utils.extract import md_tex_filter
+    pairs = []
+    for page, markdown in pages:
+        gt = [item['latex'] for item in page['layout_dets'] if item['category_type'] == 'equation_isolated']
+        pred = [item['content'] for item in md_tex_filter(markdown)['equation_isolated']]
+        pairs.extend(zip(gt, pred))
+    return pairs
+
+
+@benchmark('md_tex_filter', description='split the prediction markdown of every page into blocks')
+def bench_md_tex_filter(pages, work_dir):
+    from utils.extract import md_tex_filter
+    markdowns = [markdown for _, markdown in pages]
+    return Case(lambda: [md_tex_filter(markdown) for markdown in markdowns], clear_norm_cache)
+
+
+@benchmark('match_gt2pred_quick', description='match the text and formula blocks of every page')
+def bench_match_gt2pred_quick(pages, work_dir):
+    from utils.extract import md_tex_filter
+    from utils.match_quick import match_gt2pred_quick
+    from dataset.end2end_dataset import End2EndDataset
+    # the page helpers of the dataset use no config, so they run without loading a ground truth file
+    dataset = End2EndDataset.__new__(End2EndDataset)
+    categories = ['text_block', 'title', 'equation_isolated']
+    inputs = []
+    for page, markdown in pages:
+        pred = md_tex_filter(markdown)
+        pred_mix = [item for category in pred if category not in ['html_table', 'latex_table', 'md2html_table']
+                    for item in pred[category]]
+        gt_mix = dataset.get_sorted_text_list(dataset.get_page_elements_list(dataset.get_page_elements(page), categories))
+        inputs.append((gt_mix, pred_mix, page['page_info']['image_path']))
+
+    def run():
+        return [match_gt2pred_quick(gt_mix, pred_mix, 'text_all', img_name) for gt_mix, pred_mix, img_name in inputs]
+    return Case(run, clear_norm_cache)
+
+
+@benchmark('normalized_formula', description='normalize the gt and pred display formulas')
+def bench_normalized_formula(pages, work_dir):
+    from utils.data_preprocess import normalized_formula
+    formulas = [latex for pair in page_formulas(pages) for latex in pair]
+    return Case(lambda: [normalized_formula(latex) for latex in formulas], clear_norm_cache)
+
+
+@benchmark('TEDS.evaluate', requires=('lxml', 'apted'), description='TEDS of every normalized gt/pred table pair')
+def bench_teds(pages, work_dir):
+    from utils.extract import md_tex_filter
+    from utils.data_preprocess import normalized_table
+    from metrics.table_metric import TEDS
+    pairs = []
+    for page, markdown in pages:
+        gt = [normalized_table(item['html']) for item in page['layout_dets'] if item['category_type'] == 'table']
+        pred = [normalized_table(item['content']) for item in md_tex_filter(markdown)['html_table']]
+        pairs.extend(zip(pred, gt))
+    teds = TEDS(structure_only=False)
+    return Case(lambda: [teds.evaluate(pred, gt) for pred, gt in pairs])
+
+
+@benchmark('CDM.color_latex', requires=('bin:node',),
+           description='tokenize, normalize and color the formulas for rendering (KaTeX in node)')
+def bench_cdm_color_latex(pages, work_dir):
+    from metrics.cdm_metric import CDM
+    from metrics.cdm.modules.latex2bbox_color import color_latex
+    formulas = [latex for pair in page_formulas(pages) for latex in pair]
+    color_list = CDM.gen_color_list(num=5800)
+    return Case(lambda: [color_latex(latex, str(idx), work_dir, color_list) for idx, latex in enumerate(formulas)])
+
+
+def synthetic_render(token_count, color_list, rng, token_size=(14, 22)):
+    """A color image as the render of a formula of token_count tokens, one colored glyph box per token"""
+    per_line = 40
+    width = 16 + min(token_count, per_line) * (token_size[0] + 4)
+    height = 16 + ((token_count - 1) // per_line + 1) * (token_size[1] + 8)
+    img = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for idx in range(token_count):
+        x = 8 + (idx % per_line) * (token_size[0] + 4)
+        y = 8 + (idx // per_line) * (token_size[1] + 8)
+        w, h = rng.integers(4, token_size[0]), rng.integers(6, token_size[1])
+        draw.rectangle([x, y, x + w, y + h], fill=color_list[idx])
+    return img
+
+
+@benchmark('CDM.extract_bbox', description='token boxes of the color renders of the formulas')
+def bench_cdm_extract_bbox(pages, work_dir):
+    from metrics.cdm_metric import CDM
+    from metrics.cdm.modules.latex2bbox_color import extrac_bbox_from_color_image
+    rng = np.random.default_rng(0)
+    color_list = CDM.gen_color_list(num=5800)
+    renders = []
+    for idx, (gt, _) in enumerate(page_formulas(pages)):
+        token_count = max(len(formula_tokens(gt)), 1)
+        renders.append((os.path.join(work_dir, f'{idx}.png'), synthetic_render(token_count, color_list, rng),
+                        color_list[:token_count]))
+
+    def reset():
+        # extraction overwrites the render with its black and white version
+        for path, img, _ in renders:
+            img.save(path)
+    return Case(lambda: [extrac_bbox_from_color_image(path, colors) for path, _, colors in renders], reset)
+
+
+def formula_tokens(latex):
+    """Whitespace-separated tokens of a formula without its $$ or \\[ \\] delimiters"""
+    return re.sub(r'^\s*(\$\$|\\\[)|(\$\$|\\\])\s*$', '', latex).split()
+
+
+def synthetic_boxes(pages):
+    """(gt boxes, pred boxes, gt size, pred size) of every formula, one box per token"""
+    rng = np.random.default_rng(0)
+    pairs = []
+    for gt, pred in page_formulas(pages):
+        boxes = []
+        for tokens in (formula_tokens(gt), formula_tokens(pred)):
+            x = np.cumsum(rng.integers(8, 24, size=len(tokens)))
+            y = rng.integers(0, 6, size=len(tokens))
+            boxes.append([{'bbox': [int(x0) - 8, int(y0), int(x0), int(y0) + 20], 'token': token}
+                          for token, x0, y0 in zip(tokens, x, y)])
+        if boxes[0] and boxes[1]:
+            sizes = [(box[-1]['bbox'][2] + 8, 32) for box in boxes]
+            pairs.append((boxes[0], boxes[1], sizes[0], sizes[1]))
+    return pairs
+
+
+@benchmark('CDM.hungarian_match', requires=('scipy',), description='Hungarian matching of the token boxes')
+def bench_cdm_hungarian(pages, work_dir):
+    from metrics.cdm.modules.visual_matcher import HungarianMatcher
+    matcher = HungarianMatcher()
+    pairs = synthetic_boxes(pages)
+    return Case(lambda: [matcher(box_gt, box_pred, gt_size, pred_size) for box_gt, box_pred, gt_size, pred_size in pairs])
+
+
+@benchmark('CDM.match', requires=('scipy', 'skimage'),
+           description='Hungarian matching and RANSAC filtering of the token boxes, with the F1 of each formula')
+def bench_cdm_match(pages, work_dir):
+    from metrics.cdm_metric import CDM
+    cdm = CDM(output_root=work_dir, cache_dir=None)
+    pairs = [(box_gt, box_pred, Image.new('RGB', gt_size), Image.new('RGB', pred_size))
+             for box_gt, box_pred, gt_size, pred_size in synthetic_boxes(pages)]
+
+    def run():
+        scores = []
+        for box_gt, box_pred, img_gt, img_pred in pairs:
+            _, inliers = cdm._match_boxes(box_gt, box_pred, img_gt, img_pred)
+            scores.append(cdm._calculate_metrics(box_gt, box_pred, inliers))
+        return scores
+    return Case(run)
+
+
+@benchmark('CDM.evaluate', requires=('skimage', 'bin:node', 'bin:xelatex', 'bin:magick'),
+           description='the whole CDM of the formulas: batched render, box extraction and matching')
+def bench_cdm_evaluate(pages, work_dir):
+    from metrics.cdm_metric import CDM
+    formulas = [(gt, pred, f'bench_{idx}') for idx, (gt, pred) in enumerate(page_formulas(pages))]
+    output_root = os.path.join(work_dir, 'cdm')
+    cdm = CDM(output_root=output_root, cache_dir=None)
+
+    def run():
+        cdm.generate_bboxes_batch(formulas)
+        return [cdm.evaluate(gt, pred, img_id) for gt, pred, img_id in formulas]
+
+    def reset():
+        shutil.rmtree(output_root, ignore_errors=True)
+    return Case(run, reset)
@@ -0,0 +1,198 @@
+"""
+Time and memory of the hot path benchmarks on synthetic pages, compared with stored baselines.
+
+    python -m tools.benchmark                      # run all benchmarks, flag regressions against baselines.json
+    python -m tools.benchmark --only TEDS.evaluate --repeat 10
+    python -m tools.benchmark --save-baseline      # record the current numbers as the new baselines
+    python -m tools.benchmark --write-dataset ./result/synthetic --pages 200   # synthetic end2end input
+
+The time of a benchmark is the best of --repeat runs after one warm-up run; the memory is the peak of the
+Python allocations (tracemalloc) of one more run, which does not count the node/xelatex subprocesses.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+
+from tabulate import tabulate
+
+from tools.benchmark.synthetic import generate_pages, write_dataset
+from tools.benchmark.hot_paths import BENCHMARKS, missing_requirements
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_WORKLOAD = {
+    'num_pages': 40,
+    'seed': 0,
+    'num_blocks': 24,
+    'table_rows': 10,
+    'table_cols': 6,
+    'num_tables': 1,
+    'formula_density': 0.25,
+    'truncation_rate': 0.1,
+    'noise_rate': 0.05,
+}
+# differences below these are timer, scheduling and allocator noise, whatever the ratio
+NOISE_FLOOR_SEC = 0.002
+NOISE_FLOOR_MB = 0.1
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+def measure(bench, pages, repeat=5):
+    """Best and median time of repeat runs and the peak traced memory (MB) of a benchmark"""
+    work_dir = tempfile.mkdtemp(prefix='omnidocbench_bench_')
+    try:
+        case = bench.setup(pages, work_dir)
+
+        def run_once():
+            if case.reset is not None:
+                case.reset()
+            start = time.perf_counter()
+            case.run()
+            return time.perf_counter() - start
+
+        run_once()  # warm-up: imports, lazily compiled regexes, the node worker of the tokenizer...
+        times = [run_once() for _ in range(repeat)]
+
+        if case.reset is not None:
+            case.reset()
+        tracemalloc.start()
+        try:
+            case.run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'time_min': min(times),
+        'time_median': statistics.median(times),
+        'peak_memory_mb': peak / 2**20,
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """(benchmark, measure, baseline value, current value) of every measure more than threshold above its baseline"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base_time, time_now = baseline[name]['time_min'], result['time_min']
+        if time_now > base_time * (1 + threshold) and time_now - base_time > NOISE_FLOOR_SEC:
+            regressions.append((name, 'time_min', base_time, time_now))
+        base_memory, memory_now = baseline[name]['peak_memory_mb'], result['peak_memory_mb']
+        if memory_now > base_memory * (1 + threshold) and memory_now - base_memory > NOISE_FLOOR_MB:
+            regressions.append((name, 'peak_memory_mb', base_memory, memory_now))
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, workload, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'machine': machine_info(), 'workload': workload, 'benchmarks': results}, f, indent=4)
+        f.write('\n')
+
+
+def process_args(args):
+    parser = argparse.ArgumentParser(description='Benchmark the evaluation hot paths on synthetic pages.')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run, all by default')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of each benchmark')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the baselines')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown or memory growth over the baseline flagged as a regression')
+    parser.add_argument('--write-dataset', metavar='DIR',
+                        help='only write the synthetic pages as gt.json and pred/*.md under DIR')
+    # the workload defaults to the one of the baselines, so that the numbers stay comparable
+    parser.add_argument('--pages', dest='num_pages', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--blocks', dest='num_blocks', type=int, help='text, title and formula blocks per page')
+    parser.add_argument('--table-rows', type=int)
+    parser.add_argument('--table-cols', type=int)
+    parser.add_argument('--tables', dest='num_tables', type=int, help='tables per page')
+    parser.add_argument('--formula-density', type=float, help='share of the blocks that are display formulas')
+    parser.add_argument('--truncation-rate', type=float, help='probability that a text block is truncated')
+    parser.add_argument('--noise-rate', type=float, help='character edit rate of the predictions')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    parameters = process_args(sys.argv[1:] if args is None else args)
+    baseline = load_baseline(parameters.baseline)
+    workload = dict(baseline['workload'] if baseline else DEFAULT_WORKLOAD)
+    for key in workload:
+        if getattr(parameters, key, None) is not None:
+            workload[key] = getattr(parameters, key)
+
+    if parameters.write_dataset:
+        gt_path, pred_dir = write_dataset(parameters.write_dataset, **workload)
+        print(f'Synthetic ground truth: {gt_path}\nSynthetic predictions: {pred_dir}')
+        return 0
+
+    pages = generate_pages(**workload)
+    results, skipped = {}, []
+    for name in parameters.only or BENCHMARKS:
+        bench = BENCHMARKS[name]
+        missing = missing_requirements(bench)
+        if missing:
+            skipped.append((name, ', '.join(missing)))
+            continue
+        print(f'Running {name}: {bench.description}')
+        results[name] = measure(bench, pages, parameters.repeat)
+
+    comparable = baseline is not None and baseline['workload'] == workload
+    base_results = baseline['benchmarks'] if comparable else {}
+    rows = []
+    for name, result in results.items():
+        base = base_results.get(name)
+        rows.append([name, f"{result['time_min']:.4f}", f"{result['time_median']:.4f}",
+                     f"{result['peak_memory_mb']:.1f}",
+                     f"{base['time_min']:.4f}" if base else '-',
+                     f"{result['time_min'] / base['time_min']:.2f}x" if base else '-'])
+    print(tabulate(rows, headers=['benchmark', 'best (s)', 'median (s)', 'peak memory (MB)', 'baseline (s)', 'ratio'],
+                   disable_numparse=True))
+    for name, missing in skipped:
+        print(f'Skipped {name}: {missing} not available')
+
+    if parameters.save_baseline:
+        save_baseline(parameters.baseline, workload, results)
+        print(f'Baselines saved to {parameters.baseline}')
+        return 0
+    if baseline is None:
+        print(f'No baselines at {parameters.baseline}, run with --save-baseline to record them.')
+        return 0
+    if not comparable:
+        print('The workload differs from the one of the baselines, the results are not compared.')
+        return 0
+    machine = machine_info()
+    if any(baseline['machine'].get(key) != machine[key] for key in ['processor', 'cpu_count', 'python']):
+        print(f"The baselines were recorded on another machine ({baseline['machine']['processor']}, "
+              f"{baseline['machine']['cpu_count']} CPUs, Python {baseline['machine']['python']}), "
+              'record local ones with --save-baseline before comparing.')
+
+    regressions = find_regressions(results, base_results, parameters.threshold)
+    for name, measure_name, base_value, value in regressions:
+        print(f'REGRESSION {name} {measure_name}: {base_value:.4f} -> {value:.4f} '
+              f'(+{(value / base_value - 1) * 100:.0f}%, threshold {parameters.threshold * 100:.0f}%)')
+    if not regressions:
+        print(f'No regression beyond {parameters.threshold * 100:.0f}% of the baselines.')
+    return 1 if regressions else 0
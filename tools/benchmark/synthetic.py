@@ -0,0 +1,215 @@
+"""
+Synthetic OmniDocBench pages and the markdown a model could have predicted for them.
+
+A page holds text blocks, titles, display formulas and tables in reading order. The prediction is the page
+rendered to markdown with recognition noise, and the text blocks tied by a 'truncated' relation are
+predicted as one paragraph, as models do for a paragraph split across columns or pages.
+"""
+import os
+import json
+import random
+
+WORDS = ('the', 'of', 'model', 'sample', 'layout', 'document', 'value', 'result', 'table', 'method', 'page',
+         'formula', 'text', 'data', 'analysis', 'reading', 'order', 'block', 'score', 'we', 'is', 'a', 'in',
+         'and', 'for', 'with', 'that', 'shows', 'under', 'each', 'over', 'between', 'recognition', 'evaluation')
+CJK_CHARS = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经'
+SYMBOLS = ('x', 'y', 'z', 'a', 'b', 'n', 'k', '\\alpha', '\\beta', '\\lambda', '\\sigma', '\\theta', '\\mu')
+OPERATORS = ('+', '-', '=', '\\leq', '\\cdot', '\\times')
+
+
+def random_sentence(rng, min_words=6, max_words=18, cjk_rate=0.2):
+    if rng.random() < cjk_rate:
+        return ''.join(rng.choice(CJK_CHARS) for _ in range(rng.randint(min_words * 2, max_words * 2))) + '。'
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def random_paragraph(rng, min_sentences=1, max_sentences=4):
+    return ' '.join(random_sentence(rng) for _ in range(rng.randint(min_sentences, max_sentences)))
+
+
+def random_term(rng, depth=0):
+    """A LaTeX term: a symbol, possibly with scripts, or a fraction, sum or bracket of terms"""
+    kind = rng.random() if depth < 2 else 0
+    if kind < 0.5:
+        term = rng.choice(SYMBOLS)
+        if rng.random() < 0.4:
+            term += '_{%s}' % rng.choice(('i', 'j', 'k', 'n', '0', '1'))
+        if rng.random() < 0.3:
+            term += '^{%d}' % rng.randint(2, 4)
+        return term
+    if kind < 0.7:
+        return '\\frac{%s}{%s}' % (random_expression(rng, depth + 1, 2), random_expression(rng, depth + 1, 2))
+    if kind < 0.85:
+        return '\\sum_{i=1}^{n} %s' % random_expression(rng, depth + 1, 2)
+    return '\\left( %s \\right)' % random_expression(rng, depth + 1, 3)
+
+
+def random_expression(rng, depth=0, max_terms=6):
+    terms = [random_term(rng, depth) for _ in range(rng.randint(1, max_terms))]
+    expression = terms[0]
+    for term in terms[1:]:
+        expression += ' %s %s' % (rng.choice(OPERATORS), term)
+    return expression
+
+
+def random_formula(rng):
+    return '%s = %s' % (random_term(rng), random_expression(rng))
+
+
+def random_table(rng, rows, cols):
+    """Cell texts of a table, the first row being the header"""
+    header = [rng.choice(WORDS).capitalize() for _ in range(cols)]
+    body = [[rng.choice(WORDS) if col == 0 else f'{rng.uniform(0, 100):.{rng.randint(0, 2)}f}' for col in range(cols)]
+            for _ in range(rows - 1)]
+    return [header] + body
+
+
+def table_html(cells, merge_header=False):
+    """Html of a table; merge_header spans the first header cell over two columns"""
+    header = cells[0]
+    if merge_header and len(header) > 2:
+        head = f'<th colspan="2">{header[0]}</th>' + ''.join(f'<th>{cell}</th>' for cell in header[2:])
+    else:
+        head = ''.join(f'<th>{cell}</th>' for cell in header)
+    body = ''.join('<tr>' + ''.join(f'<td>{cell}</td>' for cell in row) + '</tr>' for row in cells[1:])
+    return f'<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>'
+
+
+def add_noise(rng, text, noise_rate):
+    """Replace, drop or duplicate characters of text with probability noise_rate each"""
+    if noise_rate <= 0:
+        return text
+    chars = []
+    for char in text:
+        draw = rng.random()
+        if draw < noise_rate / 3:
+            chars.append(rng.choice('abcdefghijklmnopqrstuvwxyz'))
+        elif draw < noise_rate * 2 / 3:
+            continue
+        elif draw < noise_rate:
+            chars.append(char + char)
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def perturb_formula(rng, latex, noise_rate):
+    """Swap symbols and operators of a formula with probability noise_rate each, keeping it valid LaTeX"""
+    tokens = []
+    for token in latex.split(' '):
+        if token in SYMBOLS and rng.random() < noise_rate:
+            token = rng.choice(SYMBOLS)
+        elif token in OPERATORS and rng.random() < noise_rate:
+            token = rng.choice(OPERATORS)
+        tokens.append(token)
+    return ' '.join(tokens)
+
+
+def poly_of(x_min, y_min, x_max, y_max):
+    return [x_min, y_min, x_max, y_min, x_max, y_max, x_min, y_max]
+
+
+def generate_page(rng, image_name, num_blocks=20, table_rows=8, table_cols=5, num_tables=1, formula_density=0.2,
+                  truncation_rate=0.1, noise_rate=0.05):
+    """
+    One ground truth page in the OmniDocBench format and the prediction markdown of that page.
+
+    Args:
+        rng (random.Random): source of randomness, pages are reproducible from its seed
+        image_name (str): image_path of the page, the prediction is saved as its .md
+        num_blocks (int): text blocks, titles and display formulas of the page (tables come on top of them)
+        table_rows, table_cols (int): size of each table, header row included
+        num_tables (int): tables of the page
+        formula_density (float): share of the blocks that are display formulas
+        truncation_rate (float): probability that a text block is continued by the next text block
+        noise_rate (float): character edit rate of the predicted texts and table cells; the symbols and operators
+            of the predicted formulas are swapped at four times that rate
+    """
+    kinds = []
+    for idx in range(num_blocks):
+        draw = rng.random()
+        if draw < formula_density:
+            kinds.append('equation_isolated')
+        elif idx == 0 or draw > 0.92:
+            kinds.append('title')
+        else:
+            kinds.append('text_block')
+    for _ in range(num_tables):
+        kinds.insert(rng.randint(0, len(kinds)), 'table')
+
+    width, height = 1654, 2339
+    block_height = max(height // max(len(kinds), 1), 8)
+    layout_dets, relations, pred_blocks = [], [], []
+    for order, kind in enumerate(kinds):
+        item = {
+            'category_type': kind,
+            'poly': poly_of(100, order * block_height, width - 100, (order + 1) * block_height - 4),
+            'ignore': False,
+            'order': order + 1,
+            'anno_id': order,
+        }
+        if kind == 'equation_isolated':
+            latex = random_formula(rng)
+            item['latex'] = f'$$\n{latex}\n$$'
+            item['attribute'] = {'formula_type': 'print'}
+            pred_blocks.append(f'$$\n{perturb_formula(rng, latex, noise_rate * 4)}\n$$')
+        elif kind == 'table':
+            cells = random_table(rng, table_rows, table_cols)
+            merge_header = rng.random() < 0.5
+            item['html'] = table_html(cells, merge_header)
+            item['attribute'] = {'table_layout': 'horizontal', 'with_span': merge_header, 'language': 'table_en'}
+            pred_cells = [[add_noise(rng, cell, noise_rate) for cell in row] for row in cells]
+            if rng.random() < noise_rate * 4 and len(pred_cells) > 2:
+                pred_cells.pop(rng.randrange(1, len(pred_cells)))
+            pred_blocks.append(table_html(pred_cells, merge_header))
+        else:
+            text = random_sentence(rng, 2, 8, 0) if kind == 'title' else random_paragraph(rng)
+            item['text'] = text
+            item['attribute'] = {'text_language': 'text_english', 'text_background': 'white', 'text_rotate': 'normal'}
+            pred_text = add_noise(rng, text, noise_rate)
+            previous = layout_dets[-1] if layout_dets else None
+            if kind == 'text_block' and previous is not None and previous['category_type'] == 'text_block' \
+                    and rng.random() < truncation_rate:
+                relations.append({'source_anno_id': previous['anno_id'], 'target_anno_id': item['anno_id'],
+                                  'relation_type': 'truncated'})
+                pred_blocks[-1] += pred_text
+            else:
+                pred_blocks.append('# ' + pred_text if kind == 'title' else pred_text)
+        layout_dets.append(item)
+
+    page = {
+        'layout_dets': layout_dets,
+        'extra': {'relation': relations},
+        'page_info': {
+            'page_attribute': {'data_source': 'synthetic', 'language': 'english', 'layout': 'single_column',
+                               'special_issue': []},
+            'page_no': 0,
+            'height': height,
+            'width': width,
+            'image_path': image_name,
+        },
+    }
+    return page, '\n\n'.join(pred_blocks) + '\n'
+
+
+def generate_pages(num_pages=50, seed=0, **page_kwargs):
+    """num_pages (ground truth page, prediction markdown) pairs, see generate_page for the page_kwargs"""
+    rng = random.Random(seed)
+    return [generate_page(rng, f'synthetic_{idx:05d}.jpg', **page_kwargs) for idx in range(num_pages)]
+
+
+def write_dataset(out_dir, num_pages=50, seed=0, **page_kwargs):
+    """
+    Save synthetic pages as an end2end evaluation input: out_dir/gt.json and one markdown per page in
+    out_dir/pred, to be used as ground_truth.data_path and prediction.data_path of configs/end2end.yaml.
+    """
+    pages = generate_pages(num_pages, seed, **page_kwargs)
+    pred_dir = os.path.join(out_dir, 'pred')
+    os.makedirs(pred_dir, exist_ok=True)
+    for page, markdown in pages:
+        with open(os.path.join(pred_dir, page['page_info']['image_path'][:-4] + '.md'), 'w', encoding='utf-8') as f:
+            f.write(markdown)
+    with open(os.path.join(out_dir, 'gt.json'), 'w', encoding='utf-8') as f:
+        json.dump([page for page, _ in pages], f, ensure_ascii=False, indent=4)
+    return os.path.join(out_dir, 'gt.json'), pred_dir
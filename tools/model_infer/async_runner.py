@@ -0,0 +1,269 @@
+"""
+Shared asyncio runner of the image to markdown inference scripts: it lists the images, skips the ones whose
+markdown is already written, sends one request per image over a single pooled HTTP session and writes each answer
+to <save_root>/<image name without extension>.md, the file the end2end evaluation reads.
+
+A script only declares how to build the request of an image (and, for a non OpenAI-compatible API, how to read
+the markdown from the response):
+
+    import sys
+    from async_runner import chat_completion, image_content, run_inference
+
+    def build_request(image, args):
+        return chat_completion(args, [{'role': 'user', 'content': [image_content(image), {'type': 'text', 'text': PROMPT}]}])
+
+    if __name__ == '__main__':
+        sys.exit(run_inference(build_request, model='gpt-4o'))
+
+and gets the common options: --image_root, --save_root, --base_url, --api_key, --model, --concurrency (requests in
+flight), --rate and --burst (token bucket on the request starts), --max_retries and --timeout. Failed requests are
+retried with exponential backoff and jitter, honouring the Retry-After of a 429; a markdown is written to a
+temporary file first and then renamed, so that an interrupted run is resumed by running the same command again.
+Point --base_url to a local OpenAI-compatible server to try a script without calling the real API.
+"""
+import os
+import time
+import base64
+import random
+import asyncio
+import argparse
+from collections import namedtuple
+
+import aiohttp
+from tqdm import tqdm
+
+Request = namedtuple('Request', ['url', 'json', 'headers'], defaults=[None])
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# statuses worth a retry, the other 4xx (bad request, authentication...) fail the same way every time
+RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+MIME_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+
+
+class ResponseError(Exception):
+    def __init__(self, message, retry=True, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+class Image:
+    """An input image, read and base64-encoded once however many times its request is sent"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._base64 = None
+
+    @property
+    def base64(self):
+        if self._base64 is None:
+            with open(self.path, 'rb') as f:
+                self._base64 = base64.b64encode(f.read()).decode()
+        return self._base64
+
+    def release(self):
+        self._base64 = None
+
+    @property
+    def data_url(self):
+        mime = MIME_TYPES.get(os.path.splitext(self.name)[1].lower(), 'image/jpeg')
+        return f'data:{mime};base64,{self.base64}'
+
+
+def image_content(image):
+    """The OpenAI chat message part holding the image"""
+    return {'type': 'image_url', 'image_url': {'url': image.data_url}}
+
+
+def chat_completion(args, messages, **body):
+    """Request to the OpenAI-compatible chat completions endpoint of args.base_url with args.model"""
+    headers = {'Authorization': f'Bearer {args.api_key}'} if args.api_key else {}
+    return Request(f"{args.base_url.rstrip('/')}/chat/completions",
+                   {'model': args.model, 'messages': messages, **body}, headers)
+
+
+def chat_content(response):
+    """Markdown of a chat completions response"""
+    return response['choices'][0]['message']['content']
+
+
+def strip_markdown_fence(text):
+    """Drop the ```markdown fence some models wrap their whole answer in"""
+    text = text.strip()
+    if text.startswith('```markdown'):
+        text = text[len('```markdown'):].strip()
+    if text.endswith('```'):
+        text = text[:-len('```')].strip()
+    return text
+
+
+class TokenBucket:
+    """At most rate request starts per second on average, with bursts of up to burst requests"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # waiters queue on the lock, so that they get the tokens in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def output_path(image, save_root):
+    return os.path.join(save_root, os.path.splitext(image.name)[0] + '.md')
+
+
+def is_done(image, save_root):
+    # <image name>.md is the other name the evaluation reads a prediction from
+    return os.path.exists(output_path(image, save_root)) or os.path.exists(os.path.join(save_root, image.name + '.md'))
+
+
+def write_markdown(path, markdown):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(markdown)
+    os.replace(tmp_path, path)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def send(session, request, parse_response):
+    async with session.post(request.url, json=request.json, headers=request.headers) as response:
+        if response.status != 200:
+            text = await response.text()
+            retry_after = response.headers.get('Retry-After')
+            raise ResponseError(f'status {response.status}: {text[:200]}', retry=response.status in RETRY_STATUSES,
+                                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        data = await response.json(content_type=None)
+    try:
+        markdown = parse_response(data)
+    except (KeyError, IndexError, TypeError) as e:
+        raise ResponseError(f'unexpected response {str(data)[:200]}: {e!r}')
+    if not markdown or not markdown.strip():
+        raise ResponseError('empty response')
+    return markdown
+
+
+async def process_image(session, bucket, image, build_request, parse_response, args):
+    """Markdown of the image, retried up to args.max_retries times; raises the last error when all attempts fail"""
+    request = build_request(image, args)
+    for attempt in range(args.max_retries + 1):
+        await bucket.acquire()
+        try:
+            return await send(session, request, parse_response)
+        except (ResponseError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == args.max_retries or (isinstance(e, ResponseError) and not e.retry):
+                raise
+            delay = backoff_delay(attempt, args.backoff)
+            if isinstance(e, ResponseError) and e.retry_after is not None:
+                delay = max(delay, e.retry_after)
+            tqdm.write(f'Retrying {image.name} in {delay:.1f}s ({attempt + 1}/{args.max_retries}): {e!r}')
+            await asyncio.sleep(delay)
+
+
+async def run_images(images, build_request, parse_response, args):
+    """Run the images through args.concurrency workers sharing one session, return the names of the failed ones"""
+    queue = asyncio.Queue()
+    for image in images:
+        queue.put_nowait(image)
+    bucket = TokenBucket(args.rate, args.burst)
+    failed = []
+    progress = tqdm(total=len(images), desc='Inference')
+
+    async def worker(session):
+        while not queue.empty():
+            image = queue.get_nowait()
+            try:
+                markdown = await process_image(session, bucket, image, build_request, parse_response, args)
+                write_markdown(output_path(image, args.save_root), markdown)
+            except Exception as e:
+                failed.append(image.name)
+                tqdm.write(f'Failed {image.name}: {e!r}')
+            finally:
+                # the encoded image is only needed while its request is retried
+                image.release()
+                progress.update(1)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency, limit_per_host=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, trust_env=True) as session:
+        await asyncio.gather(*[worker(session) for _ in range(min(args.concurrency, len(images)))])
+    progress.close()
+    return failed
+
+
+def list_images(image_root, extensions=IMAGE_EXTENSIONS):
+    return [Image(os.path.join(image_root, name)) for name in sorted(os.listdir(image_root))
+            if name.lower().endswith(tuple(extensions))]
+
+
+def parse_args(description, defaults, args=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--image_root', type=str, default='./images', help='folder of the page images')
+    parser.add_argument('--save_root', type=str, default='./output', help='folder the markdowns are written to')
+    parser.add_argument('--base_url', type=str, default='API_URL', help='base url of the API')
+    parser.add_argument('--api_key', type=str, default='API_KEY',
+                        help='API key, the API_KEY environment variable by default')
+    parser.add_argument('--model', '--model_name', type=str, default='', help='model name')
+    parser.add_argument('--concurrency', '--threads', type=int, default=10, help='requests in flight')
+    parser.add_argument('--rate', type=float, default=0, help='request starts per second, 0 for no limit')
+    parser.add_argument('--burst', type=int, default=1, help='requests that may start at once within the rate')
+    parser.add_argument('--max_retries', type=int, default=5, help='retries of a failed request')
+    parser.add_argument('--backoff', type=float, default=1.0, help='base delay (s) of the exponential backoff')
+    parser.add_argument('--timeout', type=float, default=600, help='timeout (s) of a request')
+    parser.add_argument('--extensions', nargs='+', default=list(IMAGE_EXTENSIONS), help='image file extensions')
+    parser.set_defaults(**defaults)
+    if os.environ.get('API_KEY'):
+        # a real key in the environment wins over the placeholder key of a script
+        parser.set_defaults(api_key=os.environ['API_KEY'])
+    args = parser.parse_args(args)
+    # a callable default is derived from the other options, e.g. a save_root named after the model
+    for key, value in vars(args).items():
+        if callable(value):
+            setattr(args, key, value(args))
+    return args
+
+
+def run_inference(build_request, parse_response=chat_content, description='Convert page images to markdown.',
+                  args=None, **defaults):
+    """
+    Command line entry of an inference script.
+
+    Args:
+        build_request (callable): (Image, argparse.Namespace) -> Request of one image
+        parse_response (callable): json response -> markdown, the chat completions content by default
+        defaults: defaults of the options of the script, e.g. model='gpt-4o'; a callable default is called with
+            the parsed options, e.g. save_root=lambda args: args.model
+    """
+    args = parse_args(description, defaults, args)
+    os.makedirs(args.save_root, exist_ok=True)
+    images = list_images(args.image_root, args.extensions)
+    todo = [image for image in images if not is_done(image, args.save_root)]
+    print(f'Found {len(images)} images in {args.image_root}, {len(images) - len(todo)} already done, '
+          f'{len(todo)} to process')
+    if not todo:
+        return 0
+    failed = asyncio.run(run_images(todo, build_request, parse_response, args))
+    print(f'Done: {len(todo) - len(failed)} succeeded, {len(failed)} failed')
+    if failed:
+        print('Run the same command again to retry the failed images: ' + ', '.join(failed[:20])
+              + (' ...' if len(failed) > 20 else ''))
+        return 1
+    return 0
@@ -1,3 +1,4 @@
+import sys
 import mathpix
 import json
 import os
@@ -6,8 +7,8 @@ import time
 import io
 import fitz
 import base64
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from async_runner import Request, ResponseError, run_inference
 
 os.environ["http_proxy"] = "xxx"
 os.environ["https_proxy"] = "xxx"
@@ -90,19 +91,21 @@ def process_pdf_img(pdf_path):
         basename = os.path.basename(pdf_path).replace(".pdf", "")
         json.dump(results, open("./tmp.json".format(basename), "w"), indent=4)
 
-def process_img(image_path, output_dir):
-    with open(image_path, "rb") as file:
-        image_str = base64.b64encode(file.read()).decode()
-    results = mathpix_predict(image_str)
-    img_name = os.path.basename(image_path)
-    if results.get('text'):
-        with open(os.path.join(output_dir, img_name[:-4]+'.md'), 'w', encoding='utf-8') as outfile:
-            outfile.write(results['text'])
-    else:
-        print(results)
-        with open(os.path.join(output_dir, 'no_result.txt'), 'a') as f:
-            f.write(image_path)
-            f.write('\n')
+def build_request(image, args):
+    return Request(mathpix.servive_text, {
+        'src': image.data_url,
+        'formats': ['text'],
+        'math_inline_delimiters': ["$", "$"],
+        'math_display_delimiters': ["$$", "$$"],
+        'enable_tables_fallback': True,
+    }, mathpix.default_headers)
+
+
+def parse_response(response):
+    if response.get('error'):
+        # the image has no recognizable content, asking again gives the same answer
+        raise ResponseError(f"no result: {response['error']}", retry=False)
+    return response['text']
 
 
 def process_pdf(pdf_path):
@@ -117,21 +120,10 @@ def process_pdf(pdf_path):
 
 
 if __name__ == '__main__':
-    output_dir = 'xxx'
-
-    os.makedirs(output_dir, exist_ok=True)
-
-    from glob import glob
-
-    # paths = list(glob(data_root + "/*.pdf"))
-    img_folder = '../../demo_data/omnidocbench_demo/images'
-    paths = [os.path.join(img_folder, _) for _ in os.listdir(img_folder) if _.endswith('.jpg')]
-    with open('./no_result.txt', 'r') as f:
-        paths = [_.strip() for _ in f.readlines()]
-
-    for path in tqdm(paths):
-        process_img(path, output_dir)
-    # with ThreadPoolExecutor(max_workers=25) as executor:
-        # futures = [executor.submit(process_pdf_img, path) for path in paths]
-        # for future in tqdm(as_completed(futures), total=len(futures), desc="Processing files"):
-        #     future.result()  # Get the result to handle any exceptions
\ No newline at end of file
+    sys.exit(run_inference(
+        build_request,
+        parse_response,
+        image_root='../../demo_data/omnidocbench_demo/images',
+        save_root='xxx',
+        concurrency=25,
+    ))
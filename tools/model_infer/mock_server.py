@@ -0,0 +1,121 @@
+"""
+Local mock of an OpenAI-compatible /chat/completions endpoint, to try the inference scripts and the runner
+without calling a real API:
+
+    python mock_server.py --port 8000
+    python gpt_4o_inf.py --base_url http://127.0.0.1:8000/v1 --image_root ./images --save_root ./output
+
+Every request is answered with a small markdown page. In code, MockServer also takes a script of failures: the
+first answers to the requests whose text contains a marker, e.g. {'page_1': [(429, None, {'Retry-After': '1'})]}
+makes the first request of page_1 fail with a 429 and the next ones succeed.
+"""
+import asyncio
+import argparse
+import threading
+from collections import defaultdict
+
+from aiohttp import web
+
+
+def request_text(body):
+    """The text parts of the messages of a chat completions request"""
+    texts = []
+    for message in body.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(part.get('text', '') for part in content if part.get('type') == 'text')
+    return '\n'.join(texts)
+
+
+class MockServer:
+    """
+    The mock endpoint served from a background thread on 127.0.0.1, usable as a context manager.
+
+    Args:
+        script (dict): marker -> list of (status, content, headers) answered, in order, to the first requests
+            whose text contains the marker; a None content is the error body of a non-200 status
+        answer (str): markdown of the successful answers, followed by the marker of the request if any
+    """
+
+    def __init__(self, script=None, answer='# Mock page\n\nRecognized text.', port=0):
+        self.script = {marker: list(answers) for marker, answers in (script or {}).items()}
+        self.answer = answer
+        self.port = port
+        self.requests = defaultdict(int)   # marker (or '') -> number of requests received
+        self.texts = []                    # text of every request received
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}/v1'
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        text = request_text(body)
+        self.texts.append(text)
+        marker = next((marker for marker in self.script if marker in text), '')
+        self.requests[marker] += 1
+        answers = self.script.get(marker)
+        if answers:
+            status, content, headers = answers.pop(0)
+        else:
+            status, content, headers = 200, f'{self.answer}\n\n{marker}'.strip(), None
+        if status != 200:
+            return web.json_response({'error': {'message': content or f'mock error {status}'}}, status=status,
+                                     headers=headers)
+        return web.json_response({
+            'object': 'chat.completion',
+            'model': body.get('model', ''),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        }, headers=headers)
+
+    async def _start(self):
+        app = web.Application(client_max_size=64 * 2**20)
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start())
+            started.set()
+            self.loop.run_forever()
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a mock OpenAI-compatible chat completions endpoint.')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    with MockServer(port=args.port) as server:
+        print(f'Mock chat completions endpoint at {server.url}/chat/completions, Ctrl+C to stop')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
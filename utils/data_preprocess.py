@@ -2,11 +2,10 @@ import re
 import unicodedata
 from pylatexenc.latex2text import LatexNodes2Text
 from bs4 import BeautifulSoup
-import subprocess
-import shutil
-import uuid
 import html
 import os
+from utils.norm_cache import memoized
+from utils.latex2html import latex_converter
 
 def remove_markdown_fences(content):
     content = re.sub(r'^```markdown\n?', '', content, flags=re.MULTILINE)
@@ -73,6 +72,10 @@ inline_reg = re.compile(
     r'\\\((.*?)\\\)',
 )
 
+escape_reg = re.compile(r'\\([\\_&%^])')
+latex2text = LatexNodes2Text()
+
+@memoized
 def textblock2unicode(text):
     inline_matches = inline_reg.finditer(text)
     removal_positions = []
@@ -81,14 +84,14 @@ def textblock2unicode(text):
         content = match.group(1) if match.group(1) is not None else match.group(2)
         # print('-------- content-------', content)
         # Remove escape characters \
-        clean_content = re.sub(r'\\([\\_&%^])', '', content)
+        clean_content = escape_reg.sub('', content)
 
         try:
             if any(char in clean_content for char in r'\^_'):
                 if clean_content.endswith('\\'):
                     clean_content += ' '
                 # inline_array.append(match.group(0))
-                unicode_content = LatexNodes2Text().latex_to_text(clean_content)
+                unicode_content = latex2text.latex_to_text(clean_content)
                 removal_positions.append((position[0], position[1], unicode_content))
         except:
             continue
@@ -99,37 +102,43 @@ def textblock2unicode(text):
 
     return text
 
+formula_filter_list = ['\\mathbf', '\\mathrm', '\\mathnormal', '\\mathit', '\\mathbb', '\\mathcal', '\\mathscr', '\\mathfrak', '\\mathsf', '\\mathtt', 
+                       '\\textbf', '\\text', '\\boldmath', '\\boldsymbol', '\\operatorname', '\\bm',
+                       '\\symbfit', '\\mathbfcal', '\\symbf', '\\scriptscriptstyle', '\\notag',
+                       '\\setlength', '\\coloneqq', '\\space', '\\thickspace', '\\thinspace', '\\medspace', '\\nobreakspace', '\\negmedspace',
+                       '\\quad', '\\qquad', '\\enspace', '\\substackw', ' ', '$$', '\\left', '\\right', '\\displaystyle', '\\text']
+                    #    '\\left', '\\right', '{', '}', ' ']
+display_reg = re.compile(r"\\\[(.+?)(?<!\\)\\\]")
+# applied one after another, in this order
+formula_env_regs = [re.compile(r"\\tag\{.*?\}"), re.compile(r"\\hspace\{.*?\}"), re.compile(r"\\begin\{.*?\}"),
+                    re.compile(r"\\end\{.*?\}"), re.compile(r"\\arraycolsep.*?\}")]
+
+def remove_formula_filter_tokens(text):
+    # every filter token contains '\\', ' ' or '$'
+    if '\\' not in text and ' ' not in text and '$' not in text:
+        return text
+    # the order matters: a removal can join the pieces of a later token (e.g. \text\mathrmbf)
+    for filter_text in formula_filter_list:
+        text = text.replace(filter_text, '')
+    return text
+
+@memoized
 def normalized_formula(text):
     # Normalize math formulas before matching
-    filter_list = ['\\mathbf', '\\mathrm', '\\mathnormal', '\\mathit', '\\mathbb', '\\mathcal', '\\mathscr', '\\mathfrak', '\\mathsf', '\\mathtt', 
-                   '\\textbf', '\\text', '\\boldmath', '\\boldsymbol', '\\operatorname', '\\bm',
-                   '\\symbfit', '\\mathbfcal', '\\symbf', '\\scriptscriptstyle', '\\notag',
-                   '\\setlength', '\\coloneqq', '\\space', '\\thickspace', '\\thinspace', '\\medspace', '\\nobreakspace', '\\negmedspace',
-                   '\\quad', '\\qquad', '\\enspace', '\\substackw', ' ', '$$', '\\left', '\\right', '\\displaystyle', '\\text']
-                #    '\\left', '\\right', '{', '}', ' ']
     
     # delimiter_filter
     text = text.strip().strip('$').strip('\n')
-    pattern = re.compile(r"\\\[(.+?)(?<!\\)\\\]")
-    match = pattern.search(text)
+    match = display_reg.search(text)
 
     if match:
         text = match.group(1).strip()
     
-    tag_pattern = re.compile(r"\\tag\{.*?\}")
-    text = tag_pattern.sub('', text)
-    hspace_pattern = re.compile(r"\\hspace\{.*?\}")
-    text = hspace_pattern.sub('', text)
-    begin_pattern = re.compile(r"\\begin\{.*?\}")
-    text = begin_pattern.sub('', text)
-    end_pattern = re.compile(r"\\end\{.*?\}")
-    text = end_pattern.sub('', text)
-    col_sep = re.compile(r"\\arraycolsep.*?\}")
-    text = col_sep.sub('', text)
+    # \tag, \hspace, \begin, \end and \arraycolsep
+    for env_reg in formula_env_regs:
+        text = env_reg.sub('', text)
     text = text.strip('.')
     
-    for filter_text in filter_list:
-        text = text.replace(filter_text, '')
+    text = remove_formula_filter_tokens(text)
         
     # text = normalize_text(delimiter_filter(text))
     # text = delimiter_filter(text)
@@ -207,30 +216,6 @@ def normalized_html_table(text):
     return norm_text
 
 def normalized_latex_table(text):
-    def latex_template(latex_code):  
-        template = r'''
-        \documentclass[border=20pt]{article}
-        \usepackage{subcaption}
-        \usepackage{url}
-        \usepackage{graphicx}
-        \usepackage{caption}
-        \usepackage{multirow}
-        \usepackage{booktabs}
-        \usepackage{color}
-        \usepackage{colortbl}
-        \usepackage{xcolor,soul,framed}
-        \usepackage{fontspec}
-        \usepackage{amsmath,amssymb,mathtools,bm,mathrsfs,textcomp}
-        \setlength{\parindent}{0pt}''' + \
-        r'''
-        \begin{document}
-        ''' + \
-        latex_code + \
-        r'''
-        \end{document}'''
-    
-        return template
-
     def process_table_latex(latex_code):
         SPECIAL_STRINGS= [
             ['\\\\vspace\\{.*?\\}', ''],
@@ -274,33 +259,7 @@ def normalized_latex_table(text):
 
         return latex_code
     
-    def convert_latex_to_html(latex_content, cache_dir='./temp'):
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-
-        uuid_str = str(uuid.uuid1())
-        with open(f'{cache_dir}/{uuid_str}.tex', 'w') as f:
-            f.write(latex_template(latex_content))
-
-        cmd = ['latexmlc', '--quiet', '--nocomments', f'--log={cache_dir}/{uuid_str}.log',
-               f'{cache_dir}/{uuid_str}.tex', f'--dest={cache_dir}/{uuid_str}.html']
-        try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            with open(f'{cache_dir}/{uuid_str}.html', 'r') as f:
-                html_content = f.read()
-
-            pattern = r'<table\b[^>]*>(.*)</table>'
-            tables = re.findall(pattern, html_content, re.DOTALL | re.IGNORECASE)
-            tables = [f'<table>{table}</table>' for table in tables]
-            html_content = '\n'.join(tables)
-        
-        except Exception as e:
-            html_content = ''
-        
-        shutil.rmtree(cache_dir)
-        return html_content
-    
-    html_text = convert_latex_to_html(text)
+    html_text = latex_converter.convert([text])[0]
     normlized_tables = normalized_html_table(html_text)
     return normlized_tables
 
@@ -444,9 +403,12 @@ def inline_filter(text):
     return text, inline_array
 
 # Text OCR quality check processing:
+non_word_reg = re.compile(r'[^\w\u4e00-\u9fff]')
+
+@memoized
 def clean_string(input_string):
     # Use regex to keep Chinese characters, English letters and numbers
     # input_string = input_string.replace('\\t', '').replace('\\n', '').replace('\t', '').replace('\n', '').replace('/t', '').replace('/n', '')
     input_string = input_string.replace('\\t', '').replace('\\n', '').replace('\t', '').replace('\n', '').replace('/t', '').replace('/n', '')
-    cleaned_string = re.sub(r'[^\w\u4e00-\u9fff]', '', input_string)   # 只保留中英文和数字
+    cleaned_string = non_word_reg.sub('', input_string)   # 只保留中英文和数字
     return cleaned_string
\ No newline at end of file
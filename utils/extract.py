@@ -2,8 +2,10 @@ import re
 import os
 import json
 import copy
+import itertools
 #from  modules.table_utils import convert_markdown_to_html #end
 from  utils.table_utils import convert_markdown_to_html
+from utils.trace import traced
 import re
 import unicodedata
 from bs4 import BeautifulSoup
@@ -15,45 +17,68 @@ import pdb
 from utils.data_preprocess import remove_markdown_fences, replace_repeated_chars, textblock_with_norm_formula, textblock2unicode
 
 
-def extract_tabular(text):
-    begin_pattern = r'\\begin{tabular}'
-    end_pattern = r'\\end{tabular}'
-
-    tabulars = []
+def extract_nested_blocks(text, begin_reg, end_reg, begin_step, end_step, restart_step, start=0):
+    """
+    Find the outermost begin/end blocks of text[start:] with a cursor over the whole string, returns absolute positions.
+    The cursor moves by begin_step after a begin and end_step after an end; if a block is left open, the text after
+    its begin (+restart_step) is scanned again.
+    """
+    blocks = []
     positions = []
-    current_pos = 0
+    current_pos = start
     stack = []
-    
+    # the next matches at or after current_pos, searched again only once the cursor has passed them
+    begin_match = begin_reg.search(text, current_pos)
+    end_match = end_reg.search(text, current_pos)
+
     while current_pos < len(text):
-        begin_match = re.search(begin_pattern, text[current_pos:])
-        end_match = re.search(end_pattern, text[current_pos:])
-        
+        if begin_match and begin_match.start() < current_pos:
+            begin_match = begin_reg.search(text, current_pos)
+        if end_match and end_match.start() < current_pos:
+            end_match = end_reg.search(text, current_pos)
+
         if not begin_match and not end_match:
             break
-            
+
         if begin_match and (not end_match or begin_match.start() < end_match.start()):
-            stack.append(current_pos + begin_match.start())
-            current_pos += begin_match.start() + len(end_pattern)
+            stack.append(begin_match.start())
+            current_pos = begin_match.start() + begin_step
         elif end_match:
             if stack:
                 start_pos = stack.pop()
                 if not stack:
-                    end_pos = current_pos + end_match.start() + len(end_pattern)
-                    tabular_code = text[start_pos:end_pos]
-                    tabulars.append(tabular_code)
+                    end_pos = end_match.start() + end_step
+                    blocks.append(text[start_pos:end_pos])
                     positions.append((start_pos, end_pos))
-            current_pos += end_match.start() + len(end_pattern)
+            current_pos = end_match.start() + end_step
         else:
             current_pos += 1
-    
+
     if stack:
-        new_start = stack[0] + len(begin_pattern)
-        new_tabulars, new_positions = extract_tabular(text[new_start:])
-        new_positions = [(start + new_start, end + new_start) for start, end in new_positions]
-        tabulars.extend(new_tabulars)
+        new_blocks, new_positions = extract_nested_blocks(text, begin_reg, end_reg, begin_step, end_step, restart_step,
+                                                          start=stack[0] + restart_step)
+        blocks.extend(new_blocks)
         positions.extend(new_positions)
 
-    return tabulars, positions
+    return blocks, positions
+
+
+def blank_spans(content, spans):
+    """Replace the [start, end) spans of content with spaces in one pass, keeping every position unchanged"""
+    if not spans:
+        return content
+    chars = list(content)
+    for start, end in spans:
+        chars[start:end] = ' ' * len(chars[start:end])
+    return ''.join(chars)
+
+
+tabular_begin_reg = re.compile(r'\\begin{tabular}')
+tabular_end_reg = re.compile(r'\\end{tabular}')
+
+def extract_tabular(text):
+    # the steps are the lengths of the pattern strings r'\\end{tabular}' and r'\\begin{tabular}'
+    return extract_nested_blocks(text, tabular_begin_reg, tabular_end_reg, 14, 14, 16)
 
 # math reg
     # r'\\begin{equation\*?}(.*?)\\end{equation\*?}|'
@@ -108,6 +133,7 @@ code_block_reg = re.compile(
     re.DOTALL
 )
 
+@traced('md_tex_filter')
 def md_tex_filter(content):
     '''
     Input: 1 page md or tex content - String
@@ -147,6 +173,7 @@ def md_tex_filter(content):
     
     # extract latex table 
     latex_table_array, table_positions = extract_tex_table(content)
+    spans = []
     for latex_table, position in zip(latex_table_array, table_positions):
         position = [position[0], position[0]+len(latex_table)]   # !!!
         pred_all.append({
@@ -154,13 +181,15 @@ def md_tex_filter(content):
             'position': position,
             'content': latex_table
         })
-        content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace latex table with space
+        spans.append(position)
+    content = blank_spans(content, spans)  # replace latex table with space
 
     # print('--------After latex table: \n', content)
     # print('-------latex_table_array: \n', latex_table_array)
 
     # extract html table  
     html_table_array, table_positions = extract_html_table(content)
+    spans = []
     for html_table, position in zip(html_table_array, table_positions):
         position = [position[0], position[0]+len(html_table)]
         pred_all.append({
@@ -168,7 +197,8 @@ def md_tex_filter(content):
             'position': position,
             'content': html_table
         })
-        content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace html table with space
+        spans.append(position)
+    content = blank_spans(content, spans)  # replace html table with space
     # html_table_array = []
     # html_table_matches = html_table_reg.finditer(content)
     # if html_table_matches:
@@ -200,6 +230,7 @@ def md_tex_filter(content):
     # extract interline formula
     display_matches = display_reg.finditer(content)
     content_copy = content
+    spans = []
     for match in display_matches:
         matched = match.group(0)
         if matched:
@@ -211,7 +242,7 @@ def md_tex_filter(content):
             sub_match = dollar_pattern.search(single_line)
             if sub_match is None:
                 # pass
-                content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]
+                spans.append(position)  # replace equation with space
                 pred_all.append({
                     'category_type': 'equation_isolated',
                     'position': position,
@@ -219,7 +250,7 @@ def md_tex_filter(content):
                 })
             elif sub_match.group(1):
                 single_line = re.sub(dollar_pattern, r'\\[\1\\]', single_line)
-                content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace equation with space
+                spans.append(position)  # replace equation with space
                 pred_all.append({
                     'category_type': 'equation_isolated',
                     'position': position,
@@ -253,40 +284,45 @@ def md_tex_filter(content):
             #     'content': single_line
             # })
             # print('-----Found display formula: ', matched)
+    content = blank_spans(content, spans)
 
     # print('-------------After display: \n', content)
     # extract md table with ||
-    md_table_mathces = md_table_reg.findall(content+'\n')
+    # only whether there are two md table rows matters, stop looking after the second one
+    md_table_mathces = list(itertools.islice(md_table_reg.finditer(content+'\n'), 2))
     if len(md_table_mathces) >= 2:
         # print("md table found!")
         # print("content:", content)
         content = convert_markdown_to_html(content)
         # print('----------content after converting md table to html:', content)
         html_table_matches = html_table_reg.finditer(content)
+        spans = []
         if html_table_matches:
             for match in html_table_matches:
                 matched = match.group(0)
                 position = [match.start(), match.end()]
                 # content = content.replace(match, '')
                 # print('content after removing the md table:', content)
-                content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace md table with space
+                spans.append(position)  # replace md table with space
                 pred_all.append({
                     'category_type': 'html_table',
                     'position': position,
                     'content': matched.strip(),
                     'fine_category_type': 'md2html_table'
                 })
+        content = blank_spans(content, spans)
     # print('---------After md table: \n', content)
 
     # extract code blocks
     code_matches = code_block_reg.finditer(content)
+    spans = []
     if code_matches:
         for match in code_matches:
             position = [match.start(), match.end()]
             language = match.group(1)
             code = match.group(2).strip()
             # content = content.replace(match.group(0), '')
-            content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace code block with space
+            spans.append(position)  # replace code block with space
             pred_all.append({
                 'category_type': 'text_all',
                 'position': position,
@@ -294,6 +330,7 @@ def md_tex_filter(content):
                 'language': language,
                 'fine_category_type': 'code'
             })
+    content = blank_spans(content, spans)
 
     # print('-------After code block: \n', content)
 
@@ -452,7 +489,7 @@ def extract_tex_table(content):
         table_content = match.group(0)
         tables.append(table_content)
         tables_positions.append((start_pos, end_pos))
-        content = content[:start_pos] + ' '*(end_pos-start_pos) + content[end_pos:]
+    content = blank_spans(content, tables_positions)
 
     tabulars, tabular_positions = extract_tabular(content)
     all_tables = tables + tabulars
@@ -480,45 +517,12 @@ def extract_tex_table(content):
 #             positions.append((start_pos, end_pos))
 #     return tables, positions
 
-def extract_html_table(text):
-    begin_pattern = r'<table(?:[^>]*)>'
-    end_pattern = r'</table>'
+html_table_begin_reg = re.compile(r'<table(?:[^>]*)>')
+html_table_end_reg = re.compile(r'</table>')
 
-    tabulars = []
-    positions = []
-    current_pos = 0
-    stack = []
-    
-    while current_pos < len(text):
-        begin_match = re.search(begin_pattern, text[current_pos:])
-        end_match = re.search(end_pattern, text[current_pos:])
-        
-        if not begin_match and not end_match:
-            break
-            
-        if begin_match and (not end_match or begin_match.start() < end_match.start()):
-            stack.append(current_pos + begin_match.start())
-            current_pos += begin_match.start() + len(end_pattern)
-        elif end_match:
-            if stack:
-                start_pos = stack.pop()
-                if not stack:
-                    end_pos = current_pos + end_match.start() + len(end_pattern)
-                    tabular_code = text[start_pos:end_pos]
-                    tabulars.append(tabular_code)
-                    positions.append((start_pos, end_pos))
-            current_pos += end_match.start() + len(end_pattern)
-        else:
-            current_pos += 1
-    
-    if stack:
-        new_start = stack[0] + len(begin_pattern)
-        new_tabulars, new_positions = extract_html_table(text[new_start:])
-        new_positions = [(start + new_start, end + new_start) for start, end in new_positions]
-        tabulars.extend(new_tabulars)
-        positions.extend(new_positions)
-
-    return tabulars, positions
+def extract_html_table(text):
+    # the steps are the lengths of the pattern strings r'</table>' and r'<table(?:[^>]*)>'
+    return extract_nested_blocks(text, html_table_begin_reg, html_table_end_reg, 8, 8, 16)
 
 
 def extract_node_content(node):
@@ -0,0 +1,181 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# bump when the template or the post-processing changes the converted html
+LATEX2HTML_CACHE_VERSION = "2"
+# marks the start of each table when several tables are converted in one document
+BATCH_SEPARATOR = 'OmniDocBenchTableSeparator'
+
+
+def latex_template(latex_code):
+    template = r'''
+        \documentclass[border=20pt]{article}
+        \usepackage{subcaption}
+        \usepackage{url}
+        \usepackage{graphicx}
+        \usepackage{caption}
+        \usepackage{multirow}
+        \usepackage{booktabs}
+        \usepackage{color}
+        \usepackage{colortbl}
+        \usepackage{xcolor,soul,framed}
+        \usepackage{fontspec}
+        \usepackage{amsmath,amssymb,mathtools,bm,mathrsfs,textcomp}
+        \setlength{\parindent}{0pt}''' + \
+        r'''
+        \begin{document}
+        ''' + \
+        latex_code + \
+        r'''
+        \end{document}'''
+
+    return template
+
+
+def extract_html_tables(html_content):
+    pattern = r'<table\b[^>]*>(.*)</table>'
+    tables = re.findall(pattern, html_content, re.DOTALL | re.IGNORECASE)
+    tables = [f'<table>{table}</table>' for table in tables]
+    return '\n'.join(tables)
+
+
+def run_latexmlc(latex_document):
+    """Convert a LaTeX document in a private temp dir, return the html or None if latexmlc failed"""
+    work_dir = tempfile.mkdtemp(prefix='latexml_')
+    try:
+        with open(os.path.join(work_dir, 'table.tex'), 'w') as f:
+            f.write(latex_document)
+        cmd = ['latexmlc', '--quiet', '--nocomments', f'--log={work_dir}/table.log',
+               f'{work_dir}/table.tex', f'--dest={work_dir}/table.html']
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(os.path.join(work_dir, 'table.html'), 'r') as f:
+            return f.read()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def convert_latex_table(latex_content):
+    html_content = run_latexmlc(latex_template(latex_content))
+    if html_content is None:
+        return ''
+    return extract_html_tables(html_content)
+
+
+def convert_latex_table_batch(latex_list):
+    """
+    Convert several tables with one latexmlc run. Each table is wrapped in a group with the float counters reset
+    and preceded by a separator paragraph; the tables are converted one by one if the output cannot be split back.
+    """
+    if len(latex_list) == 1:
+        return [convert_latex_table(latex_list[0])]
+    body = ''.join(f'\n\n{BATCH_SEPARATOR}{idx}\n\n'
+                   r'\setcounter{table}{0}\setcounter{figure}{0}\setcounter{footnote}{0}\setcounter{equation}{0}'
+                   f'\n\\begingroup\n{latex_content}\n\\endgroup\n'
+                   for idx, latex_content in enumerate(latex_list))
+    html_content = run_latexmlc(latex_template(body))
+    if html_content is not None:
+        parts = re.split(f'{BATCH_SEPARATOR}(\\d+)', html_content)
+        if parts[1::2] == [str(idx) for idx in range(len(latex_list))]:
+            return [extract_html_tables(part) for part in parts[2::2]]
+    return [convert_latex_table(latex_content) for latex_content in latex_list]
+
+
+class LatexTableConverter:
+    """
+    LaTeX table -> html conversion with latexmlc, memoized by content.
+
+    convert() runs the missing tables in batches (one latexmlc process per batch) on a pool of worker threads,
+    every run in its own temp dir. With cache_dir the results are also kept on disk across runs.
+
+    The first check_size tables are converted both in a batch and one by one: if the outputs differ (latexmlc
+    numbers some element ids by their position in the document), batching is turned off so that the html, and
+    the metrics computed on it, stay those of the single-table conversion.
+    """
+    def __init__(self, batch_size=32, check_size=3):
+        self.batch_size = batch_size
+        self.check_size = check_size
+        self.batch_checked = False
+        self.memo = {}
+        self.available = None
+
+    def _store(self, latex_content, html_content, cache_dir):
+        self.memo[latex_content] = html_content
+        if cache_dir:
+            self._save(cache_dir, latex_content, html_content)
+
+    def _check_batching(self, latex_list, cache_dir):
+        self.batch_checked = True
+        single = [convert_latex_table(latex_content) for latex_content in latex_list]
+        for latex_content, html_content in zip(latex_list, single):
+            self._store(latex_content, html_content, cache_dir)
+        if convert_latex_table_batch(latex_list) != single:
+            print('latexmlc converts the LaTeX tables differently in a batch, converting them one by one.')
+            self.batch_size = 1
+
+    @staticmethod
+    def key(latex_content):
+        content = '\n'.join([LATEX2HTML_CACHE_VERSION, latex_content])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _entry_path(cache_dir, key):
+        return os.path.join(cache_dir, key[:2], key + '.html')
+
+    def _load(self, cache_dir, latex_content):
+        try:
+            with open(self._entry_path(cache_dir, self.key(latex_content)), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _save(self, cache_dir, latex_content, html_content):
+        path = self._entry_path(cache_dir, self.key(latex_content))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(html_content)
+            os.replace(tmp, path)
+        except OSError:  # a full or read-only cache must not fail the evaluation
+            pass
+
+    def convert(self, latex_list, num_workers=1, cache_dir=None):
+        """Return the html tables of each LaTeX table in latex_list ('' if the conversion failed)"""
+        if self.available is None:
+            self.available = shutil.which('latexmlc') is not None
+            if not self.available:
+                print('latexmlc is not installed, LaTeX tables are evaluated as empty tables.')
+        pending = []
+        for latex_content in dict.fromkeys(latex_list):
+            if latex_content in self.memo:
+                continue
+            html_content = self._load(cache_dir, latex_content) if cache_dir else None
+            if html_content is not None:
+                self.memo[latex_content] = html_content
+            elif not self.available:
+                self.memo[latex_content] = ''
+            else:
+                pending.append(latex_content)
+
+        if self.batch_size > 1 and not self.batch_checked and len(pending) > 1:
+            self._check_batching(pending[:self.check_size], cache_dir)
+            pending = pending[self.check_size:]
+
+        if pending:
+            batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+                for batch, html_list in zip(batches, executor.map(convert_latex_table_batch, batches)):
+                    for latex_content, html_content in zip(batch, html_list):
+                        self._store(latex_content, html_content, cache_dir)
+
+        return [self.memo[latex_content] for latex_content in latex_list]
+
+
+latex_converter = LatexTableConverter()
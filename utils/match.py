@@ -1,14 +1,19 @@
 from scipy.optimize import linear_sum_assignment
 import Levenshtein
 import numpy as np
+from rapidfuzz.process import cdist
+from rapidfuzz.distance import Levenshtein as rf_Levenshtein
 import re
 import sys
 import pdb
 from .data_preprocess import textblock_with_norm_formula, normalized_formula, textblock2unicode, clean_string
+from .trace import traced
 import re
 from bs4 import BeautifulSoup
 from copy import deepcopy
 
+CDIST_PARALLEL_MIN_CELLS = 4096  # below this, thread start-up costs more than the distances themselves
+
 def get_pred_category_type(pred_idx, pred_items):
     if pred_items[pred_idx].get('fine_category_type'):
         pred_pred_category_type = pred_items[pred_idx]['fine_category_type']
@@ -18,20 +23,31 @@ def get_pred_category_type(pred_idx, pred_items):
 
 
 def compute_edit_distance_matrix_new(gt_lines, matched_lines):
-    try:
-        distance_matrix = np.zeros((len(gt_lines), len(matched_lines)))
-        for i, gt_line in enumerate(gt_lines):
-            for j, matched_line in enumerate(matched_lines):
-                if len(gt_line) == 0 and len(matched_line) == 0:
-                    distance_matrix[i][j] = 0  
-                else:
-                    distance_matrix[i][j] = Levenshtein.distance(gt_line, matched_line) / max(len(matched_line), len(gt_line))
+    '''
+    Normalized edit distance matrix, cell (i, j) = Levenshtein(gt_i, pred_j) / max(len(gt_i), len(pred_j)).
+    All pairs are computed in one batched rapidfuzz call; pairs whose length difference already
+    forces the cost to 1 (exactly one side empty) are filled directly without computing the distance.
+    '''
+    gt_lens = np.array([len(line) for line in gt_lines], dtype=np.int64)
+    pred_lens = np.array([len(line) for line in matched_lines], dtype=np.int64)
+    max_lens = np.maximum.outer(gt_lens, pred_lens)
+    # |len_a - len_b| <= distance <= max(len_a, len_b), so the bound reaches 1 only when one side is empty
+    distance_matrix = np.where(max_lens > 0, 1.0, 0.0)
+
+    gt_keep = np.flatnonzero(gt_lens > 0)
+    pred_keep = np.flatnonzero(pred_lens > 0)
+    if len(gt_keep) == 0 or len(pred_keep) == 0:
         return distance_matrix
-    except ZeroDivisionError:
-        raise  
+
+    workers = -1 if len(gt_keep) * len(pred_keep) >= CDIST_PARALLEL_MIN_CELLS else 1
+    distances = cdist([gt_lines[i] for i in gt_keep], [matched_lines[j] for j in pred_keep],
+                      scorer=rf_Levenshtein.distance, dtype=np.int64, workers=workers)
+    distance_matrix[np.ix_(gt_keep, pred_keep)] = distances / max_lens[np.ix_(gt_keep, pred_keep)]
+    return distance_matrix
 
 
 ## 混合匹配here  0403
+@traced('get_gt_pred_lines')
 def get_gt_pred_lines(gt_mix,pred_dataset_mix,line_type):
 
     norm_html_lines,gt_lines,pred_lines,norm_gt_lines,norm_pred_lines,gt_cat_list = [],[],[],[],[],[]
@@ -158,6 +174,7 @@ def get_gt_pred_lines(gt_mix,pred_dataset_mix,line_type):
     return gt_lines_c, norm_gt_lines_c, gt_cat_list_c, pred_lines_c, norm_pred_lines_c, gt_mix, pred_dataset_mix
 
 
+@traced('match_gt2pred_simple')
 def match_gt2pred_simple(gt_items, pred_items, line_type, img_name):
 
     gt_lines, norm_gt_lines, gt_cat_list, pred_lines, norm_pred_lines, gt_items, pred_items = get_gt_pred_lines(gt_items, pred_items,line_type)
@@ -269,6 +286,7 @@ def match_gt2pred_simple(gt_items, pred_items, line_type, img_name):
     return match_list,None
 
 
+@traced('match_gt2pred_no_split')
 def match_gt2pred_no_split(gt_items, pred_items, line_type, img_name):
     # directly concatenate gt and pred by position
     gt_lines, norm_gt_lines, gt_cat_list, pred_lines, norm_pred_lines = get_gt_pred_lines(gt_items, pred_items)
@@ -0,0 +1,48 @@
+import os
+import json
+import pickle
+import hashlib
+import uuid
+
+# bump when extraction or matching changes the per-page match results
+MATCH_CACHE_VERSION = "2"
+
+
+class MatchCache:
+    """
+    On-disk cache of per-page match results (the outputs of End2EndDataset.process_get_matched_elements).
+
+    An entry is keyed by a hash of the GT page JSON, the prediction file content, the match method
+    and MATCH_CACHE_VERSION, so only the pages whose prediction changed are matched again.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, gt_page, pred_content, match_method):
+        content = '\n'.join([MATCH_CACHE_VERSION, match_method,
+                             json.dumps(gt_page, sort_keys=True, ensure_ascii=False), pred_content])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pkl')
+
+    def load(self, key):
+        """Return the cached match result, or None on a cache miss"""
+        try:
+            with open(self._entry_path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def save(self, key, result):
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a private temp name first so a concurrent run never reads a partial entry
+            tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:  # a full or read-only cache must not fail the evaluation
+            pass
@@ -4,6 +4,7 @@ import Levenshtein
 from collections import defaultdict
 import copy
 from utils.match import compute_edit_distance_matrix_new, get_gt_pred_lines, get_pred_category_type
+from utils.trace import traced
 import pdb
 import numpy as np
 import evaluate
@@ -262,7 +263,9 @@ def sort_by_position_skip_inline(items: List[Dict[str, Any]]) -> List[Dict[str,
             pair[0]                                                   # 原序号，确保稳定
         )
     )
-def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
+@traced('match_gt2pred_quick')
+def match_gt2pred_quick(gt_items, pred_items, line_type, img_name, match_stats=None):
+    # match_stats (dict), if given, gets 'budget_hit': True when the truncation merge search ran out of budget
 
     gt_items = split_gt_equation_arrays(gt_items)
     
@@ -499,7 +502,7 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
     # print("-------------cost matrix-------------")
     # print(cost_matrix)
 
-    matched_col_idx, row_ind, cost_list = cal_final_match(cost_matrix, no_ignores_gt_lines, no_ignores_pred_lines)
+    matched_col_idx, row_ind, cost_list = cal_final_match(cost_matrix, no_ignores_gt_lines, no_ignores_pred_lines, match_stats)
     # print("-------------matched_col_idx-------------")
     # print(matched_col_idx)
     
@@ -718,43 +721,87 @@ def merge_lists_with_sublists(main_list, sub_lists):
     return main_list_final   
 
 
+def semi_global_distances(pattern, text):
+    """
+    Semi-global (infix) alignment of pattern against text with Myers' bit-parallel algorithm, O(len(text))
+    big-int operations of len(pattern) bits. Returns dists where dists[j] is the smallest edit distance
+    between pattern and a substring of text ending at position j (exclusive end, 0 <= j <= len(text)).
+    """
+    m = len(pattern)
+    mask = (1 << m) - 1
+    high_bit = 1 << (m - 1)
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+
+    pv, mv, score = mask, 0, m
+    dists = [m]
+    for c in text:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high_bit:
+            score += 1
+        elif mh & high_bit:
+            score -= 1
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        dists.append(score)
+    return dists
+
+# patterns up to one machine word are compared by Levenshtein's own bit-parallel kernel at every offset
+SHORT_PATTERN_LEN = 64
+
+def best_window_distance(text, pattern):
+    """
+    Smallest Levenshtein distance between pattern and a window of text of the same length, and the first
+    offset reaching it; the same result as sliding the window over every offset.
+    For long patterns one semi-global alignment bounds every window from below (a window cannot beat the best
+    substring ending where it ends), so windows are checked from the lowest bound and the scan stops once no
+    bound can beat the best distance found.
+    """
+    m = len(pattern)
+    n_windows = len(text) - m + 1
+    if m <= SHORT_PATTERN_LEN or n_windows <= 8:
+        dists = [Levenshtein_distance(text[i:i + m], pattern) for i in range(n_windows)]
+        min_d = min(dists)
+        return min_d, dists.index(min_d)
+
+    end_dists = semi_global_distances(pattern, text)
+    bounds = sorted((end_dists[i + m], i) for i in range(n_windows))
+    min_d, pos = float('inf'), -1
+    for bound, i in bounds:
+        if bound > min_d:
+            break
+        dist = Levenshtein_distance(text[i:i + m], pattern)
+        if dist < min_d or (dist == min_d and i < pos):
+            min_d, pos = dist, i
+    return min_d, pos
+
 def sub_pred_fuzzy_matching(gt, pred):
-    
-    min_d = float('inf')
-    # pos = -1
 
     gt_len = len(gt)
     pred_len = len(pred)
 
     if gt_len >= pred_len and pred_len > 0:
-        for i in range(gt_len - pred_len + 1):
-            sub = gt[i:i + pred_len]
-            dist = Levenshtein_distance(sub, pred)/pred_len
-            if dist < min_d:
-                min_d = dist
-                pos = i
-
-        return min_d
+        min_d, pos = best_window_distance(gt, pred)
+        return min_d / pred_len
     else:
         return False
         
 def sub_gt_fuzzy_matching(pred, gt):  
     
-    min_d = float('inf')  
-    pos = ""  
-    matched_sub = ""  
     gt_len = len(gt)  
     pred_len = len(pred)  
     
     if pred_len >= gt_len and gt_len > 0:  
-        for i in range(pred_len - gt_len + 1):  
-            sub = pred[i:i + gt_len]  
-            dist = Levenshtein.distance(sub, gt)  /gt_len
-            if dist < min_d:  
-                min_d = dist  
-                pos = i  
-                matched_sub = sub  
-        return min_d, pos, gt_len, matched_sub  
+        min_d, pos = best_window_distance(pred, gt)
+        matched_sub = pred[pos:pos + gt_len]
+        return min_d / gt_len, pos, gt_len, matched_sub  
     else:  
         return 1, "", gt_len, "" 
         
@@ -857,7 +904,37 @@ def judge_pred_merge(gt_list, pred_list, threshold=0.6):
 
     return merged_pred_flag, continue_flag
     
-def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines):
+# Explicit budget of the truncation merge search: the number of span extensions tried on one page. It is shared
+# evenly, each unmatched gt line getting an equal part of what the previous lines left, and within a line each
+# start position an equal part of what the previous starts left (at least one extension), so that when the
+# budget runs short every span is cut alike instead of the last lines or starts of the page being skipped.
+# Every extension costs O(1) edit distances (the per-line fuzzy distances are memoized), so the search is
+# O(min(budget + #gt * #pred, #gt * #pred^2)) distance computations.
+MERGE_SEARCH_BUDGET = 20000
+
+def judge_span_merge(gt_line, span_lines, cur_dist, fuzzy_dists, threshold=0.6):
+    """
+    Same decision as judge_pred_merge for the span span_lines, reusing the distance of the span
+    without its last line (cur_dist) and the memoized sub_pred_fuzzy_matching distances of each line.
+    Returns merged_pred_flag, continue_flag and the distance of the whole span.
+    """
+    merged_pred = ' '.join(span_lines)
+    merged_dist = Levenshtein.distance(gt_line, merged_pred) / max(len(gt_line), len(merged_pred))
+    if merged_dist > cur_dist:
+        return False, False, merged_dist
+
+    for pred_line in span_lines[:-1]:
+        dist = fuzzy_dists(pred_line)
+        if dist is False or dist > threshold:
+            return False, False, merged_dist
+
+    add_fuzzy_dist = fuzzy_dists(span_lines[-1])
+    if add_fuzzy_dist is False:
+        return False, False, merged_dist
+
+    return add_fuzzy_dist < threshold, len(merged_pred) <= len(gt_line), merged_dist
+
+def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines, match_stats=None):
     matched_first = np.argwhere(cost_matrix < 0.25)
     masked_gt_idx = [i[0] for i in matched_first]
     unmasked_gt_idx = [i for i in range(cost_matrix.shape[0]) if i not in masked_gt_idx]
@@ -867,32 +944,52 @@ def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines):
     merges_gt_dict = {}
     merges_pred_dict = {}
     merged_gt_subsets = []
+    page_budget = MERGE_SEARCH_BUDGET
 
-    for gt_idx in unmasked_gt_idx:
+    for line_no, gt_idx in enumerate(unmasked_gt_idx):
+        line_budget = page_budget // (len(unmasked_gt_idx) - line_no)
+        line_spent = 0
         check_merge_subset = []
         merged_dist = []
-
-        for pred_idx in unmasked_pred_idx: 
+        gt_line = norm_gt_lines[gt_idx]
+        fuzzy_cache = {}
+        def fuzzy_dists(pred_line):
+            if pred_line not in fuzzy_cache:
+                fuzzy_cache[pred_line] = sub_pred_fuzzy_matching(gt_line, pred_line)
+            return fuzzy_cache[pred_line]
+
+        for start_no, pred_idx in enumerate(unmasked_pred_idx):
+            budget = max((line_budget - line_spent) // (len(unmasked_pred_idx) - start_no), 1)
             step = 1
             merged_pred = [norm_pred_lines[pred_idx]]
+            cur_dist = None
 
             while True:
                 if pred_idx + step in masked_pred_idx or pred_idx + step >= len(norm_pred_lines):
                     break
+                if budget <= 0:
+                    if match_stats is not None:
+                        match_stats['budget_hit'] = True
+                    break
+                budget -= 1
+                line_spent += 1
+                merged_pred.append(norm_pred_lines[pred_idx + step])
+                if cur_dist is None:
+                    cur_pred = merged_pred[0]
+                    cur_dist = Levenshtein.distance(gt_line, cur_pred) / max(len(gt_line), len(cur_pred))
+                merged_pred_flag, continue_flag, cur_dist = judge_span_merge(gt_line, merged_pred, cur_dist, fuzzy_dists)
+                if not merged_pred_flag:
+                    break
                 else:
-                    merged_pred.append(norm_pred_lines[pred_idx + step])
-                    merged_pred_flag, continue_flag = judge_pred_merge([norm_gt_lines[gt_idx]], merged_pred) 
-                    if not merged_pred_flag:
-                        break
-                    else:
-                        step += 1
-                    if not continue_flag:
-                        break
+                    step += 1
+                if not continue_flag:
+                    break
 
             check_merge_subset.append(list(range(pred_idx, pred_idx + step)))
             matched_line = ' '.join([norm_pred_lines[i] for i in range(pred_idx, pred_idx + step)])
-            dist = Levenshtein_distance(norm_gt_lines[gt_idx], matched_line) / max(len(matched_line), len(norm_gt_lines[gt_idx]))
+            dist = Levenshtein_distance(gt_line, matched_line) / max(len(matched_line), len(gt_line))
             merged_dist.append(dist)
+        page_budget -= line_spent
 
         if not merged_dist:
             subset_certain = []
@@ -935,10 +1032,10 @@ def cal_move_dist(gt, pred):
             pred[i], pred[pred.index(gt_c)] = pred[pred.index(gt_c)], pred[i]
     return step / len(gt)
 
-def cal_final_match(cost_matrix, norm_gt_lines, norm_pred_lines):
+def cal_final_match(cost_matrix, norm_gt_lines, norm_pred_lines, match_stats=None):
     # min_indice = cost_matrix.argmax(axis=1)
 
-    new_cost_matrix, final_norm_pred_lines, final_pred_idx_list = deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines)
+    new_cost_matrix, final_norm_pred_lines, final_pred_idx_list = deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines, match_stats)
 
     row_ind, col_ind = linear_sum_assignment(new_cost_matrix)
 
@@ -0,0 +1,89 @@
+import os
+import pickle
+import hashlib
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# bump when a memoized normalization function changes its output
+NORM_CACHE_VERSION = "1"
+
+
+class NormCache:
+    """
+    Memo of text/formula normalization results keyed by function name and input string.
+
+    Results computed inside persisting() (the GT normalizations) are kept for the whole run and can be
+    saved to / loaded from disk, so they are computed once per GT file. Other results live in a bounded LRU.
+    """
+    def __init__(self, max_entries=200000):
+        self.max_entries = max_entries
+        self.lru = OrderedDict()
+        self.persistent = {}
+        self.persist = False
+
+    def get(self, key):
+        if key in self.persistent:
+            return self.persistent[key]
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+        return None
+
+    def put(self, key, value):
+        if self.persist:
+            self.persistent[key] = value
+            return
+        self.lru[key] = value
+        if len(self.lru) > self.max_entries:
+            self.lru.popitem(last=False)
+
+    @contextmanager
+    def persisting(self):
+        self.persist = True
+        try:
+            yield self
+        finally:
+            self.persist = False
+
+    @staticmethod
+    def cache_path(cache_dir, gt_path):
+        """Cache file of a GT file version, identified by its name, size and modification time"""
+        stat = os.stat(gt_path)
+        version = '\n'.join([NORM_CACHE_VERSION, os.path.basename(gt_path), str(stat.st_size), str(stat.st_mtime_ns)])
+        return os.path.join(cache_dir, hashlib.sha256(version.encode('utf-8')).hexdigest() + '.pkl')
+
+    def load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                self.persistent.update(pickle.load(f))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+    def save(self, path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(self.persistent, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:  # a full or read-only cache must not fail the evaluation
+            pass
+
+
+norm_cache = NormCache()
+
+
+def memoized(func):
+    """Memoize a str -> str normalization function in norm_cache"""
+    @functools.wraps(func)
+    def wrapper(text):
+        if not isinstance(text, str):
+            return func(text)
+        key = (func.__name__, text)
+        result = norm_cache.get(key)
+        if result is None:
+            result = func(text)
+            norm_cache.put(key, result)
+        return result
+    return wrapper
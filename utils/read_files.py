@@ -1,3 +1,4 @@
+import os
 import json
 
 def read_md_file(filepath):
@@ -17,4 +18,65 @@ def save_paired_result(preds, gts, save_path):
         })
         formula_id += 1
     with open(save_path, 'w', encoding='utf-8') as f:
-        json.dump(save_result, f, indent=4, ensure_ascii=False)
\ No newline at end of file
+        json.dump(save_result, f, indent=4, ensure_ascii=False)
+
+def iter_json_array(filepath, chunk_size=1 << 20):
+    """Yield the elements of a top-level JSON array one by one, without loading the whole file"""
+    decoder = json.JSONDecoder()
+    with open(filepath, 'r', encoding='utf-8') as f:
+        buffer = ''
+        while not buffer:   # skip the leading whitespace, however many chunks it takes
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer = chunk.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f'{filepath} is not a JSON array')
+        pos = 1
+        eof = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if complete:
+                yield item
+                pos = end
+                continue
+            # the element continues past the buffer: drop what was consumed and read more
+            buffer = buffer[pos:]
+            pos = 0
+            chunk = f.read(max(chunk_size, len(buffer)))
+            eof = not chunk
+            buffer += chunk
+
+
+def page_selected(page, filtered_types):
+    """Whether a GT page matches all the page attributes in the filter config"""
+    if not filtered_types:
+        return True
+    return all(page["page_info"]["page_attribute"][k] == v for k, v in filtered_types.items())
+
+
+def read_gt_pages(gt_path, filtered_types=None, keep_pages=True):
+    """
+    Stream the GT json once, keeping the pages that match filtered_types and indexing the
+    page attributes of all pages by image name (without extension).
+    Returns (pages, page_info); pages is empty if keep_pages is False.
+    """
+    pages = []
+    page_info = {}
+    for page in iter_json_array(gt_path):
+        if 'page_info' in page and page['page_info'].get('image_path'):
+            img_name = os.path.basename(page['page_info']['image_path'])
+            page_info[img_name[:-4]] = page['page_info'].get('page_attribute')
+        if keep_pages and page_selected(page, filtered_types):
+            pages.append(page)
+    return pages, page_info
@@ -0,0 +1,113 @@
+import os
+import io
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# json keeps the indented files written so far; the jsonl formats write one compact record per line
+RESULT_FORMATS = {
+    'json': '.json',
+    'jsonl': '.jsonl',
+    'jsonl.gz': '.jsonl.gz',
+    'jsonl.zst': '.jsonl.zst',
+}
+
+
+def result_path(path, result_format='json'):
+    """File of a result saved in result_format, path without the extension"""
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f'Unknown result_format {result_format}, expected one of {list(RESULT_FORMATS)}')
+    return path + RESULT_FORMATS[result_format]
+
+
+def dump_line(record):
+    """A record as one compact UTF-8 json line"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) + b'\n'
+        except TypeError:   # e.g. integers beyond 64 bits, json handles them
+            pass
+    return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _open_binary(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('zstandard is not installed, it is needed for .zst results (pip install zstandard)')
+        if 'w' in mode:
+            return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'), closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, mode)
+
+
+def write_results(path, records, result_format='json', key_field=None):
+    """
+    Save the per-sample records under path (without the extension), return the written file.
+
+    records is an iterable of dicts, or a dict of dicts with key_field, whose keys are saved as the key_field of
+    each record in the jsonl formats. The jsonl formats stream the records, which are never held in one list.
+    """
+    path = result_path(path, result_format)
+    if result_format == 'json':
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(records if key_field else list(records), f, indent=4, ensure_ascii=False)
+        return path
+    if key_field:
+        records = ({key_field: key, **value} for key, value in records.items())
+    # the temp name keeps the extension, which selects the compression
+    tmp = os.path.join(os.path.dirname(path), f'.{os.getpid()}.{os.path.basename(path)}')
+    try:
+        with _open_binary(tmp, 'wb') as f:
+            for record in records:
+                f.write(dump_line(record))
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def find_result(path):
+    """The result file of path (without the extension) in whichever format it was saved, None if there is none"""
+    for extension in RESULT_FORMATS.values():
+        if os.path.exists(path + extension):
+            return path + extension
+    return None
+
+
+def iter_results(path, key_field=None):
+    """
+    Lazily read the records of a result file (.json, .jsonl, .jsonl.gz or .jsonl.zst), or of the result saved
+    under path without the extension. jsonl files are read line by line; a .json file has to be loaded whole.
+    A json dict of records (e.g. per_table_TEDS.json) yields each value with its key as key_field.
+    """
+    if not os.path.exists(path):
+        found = find_result(path)
+        if found is None:
+            raise FileNotFoundError(f'No result file for {path}')
+        path = found
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for key, value in data.items():
+                yield {key_field or 'key': key, **value} if isinstance(value, dict) else {key_field or 'key': key, 'value': value}
+        else:
+            yield from data
+        return
+    loads = orjson.loads if orjson is not None else json.loads
+    with _open_binary(path, 'rb') as f:
+        for line in io.BufferedReader(f) if path.endswith('.zst') else f:
+            if line.strip():
+                yield loads(line)
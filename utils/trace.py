@@ -0,0 +1,219 @@
+"""
+Named spans timing the stages of an evaluation, saved as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+with a summary of the time of each stage and of the slowest pages.
+
+Tracing is off unless enable() was called; span() and traced() then cost a single check. Worker processes,
+forked or spawned, inherit it through OMNIDOCBENCH_TRACE_DIR and append their spans to one file per process
+in that directory, which finish() merges with the spans of the main process.
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import functools
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+from tabulate import tabulate
+
+TRACE_DIR_ENV = 'OMNIDOCBENCH_TRACE_DIR'
+# upper bounds (ms) of the buckets of the stage duration histograms, the last bucket has no bound
+HISTOGRAM_BOUNDS_MS = [1, 10, 100, 1000, 10000]
+# a worker writes its spans when its outermost span ends or when it holds this many
+FLUSH_EVENTS = 1024
+
+_NO_SPAN = nullcontext()
+
+
+class Tracer:
+    def __init__(self, trace_dir, main=False):
+        self.trace_dir = trace_dir
+        self.main = main
+        self.pid = os.getpid()
+        self.events = []
+        self.local = threading.local()
+
+    def _stack(self):
+        """Pages of the open spans of this thread, None for a span outside any page"""
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name, args):
+        stack = self._stack()
+        # a span inside a page span belongs to that page
+        page = args.pop('page', None)
+        if page is None and stack:
+            page = stack[-1]
+        stack.append(page)
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter_ns() - start
+            stack.pop()
+            event = {'name': name, 'ph': 'X', 'ts': start / 1000, 'dur': duration / 1000,
+                     'pid': self.pid, 'tid': threading.get_native_id()}
+            if page is not None:
+                args = {**args, 'page': page}
+            if args:
+                event['args'] = args
+            self.events.append(event)
+            if not self.main and (not stack or len(self.events) >= FLUSH_EVENTS):
+                self.flush()
+
+    def flush(self):
+        """Append the spans of a worker process to its file"""
+        events, self.events = self.events, []
+        if not events:
+            return
+        with open(os.path.join(self.trace_dir, f'{self.pid}.jsonl'), 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+_tracer = Tracer(os.environ[TRACE_DIR_ENV]) if os.environ.get(TRACE_DIR_ENV) else None
+
+
+def _after_fork():
+    # a forked worker records its own spans, not the ones of the main process it was copied from
+    global _tracer
+    if _tracer is not None:
+        _tracer = Tracer(_tracer.trace_dir)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def enabled():
+    return _tracer is not None
+
+
+def enable():
+    """Start tracing this process and the worker processes it starts from now on"""
+    global _tracer
+    trace_dir = tempfile.mkdtemp(prefix='omnidocbench_trace_')
+    os.environ[TRACE_DIR_ENV] = trace_dir
+    _tracer = Tracer(trace_dir, main=True)
+
+
+def span(name, **args):
+    """
+    Context manager timing a stage under name. The args (json values) are shown with the span in the trace;
+    page=<image name> attributes the span and the spans inside it to a page.
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, args)
+
+
+def traced(name):
+    """Decorator timing every call of a function as a span named name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stage_summary(events):
+    """Count, total and percentiles (ms) and duration histogram of the spans of each stage, slowest first"""
+    durations = defaultdict(list)
+    processes = defaultdict(set)
+    for event in events:
+        durations[event['name']].append(event['dur'] / 1000)
+        processes[event['name']].add(event['pid'])
+    summary = {}
+    for name, values in durations.items():
+        values = np.array(values)
+        histogram = np.bincount(np.searchsorted(HISTOGRAM_BOUNDS_MS, values, side='right'),
+                                minlength=len(HISTOGRAM_BOUNDS_MS) + 1)
+        summary[name] = {
+            'count': len(values),
+            'processes': len(processes[name]),
+            'total_ms': float(values.sum()),
+            'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'max_ms': float(values.max()),
+            'histogram': histogram.tolist(),
+        }
+    return dict(sorted(summary.items(), key=lambda item: -item[1]['total_ms']))
+
+
+def page_summary(events, top=10):
+    """
+    The top slowest pages: the time of a page is the sum of its outermost spans (a span of the page not inside
+    another span of the same page), broken down by the names of these spans.
+    """
+    pages = defaultdict(lambda: defaultdict(float))
+    threads = defaultdict(list)
+    for event in events:
+        threads[(event['pid'], event['tid'])].append(event)
+    for thread_events in threads.values():
+        open_spans = []   # (end, page) of the spans enclosing the current one
+        for event in sorted(thread_events, key=lambda event: (event['ts'], -event['dur'])):
+            while open_spans and open_spans[-1][0] <= event['ts']:
+                open_spans.pop()
+            page = event.get('args', {}).get('page')
+            if page is not None and not any(open_page == page for _, open_page in open_spans):
+                pages[page][event['name']] += event['dur'] / 1000
+            open_spans.append((event['ts'] + event['dur'], page))
+    slowest = sorted(pages.items(), key=lambda item: -sum(item[1].values()))[:top]
+    return [{'page': page, 'total_ms': sum(stages.values()),
+             'stages': dict(sorted(stages.items(), key=lambda item: -item[1]))} for page, stages in slowest]
+
+
+def show_summary(stages, pages):
+    bucket_names = [f'<{bound}ms' for bound in HISTOGRAM_BOUNDS_MS] + [f'>={HISTOGRAM_BOUNDS_MS[-1]}ms']
+    rows = [[name, s['count'], s['processes'], f"{s['total_ms'] / 1000:.3f}", f"{s['mean_ms']:.2f}",
+             f"{s['p50_ms']:.2f}", f"{s['p95_ms']:.2f}", f"{s['max_ms']:.2f}"] + s['histogram']
+            for name, s in stages.items()]
+    print(tabulate(rows, headers=['stage', 'count', 'processes', 'total (s)', 'mean (ms)', 'p50 (ms)', 'p95 (ms)',
+                                  'max (ms)'] + bucket_names, disable_numparse=True))
+    if pages:
+        rows = [[page['page'], f"{page['total_ms']:.1f}",
+                 ', '.join(f'{name} {ms:.1f}' for name, ms in list(page['stages'].items())[:3])] for page in pages]
+        print(tabulate(rows, headers=['slowest pages', 'time (ms)', 'slowest stages (ms)'], disable_numparse=True))
+
+
+def finish(path, top_pages=10):
+    """Stop tracing, merge the spans of all processes into the Chrome trace file path and print the summary"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    os.environ.pop(TRACE_DIR_ENV, None)
+    if tracer is None:
+        return
+    events = tracer.events
+    for name in sorted(os.listdir(tracer.trace_dir)):
+        with open(os.path.join(tracer.trace_dir, name), 'r', encoding='utf-8') as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    shutil.rmtree(tracer.trace_dir, ignore_errors=True)
+
+    if events:
+        origin = min(event['ts'] for event in events)
+        for event in events:
+            event['ts'] -= origin
+    stages = stage_summary(events)
+    pages = page_summary(events, top_pages)
+    process_names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                      'args': {'name': 'main' if pid == tracer.pid else f'worker {pid}'}}
+                     for pid in sorted({event['pid'] for event in events})]
+    trace_dir = os.path.dirname(path)
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': process_names + events, 'displayTimeUnit': 'ms',
+                   'otherData': {'histogram_bounds_ms': HISTOGRAM_BOUNDS_MS, 'stages': stages, 'slowest_pages': pages}},
+                  f, ensure_ascii=False)
+    show_summary(stages, pages)
+    print(f'Trace of {len(events)} spans saved to {path}, open it in chrome://tracing or https://ui.perfetto.dev')